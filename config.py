@@ -14,6 +14,13 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 APP_KEY = os.getenv('DROPBOX_APP_KEY')
 APP_SECRET = os.getenv('DROPBOX_APP_SECRET')
 REFRESH_TOKEN = os.getenv('DROPBOX_REFRESH_TOKEN')
+# Каталог для архивов удаляемых по сроку хранения записей (если не задан — без архива)
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR')
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '200'))  # порог журнала медленных запросов
+# Приёмник HTTP-уведомлений ЮKassa (если порт не задан — не запускается)
+PAYMENT_WEBHOOK_PORT = int(os.getenv('PAYMENT_WEBHOOK_PORT', '0'))
+PAYMENT_WEBHOOK_HOST = os.getenv('PAYMENT_WEBHOOK_HOST', '0.0.0.0')
+PAYMENT_WEBHOOK_PATH = os.getenv('PAYMENT_WEBHOOK_PATH', '/yookassa/webhook')
 
 required = {
     "TELEGRAM_TOKEN": TOKEN,
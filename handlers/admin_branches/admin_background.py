@@ -1,8 +1,6 @@
 import os
 import re
-import tempfile
 
-from pathlib import Path
 from aiogram import Router, F
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import (
@@ -15,13 +13,13 @@ from aiogram.fsm.state import State, StatesGroup
 from typing import Sequence, List, cast
 
 from utils.utils import safe_answer_callback
-from utils.image_processing import add_number_overlay
+from utils.image_processing import cached_number_overlay, BACKGROUND_WATERMARK_TEXT
 from handlers.core.admin import START_TEXT, get_admin_menu_kb
-from utils.database.dropbox_storage import upload_file, delete_file
+from utils.database.dropbox_storage import delete_file, list_images_in_display_order
+from utils.media_ingest import ingest_media
 
 
 BACKGROUNDS_FOLDER = os.path.join("resources", "backgrounds")
-OUTPUT_FOLDER = os.path.join("resources", "output")
 
 
 router = Router()
@@ -112,17 +110,28 @@ async def admin_bg_finish_upload(call: CallbackQuery, state: FSMContext):
     idx = data['next_index']
     pending = data.get('pending_files', [])
 
-    for item in pending:
-        tg_file = await call.bot.get_file(item['file_id']) if call.bot else None
-        ext = '.jpg' if item['type'] == 'photo' else os.path.splitext(item.get('file_name', ''))[1] or '.png'
-        dest = os.path.join(folder, f"{idx}{ext}")
-        if call.bot and tg_file and getattr(tg_file, 'file_path', None) and isinstance(tg_file.file_path, (str, Path)):
-            await call.bot.download_file(tg_file.file_path, destination=dest)
-            # Загрузка в Dropbox
-            upload_file(dest, f"/resources/backgrounds/{idx}{ext}")
-        idx += 1
-
-    count = len(pending)
+    count = failed = 0
+    if pending and call.bot:
+        progress_msg = None
+        if call.message and isinstance(call.message, Message):
+            progress_msg = await call.message.answer(f"⏳ Загружаем фоны: 0/{len(pending)}")
+
+        async def report(done: int, total: int):
+            if progress_msg:
+                await progress_msg.edit_text(f"⏳ Загружаем фоны: {done}/{total}")
+
+        # Скачивание, выгрузка в Dropbox и превью — параллельно и вне event loop
+        stats = await ingest_media(
+            call.bot, pending, folder, "/resources/backgrounds", idx,
+            watermark_text=BACKGROUND_WATERMARK_TEXT, progress=report,
+        )
+        count, failed = stats['added'], stats['failed']
+        if progress_msg:
+            try:
+                await progress_msg.delete()
+            except TelegramBadRequest:
+                pass
+
     await state.clear()
     if call.message and isinstance(call.message, Message):
         try:
@@ -130,10 +139,11 @@ async def admin_bg_finish_upload(call: CallbackQuery, state: FSMContext):
         except Exception:
             pass
     if count:
+        text = f"🎉 Успешно добавлено {count} фонов." + (f"\n⚠️ Не удалось загрузить: {failed}." if failed else "")
         if call.message and isinstance(call.message, Message):
-            await call.message.answer(f"🎉 Успешно добавлено {count} фонов.")
+            await call.message.answer(text)
         elif call.bot:
-            await call.bot.send_message(call.from_user.id, f"🎉 Успешно добавлено {count} фонов.")
+            await call.bot.send_message(call.from_user.id, text)
         if call.bot:
             await call.bot.send_message(call.from_user.id, START_TEXT, reply_markup=get_admin_menu_kb())
     else:
@@ -159,15 +169,10 @@ async def admin_bg_delete(call: CallbackQuery, state: FSMContext):
             pass
 
     folder = BACKGROUNDS_FOLDER
-    files = []
-    for fname in os.listdir(folder):
-        if fname.lower().endswith((".jpg", ".png")):
-            m = re.match(r"^(\d+)", os.path.splitext(fname)[0])
-            if m:
-                files.append((int(m.group(1)), fname))
-    files.sort(key=lambda x: x[0])
-    filenames = [f for _, f in files]
-    next_idx = files[-1][0] + 1 if files else 1
+    # Тот же порядок, что видят пользователи: номера на превью совпадают с подготовленными при загрузке
+    filenames = list_images_in_display_order(folder)
+    nums = [int(m.group(1)) for f in filenames if (m := re.match(r"^(\d+)", f))]
+    next_idx = max(nums, default=0) + 1
 
     await state.update_data(folder=folder, files=filenames, next_index=next_idx)
     await _show_bg_images(call, state, page=0)
@@ -199,21 +204,18 @@ async def _show_bg_images(call: CallbackQuery, state: FSMContext, page: int, loa
     elif call.bot:
         loading = await call.bot.send_message(call.from_user.id, "⚙️ Загружаем фоны...")
 
-    with tempfile.TemporaryDirectory(dir=OUTPUT_FOLDER) as tmpdirname:
-        media: List[MediaUnion] = []
-        tmp_path = Path(tmpdirname)
-        for idx, fname in enumerate(files[start:end], start):
-            src = os.path.join(folder, fname)
-            tmp_file = tmp_path / f"bg_{idx}_{fname}"
-            add_number_overlay(str(src), str(tmp_file), number=idx + 1)
-            media.append(cast(MediaUnion, InputMediaPhoto(media=FSInputFile(str(tmp_file)))))
-
-        if call.message and isinstance(call.message, Message) and loading and hasattr(loading, 'answer_media_group'):
-            msgs = await loading.answer_media_group(media=media)
-        elif call.bot:
-            msgs = await call.bot.send_media_group(call.from_user.id, media=media)
-        else:
-            msgs = []
+    media: List[MediaUnion] = []
+    for idx, fname in enumerate(files[start:end], start):
+        src = os.path.join(folder, fname)
+        preview = cached_number_overlay(str(src), idx + 1)
+        media.append(cast(MediaUnion, InputMediaPhoto(media=FSInputFile(preview))))
+
+    if call.message and isinstance(call.message, Message) and loading and hasattr(loading, 'answer_media_group'):
+        msgs = await loading.answer_media_group(media=media)
+    elif call.bot:
+        msgs = await call.bot.send_media_group(call.from_user.id, media=media)
+    else:
+        msgs = []
 
     if call.bot and call.message and call.message.chat and loading and hasattr(loading, 'message_id'):
         await call.bot.delete_message(call.message.chat.id, loading.message_id)
@@ -1,8 +1,6 @@
 import os
 import re
 
-import config
-
 from aiogram import Router, F, Dispatcher
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import (
@@ -15,9 +13,10 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 from utils.utils import safe_answer_callback
-from utils.image_processing import add_number_overlay
 from handlers.core.admin import START_TEXT, get_admin_menu_kb
-from utils.database.dropbox_storage import upload_file, delete_file
+from utils.database.dropbox_storage import delete_file, list_images_in_display_order
+from utils.image_processing import cached_number_overlay, ALBUM_WATERMARK_TEXT
+from utils.media_ingest import ingest_media
 
 
 router = Router()
@@ -128,31 +127,31 @@ async def finish_upload(call: CallbackQuery, state: FSMContext):
     folder = data["img_folder"]
     idx = data["next_index"]
     pending = data.get("pending_files", [])
+    msg = getattr(call, 'message', None)
+    bot = getattr(call, 'bot', None)
 
-    for item in pending:
-        bot = getattr(call, 'bot', None)
-        if not bot:
-            continue
-        tg_file = await bot.get_file(item["file_id"])
-        if item["type"] == "photo":
-            ext = ".jpg"
-        else:
-            ext = os.path.splitext(item["file_name"])[1] or ".png"
-
-        fn = f"{idx}{ext}"
-        dest = os.path.join(folder, fn)
-        if not tg_file.file_path:
-            continue
-        await bot.download_file(tg_file.file_path, destination=dest)
+    count = 0
+    failed = 0
+    if pending and bot:
+        progress_msg = await msg.answer(f"⏳ Загружаем файлы: 0/{len(pending)}") if msg else None
 
-        # Синхронизация с Dropbox
-        upload_file(dest, f"/resources/images/{fn}")
+        async def report(done: int, total: int):
+            if progress_msg:
+                await progress_msg.edit_text(f"⏳ Загружаем файлы: {done}/{total}")
 
-        idx += 1
+        # Скачивание, выгрузка в Dropbox и превью — параллельно и вне event loop
+        stats = await ingest_media(
+            bot, pending, folder, "/resources/images", idx,
+            watermark_text=ALBUM_WATERMARK_TEXT, progress=report,
+        )
+        count, failed = stats["added"], stats["failed"]
+        if progress_msg:
+            try:
+                await progress_msg.delete()
+            except TelegramBadRequest:
+                pass
 
-    count = len(pending)
     await state.clear()
-    msg = getattr(call, 'message', None)
     if msg and getattr(msg, 'bot', None):
         await msg.bot.delete_message(msg.chat.id, msg.message_id)
     if count == 0:
@@ -164,6 +163,7 @@ async def finish_upload(call: CallbackQuery, state: FSMContext):
         if msg:
             await msg.answer(
                 text=f"🎉 Успешно добавлено {count} файлов."
+                + (f"\n⚠️ Не удалось загрузить: {failed}." if failed else "")
             )
 
     if msg:
@@ -183,12 +183,8 @@ async def admin_images_delete(call: CallbackQuery, state: FSMContext):
     msg = getattr(call, 'message', None)
     if msg and getattr(msg, 'bot', None):
         await msg.bot.delete_message(msg.chat.id, msg.message_id)
-    # Получаем список файлов из папки и сортируем по номеру в имени
-    def extract_num(fname):
-        m = re.match(r"(\d+)", fname)
-        return int(m.group(1)) if m else float('inf')
-    files = [f for f in os.listdir(IMAGES_FOLDER) if os.path.isfile(os.path.join(IMAGES_FOLDER, f)) and f.lower().endswith((".jpg", ".png"))]
-    files.sort(key=extract_num)
+    # Тот же порядок, что видят пользователи: номера на превью совпадают с подготовленными при загрузке
+    files = list_images_in_display_order(IMAGES_FOLDER)
     if not files:
         if call.message:
             await call.message.answer("В папке нет изображений для удаления.")
@@ -227,9 +223,8 @@ async def show_admin_images(call: CallbackQuery, state: FSMContext, page: int, l
     media = []
     for idx, fname in enumerate(files[start:end], start):
         src = os.path.join(folder, fname)
-        tmp = os.path.join(config.Output_Folder, f"adm_img_{idx}_{fname}")
-        add_number_overlay(str(src), str(tmp), number=idx + 1)
-        media.append(InputMediaPhoto(media=FSInputFile(tmp)))
+        preview = cached_number_overlay(str(src), idx + 1)
+        media.append(InputMediaPhoto(media=FSInputFile(preview)))
     if msg:
         msgs = await msg.answer_media_group(media)
         bot = getattr(msg, 'bot', None)
@@ -4,6 +4,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
 from datetime import datetime, timezone, timedelta
+from typing import Optional
 import re
 import json
 import asyncio
@@ -13,11 +14,11 @@ from utils.utils import safe_answer_callback
 from utils.database.db import (
     create_notification, 
     get_all_users, 
-    get_active_users_count,
     get_notifications_history,
     mark_notification_sent,
-    get_users_count
 )
+from utils.user_stats import user_stats
+from utils.notification_sender import wake_notification_scheduler
 
 router = Router()
 
@@ -912,8 +913,11 @@ async def confirm_send_notification(call: CallbackQuery, state: FSMContext):
         )
         
         if notification_id:
+            # Немедленная рассылка начнётся сразу, запланированная — точно в срок
+            wake_notification_scheduler()
+
             # Получаем статистику пользователей
-            total_users = await get_users_count(active_only=False)
+            total_users = (await user_stats.snapshot())["total"]
             
             # Рассчитываем статистику батчей
             batch_size = 30
@@ -928,7 +932,7 @@ async def confirm_send_notification(call: CallbackQuery, state: FSMContext):
                 f"📦 Батчей для отправки: {total_batches}\n"
                 f"⏱️ Примерное время: ~{estimated_time:.1f} сек\n"
                 f"⚡ Скорость: ~{batch_size/0.1:.0f} сообщений/сек\n"
-                f"📅 Точность времени: ±1 минута (умная проверка)"
+                f"📅 Отправка точно в запланированное время"
             )
             
             if scheduled_at:
@@ -978,8 +982,9 @@ async def show_users_stats(call: CallbackQuery, state: FSMContext):
     await safe_answer_callback(call, state)
     
     try:
-        total_users = await get_users_count(active_only=False)
-        active_users = await get_active_users_count()
+        stats = await user_stats.snapshot()
+        total_users = stats["total"]
+        active_users = stats["active"]
         
         # Рассчитываем статистику рассылки
         batch_size = 30
@@ -992,6 +997,7 @@ async def show_users_stats(call: CallbackQuery, state: FSMContext):
             f"📊 <b>Статистика пользователей:</b>\n\n"
             f"👥 Всего пользователей: {total_users}\n"
             f"🟢 Активных (30 дней): {active_users}\n"
+            f"🆕 Новых сегодня: {stats['new_today']}\n"
             f"📈 Активность: {(active_users/total_users*100):.1f}%" if total_users > 0 else "📈 Активность: 0%\n\n"
             f"🚀 <b>Система рассылки:</b>\n"
             f"📦 Размер батча: {batch_size} пользователей\n"
@@ -1015,22 +1021,45 @@ async def show_users_stats(call: CallbackQuery, state: FSMContext):
         await call.answer("❌ Ошибка при получении статистики", show_alert=True)
 
 
-@router.callback_query(F.data == "admin_notifications_history")
+# Фильтры истории по типу вложения: callback_data "admin_notifications_history:<тип>"
+HISTORY_MEDIA_FILTERS = {"photo": "📷 Фото", "video": "🎥 Видео", "document": "📄 Документы"}
+
+
+def get_history_filters_kb(media_type: Optional[str]) -> InlineKeyboardMarkup:
+    filters = [(None, "Все")] + list(HISTORY_MEDIA_FILTERS.items())
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text=f"• {label}" if key == media_type else label,
+                callback_data="admin_notifications_history" + (f":{key}" if key else "")
+            )
+            for key, label in filters
+        ],
+        [InlineKeyboardButton(text="⏎ Назад", callback_data="admin_notifications")]
+    ])
+
+
+@router.callback_query(F.data.startswith("admin_notifications_history"))
 async def show_notifications_history(call: CallbackQuery, state: FSMContext):
-    """Показывает историю уведомлений."""
+    """Показывает историю уведомлений, при выборе фильтра — только с вложениями этого типа."""
     if call.from_user.id not in ADMIN_IDS:
         await call.answer("❌ Нет доступа", show_alert=True)
         return
     
     await safe_answer_callback(call, state)
     
+    media_type = (call.data or "").partition(":")[2] or None
+    if media_type not in HISTORY_MEDIA_FILTERS:
+        media_type = None
+    
     try:
-        notifications = await get_notifications_history(limit=10)
+        notifications = await get_notifications_history(limit=10, media_type=media_type)
         
         if not notifications:
-            history_text = "📋 История уведомлений пуста"
+            history_text = "📋 Уведомлений с таким вложением нет" if media_type else "📋 История уведомлений пуста"
         else:
-            history_text = "📋 <b>Последние уведомления:</b>\n\n"
+            title = f"Последние уведомления ({HISTORY_MEDIA_FILTERS[media_type]})" if media_type else "Последние уведомления"
+            history_text = f"📋 <b>{title}:</b>\n\n"
             for notif in notifications:
                 status = "✅ Отправлено" if notif["is_sent"] else "⏳ Ожидает"
                 created = notif["created_at"].strftime("%d.%m %H:%M")
@@ -1038,20 +1067,22 @@ async def show_notifications_history(call: CallbackQuery, state: FSMContext):
                 history_text += f"📝 {notif['text'][:50]}{'...' if len(notif['text']) > 50 else ''}\n\n"
         
         if isinstance(call.message, Message):
-            await call.message.edit_text(
-                history_text,
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="⏎ Назад", callback_data="admin_notifications")]
-                ])
-            )
+            try:
+                await call.message.edit_text(
+                    history_text,
+                    parse_mode="HTML",
+                    reply_markup=get_history_filters_kb(media_type)
+                )
+            except Exception as e:
+                # Повторное нажатие на уже выбранный фильтр
+                if "message is not modified" not in str(e):
+                    raise
     
     except Exception as e:
         logger.error(f"Ошибка при получении истории: {e}")
         await call.answer("❌ Ошибка при получении истории", show_alert=True)
 
 
-
 def register_notifications_handlers(dp):
     """Регистрирует обработчики уведомлений."""
     dp.include_router(router) 
\ No newline at end of file
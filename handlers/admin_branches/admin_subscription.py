@@ -174,7 +174,9 @@ async def admin_sub_confirm(call: CallbackQuery, state: FSMContext):
         # Обнуляем бесплатные сообщения, если это психолог
         if subscription_type == "psychologist":
             from utils.database.db import set_free_count
+            from utils.quota import quota
             await set_free_count(user_id, 0)
+            quota.forget(user_id)
         result_text = f"🎉 Подписка «{sub_name}» выдана пользователю ID {user_id} до {expires.strftime('%Y-%m-%d')}."
     else:
         await delete_subscription(user_id, type=subscription_type)
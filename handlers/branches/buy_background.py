@@ -15,9 +15,10 @@ from pathlib import Path
 import config
 
 from utils.utils import push_state, safe_answer_callback
-from utils.payments.payment_functional import create_payment, check_payment_status
+from utils.payments.payment_functional import get_or_create_payment, check_payment_status, PaymentGatewayError
 from handlers.core.start import START_TEXT, get_main_menu_kb
-from utils.image_processing import add_watermark, add_number_overlay
+from utils.database.dropbox_storage import list_images_in_display_order
+from utils.image_processing import add_watermark, add_number_overlay, cached_watermark
 from config import logger
 
 
@@ -53,10 +54,7 @@ async def choose_background(call: CallbackQuery, state: FSMContext):
     await safe_answer_callback(call, state)
     await push_state(state, UserBackgroundStates.menu)
 
-    files = sorted(
-        f for f in os.listdir(Path("resources/backgrounds"))
-        if f.lower().endswith((".jpg", ".png"))
-    )
+    files = list_images_in_display_order(str(Path("resources/backgrounds")))
     if not files:
         return await call.answer("❌ Нет доступных фонов", show_alert=True)
 
@@ -94,11 +92,11 @@ async def show_backgrounds_album(call: CallbackQuery, state: FSMContext, loading
         media = []
         for idx, filename in enumerate(page_files, start=1):
             src = os.path.join(data['image_folder'], filename)
-            wm_path = tmp_path / f"wm_{page}_{idx}_{filename}"
             num_path = tmp_path / f"num_{page}_{idx}_{filename}"
 
-            add_watermark(str(src), str(wm_path))
-            add_number_overlay(str(wm_path), str(num_path), number=idx)
+            # Водяной знак строится один раз на файл (или заранее, при загрузке из админки)
+            wm_path = cached_watermark(str(src))
+            add_number_overlay(wm_path, str(num_path), number=idx)
 
             media.append(InputMediaPhoto(media=FSInputFile(str(num_path))))
 
@@ -188,37 +186,73 @@ async def select_background(call: CallbackQuery, state: FSMContext):
     src_path = os.path.join(data['image_folder'], bg_filename)
     display_index = bg_index + 1
 
-    user_id = call.from_user.id
-    payment_url, payment_id = await create_payment(
-        user_id,
-        100,
-        f"Покупка фона #{display_index}"
-    )
-    await state.update_data(paying_bg=bg_index, payment_id=payment_id)
+    # Платёж создаётся только по нажатию «Оплатить фон» (bg_pay_)
+    await state.update_data(paying_bg=bg_index, payment_id=None)
     await push_state(state, UserBackgroundStates.browsing)
 
     with tempfile.TemporaryDirectory(dir=config.Output_Folder) as tmpdir:
         wm_path = Path(tmpdir) / f"wm_preview_{bg_filename}"
         add_watermark(src_path, str(wm_path))
 
-
-        kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="💳 Оплатить фон", url=payment_url)],
-            [InlineKeyboardButton(text="📬 Получить фон", callback_data=f'backgrounds_check_{payment_id}_{bg_index}')],
-            [InlineKeyboardButton(text="⏎ Назад", callback_data='bg_go_back')]
-        ])
         await call.message.answer_photo(
             photo=FSInputFile(str(wm_path)),
             caption=(
                 f"👆 Фон #{display_index}\n\n"
                 "Оплатите фон — после подтверждения оплаты он сразу станет вам доступен."
             ),
-            reply_markup=kb
+            reply_markup=get_background_payment_kb(bg_index)
         )
 
     await state.set_state(UserBackgroundStates.waiting_payment)
 
 
+def get_background_payment_kb(bg_index: int, payment_url: str | None = None,
+                              payment_id: str | None = None) -> InlineKeyboardMarkup:
+    """Клавиатура оплаты фона: до создания платежа — кнопка «Оплатить», после — ссылка и проверка."""
+    if payment_url and payment_id:
+        pay_rows = [
+            [InlineKeyboardButton(text="💳 Оплатить фон", url=payment_url)],
+            [InlineKeyboardButton(text="📬 Получить фон", callback_data=f'backgrounds_check_{payment_id}_{bg_index}')],
+        ]
+    else:
+        pay_rows = [[InlineKeyboardButton(text="💳 Оплатить фон", callback_data=f'bg_pay_{bg_index}')]]
+    return InlineKeyboardMarkup(inline_keyboard=pay_rows + [
+        [InlineKeyboardButton(text="⏎ Назад", callback_data='bg_go_back')]
+    ])
+
+
+@router.callback_query(UserBackgroundStates.waiting_payment, F.data.startswith('bg_pay_'))
+async def bg_pay(call: CallbackQuery, state: FSMContext):
+    """Создаёт (или переиспользует) платёж за выбранный фон и показывает ссылку на оплату."""
+    await safe_answer_callback(call, state)
+    data = await state.get_data()
+    bg_index = int(call.data.split('_')[-1])
+    bg_filename = data['image_files'][bg_index]
+    user_id = call.from_user.id
+
+    try:
+        payment_url, payment_id = await get_or_create_payment(
+            user_id,
+            f"background:{bg_filename}",
+            100,
+            f"Покупка фона #{bg_index + 1}"
+        )
+    except PaymentGatewayError as e:
+        logger.error(f"Не удалось создать платёж за фон для пользователя {user_id}: {e}")
+        payment_url = payment_id = None
+    if not payment_url:
+        await call.message.answer("❌ Не удалось создать платёж, попробуйте ещё раз.")
+        return
+
+    await state.update_data(payment_id=payment_id)
+    try:
+        await call.message.edit_reply_markup(
+            reply_markup=get_background_payment_kb(bg_index, payment_url, payment_id)
+        )
+    except TelegramBadRequest:
+        pass
+
+
 # ——————————————————————
 # Проверка оплаты и отправка фона
 # ——————————————————————
@@ -10,9 +10,9 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InputMediaPhoto
 
 from utils.utils import safe_answer_callback
-from utils.database.db import list_fonts
+from utils.database.catalogue import catalogue
 from handlers.core.start import START_TEXT, get_main_menu_kb
-from utils.payments.payment_functional import create_payment, check_payment_status
+from utils.payments.payment_functional import get_or_create_payment, check_payment_status, PaymentGatewayError
 from config import logger
 
 
@@ -45,16 +45,16 @@ async def purchase_fonts_menu(call: CallbackQuery, state: FSMContext):
 @router.callback_query(UserFontsStates.menu, F.data == "fonts_browse")
 async def fonts_browse(call: CallbackQuery, state: FSMContext):
     """
-    Загружает список доступных шрифтов и показывает первый превью.
-    Сохраняет список в state.
+    Показывает первый превью из каталога шрифтов.
+    В state хранится только индекс, сами шрифты берутся из кэша каталога.
     """
     await safe_answer_callback(call, state)
     loading = await call.message.answer("⚙️ Загружаем шрифты…")
-    fonts = await list_fonts()
+    fonts = await catalogue.fonts()
     if not fonts:
         return await call.answer("❌ Пока нет доступных шрифтов", show_alert=True)
 
-    await state.update_data(font_index=0, fonts=fonts)
+    await state.update_data(font_index=0)
     await _show_font_for_purchase(call, state, edit=True)
     await loading.delete()
     await state.set_state(UserFontsStates.browsing)
@@ -63,10 +63,14 @@ async def fonts_browse(call: CallbackQuery, state: FSMContext):
 async def _show_font_for_purchase(call: CallbackQuery, state: FSMContext, edit: bool):
     """Отображает превью шрифта для покупки, редактируя сообщение при edit=True или отправляя новое при edit=False."""
     data = await state.get_data()
-    font = data['fonts'][data['font_index']]
+    fonts = await catalogue.fonts()
+    if not fonts:
+        return
+    idx = data.get('font_index', 0) % len(fonts)
+    font = fonts[idx]
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="←", callback_data="_fonts_prev"),
-         InlineKeyboardButton(text=f"{data['font_index']+1}/{len(data['fonts'])}", callback_data="noop"),
+         InlineKeyboardButton(text=f"{idx+1}/{len(fonts)}", callback_data="noop"),
          InlineKeyboardButton(text="→", callback_data="_fonts_next")],
         [InlineKeyboardButton(text="💳 Приобрести", callback_data=f"fonts_pay_{font['id']}")],
         [InlineKeyboardButton(text="🏠 Вернуться в главное меню", callback_data="go_back_user_font")]
@@ -100,7 +104,7 @@ async def _show_font_for_purchase(call: CallbackQuery, state: FSMContext, edit:
 async def fonts_prev(call: CallbackQuery, state: FSMContext):
     """Показывает предыдущий шрифт в режиме просмотра."""
     data = await state.get_data()
-    idx = (data['font_index'] - 1) % len(data['fonts'])
+    idx = data.get('font_index', 0) - 1
     await state.update_data(font_index=idx)
     await _show_font_for_purchase(call, state, edit=True)
 
@@ -109,7 +113,7 @@ async def fonts_prev(call: CallbackQuery, state: FSMContext):
 async def fonts_next(call: CallbackQuery, state: FSMContext):
     """Показывает следующий шрифт в режиме просмотра."""
     data = await state.get_data()
-    idx = (data['font_index'] + 1) % len(data['fonts'])
+    idx = data.get('font_index', 0) + 1
     await state.update_data(font_index=idx)
     await _show_font_for_purchase(call, state, edit=True)
 
@@ -132,8 +136,7 @@ async def fonts_pay(call: CallbackQuery, state: FSMContext):
     font_id = int(call.data.split('_')[-1])
     user_id = call.from_user.id
 
-    fonts = await list_fonts()
-    font = next((f for f in fonts if f['id'] == font_id), None)
+    font = await catalogue.font(font_id)
     if not font:
         await call.message.answer("❗️ Шрифт не найден.")
         logger.warning(f"Пользователь {user_id} попытался купить несуществующий шрифт {font_id}")
@@ -141,18 +144,9 @@ async def fonts_pay(call: CallbackQuery, state: FSMContext):
 
     font_name = font['name']
 
-    payment_url, payment_id = await create_payment(
-        user_id,
-        1000,
-        f"Покупка шрифта #{font_id}"
-    )
-    await state.update_data(paying_font=font_id, payment_id=payment_id)
-
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="💳 Оплатить шрифт", url=payment_url)],
-        [InlineKeyboardButton(text="📬 Получить шрифт", callback_data=f"fonts_check_{payment_id}_{font_id}")],
-        [InlineKeyboardButton(text="⏎ Назад", callback_data="go_back_user_font")],
-    ])
+    # Платёж создаётся только по нажатию «Оплатить шрифт» (fonts_link_)
+    await state.update_data(paying_font=font_id, payment_id=None)
+    kb = get_font_payment_kb(font_id)
 
     # Показываем фото выбранного шрифта перед кнопками оплаты
     try:
@@ -169,6 +163,49 @@ async def fonts_pay(call: CallbackQuery, state: FSMContext):
     await state.set_state(UserFontsStates.waiting_payment)
 
 
+def get_font_payment_kb(font_id: int, payment_url: str | None = None,
+                        payment_id: str | None = None) -> InlineKeyboardMarkup:
+    """Клавиатура оплаты шрифта: до создания платежа — кнопка «Оплатить», после — ссылка и проверка."""
+    if payment_url and payment_id:
+        pay_rows = [
+            [InlineKeyboardButton(text="💳 Оплатить шрифт", url=payment_url)],
+            [InlineKeyboardButton(text="📬 Получить шрифт", callback_data=f"fonts_check_{payment_id}_{font_id}")],
+        ]
+    else:
+        pay_rows = [[InlineKeyboardButton(text="💳 Оплатить шрифт", callback_data=f"fonts_link_{font_id}")]]
+    return InlineKeyboardMarkup(inline_keyboard=pay_rows + [
+        [InlineKeyboardButton(text="⏎ Назад", callback_data="go_back_user_font")],
+    ])
+
+
+@router.callback_query(UserFontsStates.waiting_payment, F.data.startswith('fonts_link_'))
+async def fonts_link(call: CallbackQuery, state: FSMContext):
+    """Создаёт (или переиспользует) платёж за выбранный шрифт и показывает ссылку на оплату."""
+    await safe_answer_callback(call, state)
+    font_id = int(call.data.split('_')[-1])
+    user_id = call.from_user.id
+
+    try:
+        payment_url, payment_id = await get_or_create_payment(
+            user_id,
+            f"font:{font_id}",
+            1000,
+            f"Покупка шрифта #{font_id}"
+        )
+    except PaymentGatewayError as e:
+        logger.error(f"Не удалось создать платёж за шрифт для пользователя {user_id}: {e}")
+        payment_url = payment_id = None
+    if not payment_url:
+        await call.message.answer("❌ Не удалось создать платёж, попробуйте ещё раз.")
+        return
+
+    await state.update_data(payment_id=payment_id)
+    try:
+        await call.message.edit_reply_markup(reply_markup=get_font_payment_kb(font_id, payment_url, payment_id))
+    except TelegramBadRequest:
+        pass
+
+
 # ——————————————————————
 # Проверка оплаты и выдача шрифта
 # ——————————————————————
@@ -192,8 +229,7 @@ async def fonts_check(call: CallbackQuery, state: FSMContext):
         )
         return
 
-    fonts = await list_fonts()
-    font = next((f for f in fonts if f['id'] == int(font_id)), None)
+    font = await catalogue.font(int(font_id))
 
     kb = InlineKeyboardMarkup(inline_keyboard=[[
         InlineKeyboardButton(text="🏠 Вернуться в главное меню", callback_data="user_back_to_main")
@@ -251,11 +287,11 @@ async def go_back_fonts(call: CallbackQuery, state: FSMContext):
         except TelegramBadRequest:
             pass
         loading = await call.message.answer("⚙️ Загружаем шрифты…")
-        fonts = await list_fonts()
+        fonts = await catalogue.fonts()
         if not fonts:
             await loading.edit_text("❌ Пока нет доступных шрифтов")
             return
-        await state.update_data(font_index=0, fonts=fonts)
+        await state.update_data(font_index=0)
         await _show_font_for_purchase(call, state, edit=False)
         await loading.delete()
         await state.set_state(UserFontsStates.browsing)
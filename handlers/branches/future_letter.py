@@ -1,8 +1,6 @@
-import asyncio
 from datetime import datetime, timedelta, timezone
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from aiogram import Router, F, Bot, Dispatcher
+from aiogram import Router, F, Dispatcher
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     CallbackQuery, Message
@@ -15,19 +13,13 @@ from handlers.core.start import START_TEXT, get_main_menu_kb
 from handlers.core.subscription import is_subscribed
 from utils.utils import safe_answer_callback
 from utils.payments.payment_functional import create_payment, check_payment_status
-from utils.database.db import (
-    upsert_future_letter,
-    fetch_due_letters,
-    fetch_all_unsent_letters,
-    mark_letter_sent,
-    count_free_letters_in_month
-)
+from utils.database.db import upsert_future_letter
+from utils.quota import quota
 from utils.utils import safe_edit_text
-from config import logger, ADMIN_IDS
+from config import logger
 
 
 router = Router()
-scheduler = AsyncIOScheduler()
 
 
 class FutureLetterStates(StatesGroup):
@@ -180,7 +172,7 @@ async def input_future_letter(message: Message, state: FSMContext):
 # ——————————————————————
 @router.callback_query(F.data.in_({'in_month', 'in_year'}))
 async def choose_interval(call: CallbackQuery, state: FSMContext):
-    """Сохраняет интервал отправки и запускает оплату. Также планирует задачу отправки письма через APScheduler."""
+    """Сохраняет интервал отправки и запускает оплату (подписчику — бесплатное письмо месяца)."""
     user_id = call.from_user.id
     data = await state.get_data()
     draft = data.get('user_text', '') or ""
@@ -189,16 +181,10 @@ async def choose_interval(call: CallbackQuery, state: FSMContext):
     send_at = now + timedelta(days=delay_days)
 
     if await is_subscribed(user_id):
-        used = await count_free_letters_in_month(user_id, now)
-        if used < 1:
-            letter_id = await upsert_future_letter(user_id, draft, send_at, is_free=True)
-            if call.bot:
-                scheduler.add_job(
-                    send_and_mark_letter,
-                    trigger='date',
-                    run_date=send_at,
-                    args=[call.bot, user_id, f"📨 Ваше письмо из прошлого:\n\n{draft}", letter_id]
-                )
+        # Бесплатное письмо месяца: списание квоты и сохранение письма — один запрос
+        letter_id = await quota.create_free_letter(user_id, draft, send_at)
+        if letter_id is not None:
+            # Письмо доставит utils.letter_delivery, когда наступит send_after
             formatted_date = send_at.strftime("%d.%m.%Y")
             await safe_answer_callback(call, state)
             if isinstance(call.message, Message):
@@ -229,7 +215,7 @@ async def check_future_letter(call: CallbackQuery, state: FSMContext):
     status = await check_payment_status(pid)
     user_id = call.from_user.id
 
-    if not pid or await check_payment_status(pid) != 'succeeded':
+    if status != 'succeeded':
         await call.answer(text='❌ Платёж не подтверждён', show_alert=True)
         logger.warning(
             f"Платёж {pid} пользователя {user_id} для письма в будущее не подтверждён "
@@ -240,15 +226,7 @@ async def check_future_letter(call: CallbackQuery, state: FSMContext):
 
     draft = data.get('user_text', '') or ""
     send_at = datetime.fromisoformat(data['send_at'])
-    letter_id = await upsert_future_letter(call.from_user.id, draft, send_at)
-
-    if call.bot:
-        scheduler.add_job(
-            send_and_mark_letter,
-            trigger='date',
-            run_date=send_at,
-            args=[call.bot, call.from_user.id, f"📨 Ваше письмо из прошлого:\n\n{draft}", letter_id]
-        )
+    await upsert_future_letter(call.from_user.id, draft, send_at)
 
     formatted_date = send_at.strftime("%d.%m.%Y")
     await safe_answer_callback(call, state)
@@ -300,130 +278,9 @@ async def go_back_to_menu(call: CallbackQuery, state: FSMContext):
         await call.message.answer(text=START_TEXT, reply_markup=get_main_menu_kb())
 
 
-# ——————————————————————
-# Доставка писем
-# ——————————————————————
-async def deliver_future_letters(bot: Bot):
-    """
-    Периодически проверяет БД на неотправленные письма
-    и отправляет их пользователям.
-    """
-    letters = await fetch_due_letters()
-    for l in letters:
-        for attempt in (1, 2):
-            try:
-                created_at = l.get('created_at')
-                if isinstance(created_at, str):
-                    created_at = datetime.fromisoformat(created_at)
-                if created_at is not None:
-                    ts = created_at.strftime("%d.%m.%Y %H:%M")
-                else:
-                    ts = ""
-                text = (
-                    f"📨 Ваше письмо, составленное {ts}:\n\n"
-                    f"{l['content']}"
-                )
-                await bot.send_message(l['user_id'], text)
-                await mark_letter_sent(l['id'])
-                break
-            except TelegramBadRequest as e:
-                if attempt == 1:
-                    await asyncio.sleep(5)
-                else:
-                    logger.exception(f"Не удалось отправить письмо id={l['id']} после 2 попыток", exc_info=e)
-                    try:
-                        chat = await bot.get_chat(l['user_id'])
-                        username = chat.username or f"{chat.first_name or ''} {chat.last_name or ''}".strip()
-                    except TelegramBadRequest:
-                        username = None
-                    admin_text = (
-                        f"❗ Не удалось доставить письмо пользователю {l['user_id']}"
-                        f" (@{username})" if username else '' + f":\n\n{l['content']}"
-                    )
-                    # ADMIN_IDS может быть списком, отправляем каждому админу
-                    if isinstance(ADMIN_IDS, (list, tuple)):
-                        for admin_id in ADMIN_IDS:
-                            try:
-                                await bot.send_message(admin_id, admin_text)
-                            except TelegramBadRequest:
-                                logger.exception("Не удалось уведомить админа о неотправленном письме")
-                    else:
-                        try:
-                            await bot.send_message(ADMIN_IDS, admin_text)
-                        except TelegramBadRequest:
-                            logger.exception("Не удалось уведомить админа о неотправленном письме")
-
-
-async def reschedule_pending(bot: Bot):
-    """
-    При старте приложения вновь планирует все письма,
-    которые ещё не были отправлены.
-    """
-    pending = await fetch_all_unsent_letters()
-    now = datetime.now(timezone.utc)
-    for l in pending:
-        raw_send = l.get('send_at')
-        if not raw_send:
-            # logger.warning(f"reschedule_pending: письмо id={l.get('id')} без send_at, пропускаем"
-            #                f"текст письма: \"{l.get('content', '').replace(chr(10), ' ')}\""
-            #                )
-            continue
-        run_dt = (datetime.fromisoformat(raw_send)
-                  if isinstance(raw_send, str) else raw_send)
-        if run_dt and run_dt.tzinfo is None:
-            run_dt = run_dt.replace(tzinfo=timezone.utc)
-        if run_dt and run_dt <= now:
-            created_raw = l.get('created_at')
-            created_at = (datetime.fromisoformat(created_raw)
-                            if isinstance(created_raw, str) else created_raw)
-            if created_at and created_at.tzinfo is None:
-                created_at = created_at.replace(tzinfo=timezone.utc)
-            if created_at:
-                ts = created_at.strftime("%d.%m.%Y %H:%M")
-            else:
-                ts = ""
-            text = f"📨 Ваше письмо, составленное {ts}:\n\n{l['content']}"
-            try:
-                await bot.send_message(l['user_id'], text)
-                await mark_letter_sent(l['id'])
-            except TelegramBadRequest as e:
-                logger.exception(f"Ошибка при немедленной отправке письма id={l['id']}", exc_info=e)
-            continue
-        content = l['content']
-        if run_dt:
-            scheduler.add_job(
-                send_and_mark_letter,
-                trigger='date',
-                run_date=run_dt,
-                args=[bot, l['user_id'], f"📨 Ваше письмо, из прошлого:\n\n{content}", l['id']]
-            )
-
-
-def setup_future_letter_scheduler(bot: Bot):
-    """
-    Настраивает APScheduler:
-    - ежедневная проверка unsent писем в 12:00 UTC
-    - планирование уже имеющихся писем.
-    """
-    scheduler.add_job(
-        deliver_future_letters,
-        'cron',
-        hour=12,
-        minute=0,
-        args=[bot]
-    )
-    scheduler.start()
-    asyncio.get_event_loop().create_task(reschedule_pending(bot))
-
-
 # ——————————————————————
 # Регистрация роутера
 # ——————————————————————
 def register_future_letter(dp: Dispatcher):
     dp.include_router(router)
 
-
-# --- Новый вспомогательный метод ---
-async def send_and_mark_letter(bot, user_id, text, letter_id):
-    await bot.send_message(user_id, text)
-    await mark_letter_sent(letter_id)
@@ -13,9 +13,12 @@ from PIL import Image
 import config
 
 from config import logger
-from utils.database.db import list_fonts, list_colors
-from utils.image_processing import add_watermark, add_text_to_image, add_number_overlay
-from utils.payments.payment_functional import create_payment, check_payment_status
+from utils.database.catalogue import catalogue
+from utils.database.dropbox_storage import list_images_in_display_order
+from utils.image_processing import (
+    add_watermark, add_text_to_image, add_number_overlay, cached_watermark, ALBUM_WATERMARK_TEXT
+)
+from utils.payments.payment_functional import get_or_create_payment, check_payment_status, PaymentGatewayError
 from utils.utils import safe_edit_text, safe_edit_media, push_state, validate_text, safe_answer_callback
 from handlers.core.start import START_TEXT, get_main_menu_kb
 from handlers.core.subscription import is_subscribed
@@ -160,7 +163,7 @@ async def choose_image(call: CallbackQuery, state: FSMContext):
     
     # Используем папку resources/images напрямую
     folder = data.get('image_folder', 'resources/images')
-    files = sorted(f for f in os.listdir(folder) if f.lower().endswith(('.jpg', '.png')))
+    files = list_images_in_display_order(folder)
     await state.update_data(image_files=files, image_folder=folder)
     await show_images_album(call, state, page=0)
 
@@ -213,11 +216,8 @@ async def show_images_album(call: CallbackQuery, state: FSMContext, page: int =
         if await is_subscribed(user_id):
             add_number_overlay(str(src), numbered_path, number=i + 1)
         else:
-            wm_path = os.path.join(
-                config.Output_Folder,
-                f'scroll_watermarked_{os.path.basename(src)}'
-            )
-            add_watermark(src, wm_path, watermark_text='Создано в Добрые Открыточки<3')
+            # Водяной знак строится один раз на файл (или заранее, при загрузке из админки)
+            wm_path = cached_watermark(src, ALBUM_WATERMARK_TEXT)
             add_number_overlay(wm_path, numbered_path, number=i + 1)
         media.append(InputMediaPhoto(media=FSInputFile(numbered_path)))
 
@@ -307,7 +307,7 @@ async def choose_font(call: CallbackQuery, state: FSMContext, edit=False):
     """Отображает образцы шрифтов и навигацию по ним"""
     await push_state(state, ImageMaker.choosing_font)
     data = await state.get_data()
-    fonts = await list_fonts()
+    fonts = await catalogue.fonts()
     if not fonts:
         await call.answer("❌ База шрифтов пуста", show_alert=True)
         return
@@ -347,7 +347,7 @@ async def choose_font(call: CallbackQuery, state: FSMContext, edit=False):
 async def prev_font(call: CallbackQuery, state: FSMContext):
     """Переходит к предыдущему образцу шрифта"""
     data = await state.get_data()
-    fonts = await list_fonts()
+    fonts = await catalogue.fonts()
     idx = (data.get('font_index', 0) - 1) % len(fonts)
     await state.update_data(font_index=idx)
     await choose_font(call, state, edit=True)
@@ -357,7 +357,7 @@ async def prev_font(call: CallbackQuery, state: FSMContext):
 async def next_font(call: CallbackQuery, state: FSMContext):
     """Переходит к следующему образцу шрифта"""
     data = await state.get_data()
-    fonts = await list_fonts()
+    fonts = await catalogue.fonts()
     idx = (data.get('font_index', 0) + 1) % len(fonts)
     await state.update_data(font_index=idx)
     await choose_font(call, state, edit=True)
@@ -369,8 +369,7 @@ async def select_font(call: CallbackQuery, state: FSMContext):
     if not call.data:
         return
     font_id = int(call.data.split('_')[-1])
-    fonts = await list_fonts()
-    selected = next((f for f in fonts if f['id'] == font_id), None)
+    selected = await catalogue.font(font_id)
     if not selected:
         await call.answer("❌ Шрифт не найден", show_alert=True)
         return
@@ -398,7 +397,7 @@ async def choose_color(call: CallbackQuery, state: FSMContext, edit: bool = Fals
     """Отображает образцы цветов и навигацию по ним"""
     await push_state(state, ImageMaker.choosing_color)
     data = await state.get_data()
-    colors = await list_colors()
+    colors = await catalogue.colors()
     if not colors:
         await call.answer("❌ База цветов пуста", show_alert=True)
         return
@@ -444,7 +443,7 @@ async def choose_color(call: CallbackQuery, state: FSMContext, edit: bool = Fals
 async def prev_color(call: CallbackQuery, state: FSMContext):
     """Переключается на предыдущий образец цвета"""
     data = await state.get_data()
-    colors = await list_colors()
+    colors = await catalogue.colors()
     idx = (data.get('color_index', 0) - 1) % len(colors)
     await state.update_data(color_index=idx)
     await choose_color(call, state, edit=True)
@@ -454,7 +453,7 @@ async def prev_color(call: CallbackQuery, state: FSMContext):
 async def next_color(call: CallbackQuery, state: FSMContext):
     """Переключается на следующий образец цвета"""
     data = await state.get_data()
-    colors = await list_colors()
+    colors = await catalogue.colors()
     idx = (data.get('color_index', 0) + 1) % len(colors)
     await state.update_data(color_index=idx)
     await choose_color(call, state, edit=True)
@@ -466,8 +465,7 @@ async def select_color(call: CallbackQuery, state: FSMContext):
     if not call.data:
         return
     color_id = int(call.data.split('_')[-1])
-    colors = await list_colors()
-    selected = next((c for c in colors if c['id'] == color_id), None)
+    selected = await catalogue.color(color_id)
     if not selected:
         await call.answer("❌ Цвет не найден", show_alert=True)
         return
@@ -593,27 +591,57 @@ async def send_image_preview(message: Message, state: FSMContext, size_correctio
     preview_path = os.path.join(config.Output_Folder, f"preview_{filename}")
     add_watermark(final_path, preview_path, watermark_text='Создано в Добрые Открыточки<3')
 
-    if not is_resizing and message.from_user:
-        url, pid = await create_payment(message.from_user.id, 100, 'Оплата за открытку')
-        await state.update_data(payment_url=url, payment_id=pid)
+    if not is_resizing:
+        # Платёж создаётся только по нажатию «Оплатить открытку» (card_pay)
+        await state.update_data(payment_url=None, payment_id=None)
 
     await state.update_data(preview_path=preview_path, final_path=final_path, size_correction=size_correction)
 
     data = await state.get_data()
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text='🛒 Оплатить открытку', url=data['payment_url'])],
-        [InlineKeyboardButton(text='💌 Получить открытку', callback_data=f'check_payment:{data['payment_id']}')],
+    await message.answer_photo(photo=FSInputFile(preview_path), caption='📦 Предварительный просмотр',
+                               reply_markup=get_preview_kb(data))
+    try:
+        await indicator.delete()
+    except TelegramBadRequest:
+        pass
+
+
+def get_preview_kb(data: dict) -> InlineKeyboardMarkup:
+    """Клавиатура превью: до создания платежа — кнопка «Оплатить», после — ссылка и проверка оплаты."""
+    if data.get('payment_url') and data.get('payment_id'):
+        pay_rows = [
+            [InlineKeyboardButton(text='🛒 Оплатить открытку', url=data['payment_url'])],
+            [InlineKeyboardButton(text='💌 Получить открытку', callback_data=f"check_payment:{data['payment_id']}")],
+        ]
+    else:
+        pay_rows = [[InlineKeyboardButton(text='🛒 Оплатить открытку', callback_data='card_pay')]]
+    return InlineKeyboardMarkup(inline_keyboard=pay_rows + [
         [InlineKeyboardButton(text='Текст меньше', callback_data='resize_minus'),
          InlineKeyboardButton(text='Текст больше', callback_data='resize_plus')],
         [InlineKeyboardButton(text='⏎ Назад', callback_data='go_back')]
     ])
 
-    await message.answer_photo(photo=FSInputFile(preview_path), caption='📦 Предварительный просмотр',
-                               reply_markup=keyboard)
+
+@router.callback_query(F.data == 'card_pay')
+async def card_pay(call: CallbackQuery, state: FSMContext):
+    """Создаёт (или переиспользует) платёж за открытку и показывает ссылку на оплату."""
+    await safe_answer_callback(call, state)
     try:
-        await indicator.delete()
-    except TelegramBadRequest:
-        pass
+        url, pid = await get_or_create_payment(call.from_user.id, 'card', 100, 'Оплата за открытку')
+    except PaymentGatewayError as e:
+        logger.error(f"Не удалось создать платёж за открытку для пользователя {call.from_user.id}: {e}")
+        url = pid = None
+    if not url:
+        if isinstance(call.message, Message):
+            await call.message.answer('❌ Не удалось создать платёж, попробуйте ещё раз.')
+        return
+    await state.update_data(payment_url=url, payment_id=pid)
+    data = await state.get_data()
+    if isinstance(call.message, Message):
+        try:
+            await call.message.edit_reply_markup(reply_markup=get_preview_kb(data))
+        except TelegramBadRequest:
+            pass
 
 
 # ——————————————————————
@@ -681,7 +709,7 @@ async def check_payment_callback(call: CallbackQuery, state: FSMContext):
     user_id = call.from_user.id
 
     status = await check_payment_status(pid)
-    if await check_payment_status(pid) == 'succeeded':
+    if status == 'succeeded':
         data = await state.get_data()
         final_path = data.get('final_path') or data.get('preview_path')
         if not final_path:
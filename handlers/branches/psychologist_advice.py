@@ -2,13 +2,16 @@ from aiogram import Router, types, F, Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 from datetime import datetime, timezone
-from utils.chatgpt.gpt import get_psychologist_response, get_psychologist_context, save_message, get_message_count, clear_history, get_last_user_message_time, save_summary_if_needed
-from handlers.core.subscription import is_subscribed
-import asyncio
+from utils.chatgpt.gpt import get_psychologist_response, get_psychologist_context, save_message, get_message_count, clear_history, get_last_user_message_time
+from utils.chatgpt.summary_worker import schedule_summary
 import random
 import time
 from utils.session_timer import start_session_timer, cancel_session_timer
-from utils.database.db import get_free_count, increment_free_count, reset_free_count, set_free_count, fetch_subscription, get_summary
+from utils.database.db import reset_free_count, set_free_count, fetch_subscription, get_summary, fetch_psychologist_access
+from utils.database.unit_of_work import UnitOfWork
+from utils.unit_of_work_middleware import UNIT_OF_WORK_FLAG
+from utils.quota import quota
+from utils.task_supervisor import supervisor
 import re
 from config import logger
 
@@ -39,6 +42,10 @@ THANK_YOU = [
 ]
 
 
+# Фоновые задачи психолога: сохранение истории и генерация приветствия (вызов модели)
+supervisor.register_class("psychologist_save", max_concurrency=10, max_pending=2000)
+supervisor.register_class("psychologist_greeting", max_concurrency=5, max_pending=200)
+
 SUBSCRIPTION_PRICE = 990
 FREE_MESSAGES = 3
 SESSION_TIMEOUT = 600
@@ -142,10 +149,10 @@ async def psychologist_advice_start(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
     # --- Проверка лимита бесплатных сообщений ДО генерации приветствия ---
-    subscribed = await is_subscribed(user_id, 'psychologist')
+    access = await fetch_psychologist_access(user_id)
+    subscribed = bool(access["expires_at"] and access["expires_at"] > datetime.now(timezone.utc))
     if not subscribed:
-        free_count = await get_free_count(user_id)
-        if free_count >= FREE_MESSAGES:
+        if access["free_count"] >= FREE_MESSAGES:
             if call.message and isinstance(call.message, Message):
                 await call.message.edit_text(
                     "Ваши бесплатные сообщения с ботом закончились.\n\nОформите подписку, чтобы продолжить получать поддержку.",
@@ -227,8 +234,8 @@ async def psychologist_advice_start(call: CallbackQuery, state: FSMContext):
         except Exception as e:
             logger.error(f"Ошибка в фоновом обновлении приветствия для {user_id}: {e}")
     
-    # Запускаем обновление приветствия в фоне
-    asyncio.create_task(update_greeting_in_background())
+    # Запускаем обновление приветствия в фоне (при перегрузке остаётся стандартное приветствие)
+    supervisor.spawn("psychologist_greeting", update_greeting_in_background)
     await call.answer()
     return
 
@@ -271,8 +278,8 @@ async def start_psychologist(message: types.Message, state: FSMContext):
         # Сохраняем ID сообщения с кнопкой для последующего удаления
         await state.update_data(last_menu_message_id=questions_msg.message_id)
 
-@router.message()
-async def handle_psychologist_message(message: types.Message, state: FSMContext):
+@router.message(flags={UNIT_OF_WORK_FLAG: True})
+async def handle_psychologist_message(message: types.Message, state: FSMContext, uow: UnitOfWork):
     if not message or not message.text:
         return
     data = await state.get_data()
@@ -355,10 +362,18 @@ async def handle_psychologist_message(message: types.Message, state: FSMContext)
             await state.update_data(continue_session_message_id=None)
     
     # --- Проверка лимита бесплатных сообщений ДО сообщения ожидания ---
-    subscribed = await is_subscribed(user_id, 'psychologist')
+    # Подписка и счётчик бесплатных сообщений — одним запросом
+    access = await fetch_psychologist_access(user_id)
+    subscribed = bool(access["expires_at"] and access["expires_at"] > datetime.now(timezone.utc))
+    consumed_free = False
     if not subscribed:
-        free_count = await get_free_count(user_id)
-        if free_count >= FREE_MESSAGES:
+        if data.get("psychologist_stage") == "dialog":
+            # В диалоге бесплатное сообщение списывается сразу и атомарно — параллельные сообщения не превысят лимит
+            consumed_free = await quota.consume_free_message(user_id, FREE_MESSAGES)
+            allowed = consumed_free
+        else:
+            allowed = access["free_count"] < FREE_MESSAGES
+        if not allowed:
             await message.answer(
                 "Ваши бесплатные сообщения с ботом-психологом закончились.\n\nОформите подписку, чтобы продолжить получать поддержку.",
                 reply_markup=subscribe_kb()
@@ -369,7 +384,13 @@ async def handle_psychologist_message(message: types.Message, state: FSMContext)
     
     # --- Сообщение ожидания отправляем только если лимит не превышен ---
     wait_text = random.choice(THANK_YOU)
-    wait_msg = await message.answer(wait_text, reply_markup=None)
+    try:
+        wait_msg = await message.answer(wait_text, reply_markup=None)
+    except Exception:
+        if consumed_free:
+            # Сообщение ожидания не ушло — обработки не будет, возвращаем списанное бесплатное сообщение
+            await quota.refund_free_message(user_id)
+        raise
 
     # Первый этап — ответы на вопросы
     if data.get("psychologist_stage") == "questions":
@@ -381,6 +402,8 @@ async def handle_psychologist_message(message: types.Message, state: FSMContext)
             await state.update_data(session_start=now)
             
             context = await get_psychologist_context(user_id)
+            # Не держим соединение из пула, пока ждём ответа модели
+            await uow.release()
             response = await get_psychologist_response(context, message.text or "")
             
             # Проверяем, что ответ не пустой
@@ -414,7 +437,7 @@ async def handle_psychologist_message(message: types.Message, state: FSMContext)
                     # logger.info(f"[PERF] Начинаем фоновое сохранение для пользователя {user_id}")
                     
                     # Сохраняем оба сообщения одной транзакцией
-                    from utils.database.db import save_user_and_bot_messages
+                    from utils.chatgpt.gpt import save_user_and_bot_messages
                     await save_user_and_bot_messages(user_id, message.text, response or "")
                     
                     bg_time = time.time() - bg_start
@@ -426,11 +449,13 @@ async def handle_psychologist_message(message: types.Message, state: FSMContext)
                 except Exception as e:
                     logger.error(f"Ошибка в фоновом сохранении для пользователя {user_id}: {e}")
             
-            # Запускаем сохранение в фоне
-            asyncio.create_task(background_save())
+            # Запускаем сохранение в фоне; если очередь переполнена — сохраняем сразу
+            if supervisor.spawn("psychologist_save", background_save) is None:
+                await background_save()
         return
     # Диалог с психологом
     if data.get("psychologist_stage") == "dialog":
+        delivered = False
         try:
             dialog_start = time.time()
             # logger.info(f"[PERF] Начинаем обработку диалога для пользователя {user_id}")
@@ -439,6 +464,8 @@ async def handle_psychologist_message(message: types.Message, state: FSMContext)
             await state.update_data(session_start=now)
             
             context = await get_psychologist_context(user_id)
+            # Не держим соединение из пула, пока ждём ответа модели
+            await uow.release()
             response = await get_psychologist_response(context, message.text or "")
             
             # Проверяем, что ответ не пустой
@@ -461,6 +488,7 @@ async def handle_psychologist_message(message: types.Message, state: FSMContext)
                 pass
             # Ответ бота без кнопки
             await message.answer(response, reply_markup=None, parse_mode='HTML')
+            delivered = True
             # Следующее сообщение с кнопкой и сохранение его ID
             menu_msg = await message.answer("Если потребуется — вы всегда можете вернуться в главное меню.", reply_markup=main_menu_kb())
             await state.update_data(last_menu_message_id=menu_msg.message_id)
@@ -471,25 +499,16 @@ async def handle_psychologist_message(message: types.Message, state: FSMContext)
                     bg_start = time.time()
                     # logger.info(f"[PERF] Начинаем фоновые БД операции для пользователя {user_id}")
                     
-                    # Увеличиваем счетчик бесплатных сообщений только для неподписанных пользователей
-                    if not subscribed:
-                        count_start = time.time()
-                        await increment_free_count(user_id)
-                        count_time = time.time() - count_start
-                        # logger.info(f"[PERF] Увеличение счетчика заняло: {count_time:.3f}s")
-                    
-                    # Сохраняем оба сообщения одной транзакцией
-                    from utils.database.db import save_user_and_bot_messages
+                    from utils.chatgpt.gpt import save_user_and_bot_messages
+                    # Бесплатное сообщение уже списано до запроса к модели
                     save_both_start = time.time()
-                    await save_user_and_bot_messages(user_id, message.text or "", response or "")
+                    msg_count = await save_user_and_bot_messages(user_id, message.text or "", response or "")
                     save_both_time = time.time() - save_both_start
                     # logger.info(f"[PERF] Сохранение обоих сообщений в одной транзакции заняло: {save_both_time:.3f}s")
                     
-                    # Проверяем и создаем резюме если нужно
-                    summary_start = time.time()
-                    await save_summary_if_needed(user_id, THRESHOLD)
-                    summary_time = time.time() - summary_start
-                    # logger.info(f"[PERF] Проверка/сохранение резюме заняло: {summary_time:.3f}s")
+                    # Резюме создается в фоне, когда пользователь сделает паузу в переписке
+                    if msg_count > THRESHOLD:
+                        schedule_summary(user_id, THRESHOLD)
                     
                     bg_total_time = time.time() - bg_start
                     # logger.info(f"[PERF] Фоновые БД операции для пользователя {user_id} завершены за: {bg_total_time:.3f}s")
@@ -500,10 +519,20 @@ async def handle_psychologist_message(message: types.Message, state: FSMContext)
                 except Exception as e:
                     logger.error(f"Ошибка в фоновых БД операциях для пользователя {user_id}: {e}")
             
-            # Запускаем БД операции в фоне, не ожидая их завершения
-            asyncio.create_task(background_db_operations())
+            # Запускаем БД операции в фоне, не ожидая их завершения; если очередь переполнена — выполняем сразу
+            if supervisor.spawn("psychologist_save", background_db_operations) is None:
+                await background_db_operations()
         except Exception as e:
             logger.error(f"Ошибка при обработке сообщения пользователя {user_id}: {e}")
+            if delivered:
+                # Ответ уже у пользователя: сообщение засчитано, сообщать об ошибке незачем
+                return
+            if consumed_free:
+                # Ответа не было — возвращаем списанное бесплатное сообщение
+                try:
+                    await quota.refund_free_message(user_id)
+                except Exception as refund_error:
+                    logger.error(f"Не удалось вернуть бесплатное сообщение пользователю {user_id}: {refund_error}")
             try:
                 await wait_msg.delete()
             except Exception:
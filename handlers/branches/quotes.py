@@ -1,14 +1,15 @@
 import re, json
 
-from datetime import date
+from datetime import date, datetime, timezone
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, Message
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
 
-from utils.database.db import fetch_daily_quote, upsert_daily_quote
+from utils.database.db import fetch_daily_quote_with_subscription, upsert_daily_quote
+from utils.database.unit_of_work import UnitOfWork
+from utils.unit_of_work_middleware import UNIT_OF_WORK_FLAG
 from utils.chatgpt.gpt import generate_daily_quote_model
-from handlers.core.subscription import is_subscribed
 from handlers.core.start import START_TEXT, get_main_menu_kb
 from config import SUPPORT_URL, logger
 from utils.utils import safe_answer_callback
@@ -58,8 +59,8 @@ async def format_quote_message(quote: str, source: str | None) -> tuple[str, dic
 # ——————————————————————
 # Основной обработчик «Цитата дня»
 # ——————————————————————
-@router.callback_query(F.data == "quote_of_day")
-async def quote_of_day_handler(call: CallbackQuery, state: FSMContext):
+@router.callback_query(F.data == "quote_of_day", flags={UNIT_OF_WORK_FLAG: True})
+async def quote_of_day_handler(call: CallbackQuery, state: FSMContext, uow: UnitOfWork):
     """
     Получает «Цитату дня» для пользователя:
     — если уже сохранена, выводит её;
@@ -81,7 +82,8 @@ async def quote_of_day_handler(call: CallbackQuery, state: FSMContext):
         await safe_answer_callback(call, state)
         return
 
-    existing = await fetch_daily_quote(user_id, today)
+    # Сохранённая цитата и подписка — одним запросом
+    existing, expires_at = await fetch_daily_quote_with_subscription(user_id, today)
     if existing:
         quote, source = existing
         text, extra = await format_quote_message(quote, source)
@@ -90,7 +92,7 @@ async def quote_of_day_handler(call: CallbackQuery, state: FSMContext):
         await safe_answer_callback(call, state)
         return
 
-    if not await is_subscribed(user_id):
+    if not (expires_at and expires_at > datetime.now(timezone.utc)):
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Что за подписка?", callback_data="subscription")],
             [InlineKeyboardButton(text="🏠 Вернуться в главное меню", callback_data="main_menu_edit_quote")]
@@ -108,6 +110,8 @@ async def quote_of_day_handler(call: CallbackQuery, state: FSMContext):
     if isinstance(call.message, Message):
         await safe_edit_message(call.message, "⏳ Генерируем цитату дня...")
     
+    # Не держим соединение из пула, пока ждём ответа модели
+    await uow.release()
     try:
         raw = await generate_daily_quote_model()
         if isinstance(raw, str):
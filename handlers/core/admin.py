@@ -1,3 +1,7 @@
+import asyncio
+import html
+import time
+
 from aiogram import Router, Dispatcher, types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
@@ -6,10 +10,31 @@ from aiogram.filters import Command
 from utils.utils import safe_answer_callback
 from config import ADMIN_IDS, logger
 from utils.database.dropbox_storage import sync_resources_hash
+from utils.readiness import readiness, STAGE_RESOURCES
+from utils.database.catalogue import catalogue
+from utils.database.profiler import profiler
+from utils.task_supervisor import supervisor
 
 
 router = Router()
 
+TELEGRAM_MESSAGE_LIMIT = 4096
+DBSTATS_MAX_TOP = 40  # строк в /dbstats; больше не помещается в одно сообщение
+
+
+def _pre_message(header: str, lines: list) -> str:
+    """
+    Сообщение «заголовок + <pre>строки</pre>» в пределах лимита Telegram.
+    Лишние строки отбрасываются до обёртки в <pre>, чтобы HTML оставался корректным.
+    """
+    lines = list(lines)
+    while True:
+        body = html.escape("\n".join(lines))
+        text = f"{header}\n<pre>{body}</pre>"
+        if len(text) <= TELEGRAM_MESSAGE_LIMIT or not lines:
+            return text
+        lines = lines[:-2] + ["…"] if len(lines) > 1 else []
+
 
 START_TEXT = (
     "🔧 Пункт администрирования:"
@@ -60,6 +85,74 @@ async def cmd_admin(message: types.Message, state: FSMContext):
     await message.answer(START_TEXT, reply_markup=get_admin_menu_kb())
 
 
+@router.message(Command("dbstats"))
+async def cmd_dbstats(message: types.Message):
+    """Показывает статистику запросов к БД: /dbstats [N] — топ-N функций по суммарному времени, /dbstats reset — сброс."""
+    if not message.from_user or message.from_user.id not in ADMIN_IDS:
+        return await message.answer("❌ У вас нет доступа к админ-панели.")
+
+    arg = (message.text or "").split(maxsplit=1)[1:]
+    if arg and arg[0].strip() == "reset":
+        profiler.reset()
+        return await message.answer("🔄 Статистика запросов к БД сброшена.")
+    top = min(int(arg[0]) if arg and arg[0].strip().isdigit() else 15, DBSTATS_MAX_TOP)
+
+    rows = profiler.snapshot(top=top)
+    if not rows:
+        return await message.answer("📭 Запросов к БД пока не было.")
+
+    lines = [
+        f"{'функция':<32} {'вызовы':>7} {'ср,мс':>7} {'p95':>6} {'макс':>7} {'строк':>6} {'пул,мс':>6}"
+    ]
+    for row in rows:
+        lines.append(
+            f"{row['name'][:32]:<32} {row['calls']:>7} {row['avg_ms']:>7.1f} {row['p95_ms']:>6.0f} "
+            f"{row['max_ms']:>7.0f} {row['avg_rows']:>6.1f} {row['avg_pool_wait_ms']:>6.1f}"
+        )
+        if row['errors']:
+            lines.append(f"  ↳ ошибок: {row['errors']}")
+
+    uptime_min = int((time.time() - profiler.started_at) // 60)
+    header = (
+        f"📈 Запросы к БД за {uptime_min} мин "
+        f"(медленных SQL > {profiler.slow_query_seconds * 1000:.0f} мс: {profiler.slow_queries})"
+    )
+    await message.answer(_pre_message(header, lines), parse_mode="HTML")
+
+
+@router.message(Command("tasks"))
+async def cmd_tasks(message: types.Message):
+    """Показывает состояние фоновых циклов, классов задач и очередей."""
+    if not message.from_user or message.from_user.id not in ADMIN_IDS:
+        return await message.answer("❌ У вас нет доступа к админ-панели.")
+
+    stats = supervisor.stats()
+    lines = ["Циклы:"]
+    for name, loop in stats["loops"].items():
+        state = "✅" if loop["alive"] else "☑️" if loop["finished"] else "❌"
+        lines.append(f"{state} {name}: {loop['uptime']:.0f} с, перезапусков {loop['restarts']}")
+        if loop["last_error"]:
+            lines.append(f"   ↳ {loop['last_error'][:200]}")
+    lines.append("\nЗадачи:")
+    for name, c in stats["classes"].items():
+        lines.append(
+            f"{name}: выполняется {c['running']}, ждёт {c['pending']}, готово {c['completed']}, "
+            f"ошибок {c['failed']}, отброшено {c['dropped']}, ср. {c['avg_runtime']} с, макс. {c['max_runtime']} с"
+        )
+    if stats["queues"]:
+        lines.append("\nОчереди:")
+        for name, size in stats["queues"].items():
+            lines.append(f"{name}: {size}")
+    ready = readiness.snapshot()
+    lines.append("\nГотовность:")
+    for stage, seconds in ready["ready"].items():
+        lines.append(f"✅ {stage}: через {seconds} с после запуска")
+    for stage, error in ready["errors"].items():
+        lines.append(f"❌ {stage}: {error[:200]}")
+    lines.append(f"локальная копия resources: {'есть' if ready['resources_snapshot'] else 'нет'}")
+    await message.answer(_pre_message("⚙️ Фоновые задачи", lines), parse_mode="HTML")
+
+
 @router.callback_query(F.data == "admin_back")
 async def admin_back(call: CallbackQuery, state: FSMContext):
     """Возвращает пользователя в главное меню администрирования."""
@@ -92,8 +185,17 @@ async def admin_sync(call: CallbackQuery, state: FSMContext):
     except Exception:
         msg = await msg.answer("⏳ Импорт данных из Dropbox...")
     try:
-        sync_resources_hash()
-        result_text = "✅ Импорт завершён! Локальные ресурсы приведены к виду Dropbox."
+        # Полная сверка в отдельном потоке: обработчики других пользователей не блокируются
+        stats = await asyncio.to_thread(sync_resources_hash, True)
+        if stats['error']:
+            raise RuntimeError(f"Dropbox недоступен: {stats['error']}")
+        catalogue.invalidate()
+        readiness.mark_ready(STAGE_RESOURCES)
+        result_text = (
+            "✅ Импорт завершён! Локальные ресурсы приведены к виду Dropbox.\n"
+            f"Скачано: {stats['downloaded']}, перемещено: {stats['moved']}, без изменений: {stats['skipped']}, "
+            f"удалено: {stats['deleted']}, ошибок: {stats['failed']} ({stats['seconds']} с)"
+        )
     except Exception as e:
         result_text = f"❌ Ошибка импорта: {str(e)}"
     # После завершения снова редактируем (или отправляем новое)
@@ -266,7 +266,9 @@ async def process_payment_check(call: CallbackQuery, state: FSMContext, subscrip
         # Сбрасываем счетчик бесплатных сообщений при оформлении подписки
         if subscription_type == 'psychologist':
             from utils.database.db import reset_free_count
+            from utils.quota import quota
             await reset_free_count(user_id)
+            quota.forget(user_id)
             logger.info(f"Сброшен счетчик бесплатных сообщений для пользователя {user_id}")
         
         logger.info(f"Платёж {payment_id} пользователя {user_id} успешно завершён, подписка {subscription_type} до {formatted}")
@@ -20,6 +20,10 @@ from utils.startup import on_startup
 from handlers import register_all
 from utils.bot_instance import bot
 from utils.activity_middleware import ActivityMiddleware
+from utils.unit_of_work_middleware import UnitOfWorkMiddleware
+from utils.task_supervisor import supervisor, SHUTDOWN_DRAIN_TIMEOUT
+from utils.chatgpt.summary_worker import summary_worker
+from utils.payments.webhook import stop_payment_webhook
 
 
 if bot.token is None:
@@ -34,6 +38,11 @@ activity_middleware = ActivityMiddleware()
 dp.message.middleware(activity_middleware)
 dp.callback_query.middleware(activity_middleware)
 
+# Одно соединение с БД на апдейт для обработчиков с флагом UNIT_OF_WORK_FLAG
+unit_of_work_middleware = UnitOfWorkMiddleware()
+dp.message.middleware(unit_of_work_middleware)
+dp.callback_query.middleware(unit_of_work_middleware)
+
 
 async def main():
     register_all(dp)
@@ -41,7 +50,20 @@ async def main():
     await on_startup(bot, activity_middleware)
     logger.info("🤖 Бот запущен!")
 
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # Останавливаем фоновые циклы и даём разовым задачам (сохранение истории и т.п.) завершиться
+        await stop_payment_webhook()
+        # Отложенные сжатия истории выполняем сразу, иначе они потеряются вместе с таймерами
+        pending_summaries = summary_worker.pending_count()
+        if pending_summaries:
+            logger.info(f"Сжимаем отложенные истории перед остановкой: {pending_summaries}")
+            try:
+                await asyncio.wait_for(summary_worker.flush(), SHUTDOWN_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning("Не все отложенные истории успели сжаться до остановки")
+        await supervisor.shutdown()
 
 
 if __name__ == "__main__":
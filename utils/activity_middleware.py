@@ -3,6 +3,11 @@ import asyncio
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 from utils.database.db import batch_update_user_activity
+from utils.user_stats import user_stats
+from utils.singleflight import current_user_id
+from utils.task_supervisor import supervisor
+
+ACTIVITY_QUEUE_MAX_SIZE = 10000  # обновлений активности в очереди; сверх лимита обновление пропускается
 
 
 class ActivityMiddleware(BaseMiddleware):
@@ -10,8 +15,7 @@ class ActivityMiddleware(BaseMiddleware):
     
     def __init__(self):
         super().__init__()
-        self._update_queue = asyncio.Queue()
-        self._background_task = None
+        self._update_queue = asyncio.Queue(maxsize=ACTIVITY_QUEUE_MAX_SIZE)
     
     async def __call__(
         self,
@@ -21,6 +25,8 @@ class ActivityMiddleware(BaseMiddleware):
     ) -> Any:
         # Добавляем обновление активности в очередь (не блокируем)
         if hasattr(event, 'from_user') and event.from_user:
+            # Пользователь апдейта нужен для объединения одинаковых запросов к моделям
+            current_user_id.set(event.from_user.id)
             try:
                 self._update_queue.put_nowait(event.from_user.id)
             except asyncio.QueueFull:
@@ -31,9 +37,9 @@ class ActivityMiddleware(BaseMiddleware):
         return await handler(event, data)
     
     async def start_background_processor(self):
-        """Запускает фоновую обработку обновлений активности."""
-        if self._background_task is None or self._background_task.done():
-            self._background_task = asyncio.create_task(self._process_updates())
+        """Запускает фоновую обработку обновлений активности под надзором супервизора."""
+        supervisor.register_queue("activity", self._update_queue)
+        supervisor.run_forever("activity", self._process_updates)
     
     async def _process_updates(self):
         """Фоновая обработка обновлений активности."""
@@ -71,7 +77,8 @@ class ActivityMiddleware(BaseMiddleware):
         
         try:
             # Используем оптимизированную пакетную функцию
-            await batch_update_user_activity(user_ids)
+            inserted, reactivated = await batch_update_user_activity(user_ids)
+            user_stats.apply(inserted, reactivated)
         except Exception as e:
             # Логируем только критические ошибки
             if "connection" in str(e).lower() or "database" in str(e).lower():
@@ -10,16 +10,33 @@ from openai.types.chat import ChatCompletionSystemMessageParam, ChatCompletionUs
 
 from config import OPENAI_API_KEY, logger
 from utils.database import db
+from utils.ttl_cache import TTLCache
+from utils.singleflight import single_flight
+from utils.chatgpt.routing import route_task, is_complex_query
+from utils.chatgpt.tokenizer import (
+    count_tokens, count_message_tokens, count_messages_tokens, get_context_budget, truncate_to_tokens,
+    MESSAGE_OVERHEAD_TOKENS, REPLY_PRIMING_TOKENS
+)
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 
-# Простое кэширование для контекста психолога
-_context_cache = {}
+# Кэш контекста психолога: ключ (user_id, m, model), группа — user_id
 CACHE_TTL = 300  # 5 минут в секундах
+CONTEXT_CACHE_MAX_SIZE = 1000
+_context_cache = TTLCache(max_size=CONTEXT_CACHE_MAX_SIZE, ttl=CACHE_TTL)
 
-# Кэш для счетчиков сообщений (чтобы не делать лишние запросы к БД)
-_message_count_cache = {}
+# Кэш для счетчиков сообщений (чтобы не делать лишние запросы к БД), ключ — user_id
 MESSAGE_COUNT_CACHE_TTL = 60  # 1 минута
+MESSAGE_COUNT_CACHE_MAX_SIZE = 5000
+_message_count_cache = TTLCache(max_size=MESSAGE_COUNT_CACHE_MAX_SIZE, ttl=MESSAGE_COUNT_CACHE_TTL)
+
+# Бюджет токенов контекста психолога
+PSYCHOLOGIST_MODEL = 'gpt-5-mini'
+USER_MESSAGE_RESERVE_TOKENS = 600  # резерв под новое сообщение пользователя
+SUMMARY_BUDGET_SHARE = 0.3  # максимальная доля бюджета под резюме
+
+# Жёсткий предел истории: если резюме долго не создаётся, старейшие сообщения удаляются при записи
+HISTORY_MAX_MESSAGES = 200
 
 # --- Психолог: работа с историей и резюме ---
 
@@ -67,96 +84,85 @@ CONVERSATION_GREETING_PROMPT = (
 
 def _invalidate_user_cache(user_id: int):
     """Инвалидирует кэш для конкретного пользователя."""
-    keys_to_remove = [key for key in _context_cache.keys() if key.startswith(f"context_{user_id}_")]
-    for key in keys_to_remove:
-        del _context_cache[key]
-    
+    _context_cache.invalidate_group(user_id)
     # Также инвалидируем кэш счетчика сообщений
-    msg_count_key = f"msg_count_{user_id}"
-    if msg_count_key in _message_count_cache:
-        del _message_count_cache[msg_count_key]
-
-async def save_message(user_id: int, role: str, content: str):
-    """Сохраняет сообщение пользователя или ассистента в историю."""
-    await db.save_history_message(user_id, role, content)
-    # Инвалидируем кэш для этого пользователя
-    _invalidate_user_cache(user_id)
+    _message_count_cache.pop(user_id)
+
+def get_cache_stats() -> dict:
+    """Статистика кэшей психолога (размер, попадания, вытеснения)."""
+    return {
+        "context": _context_cache.stats(),
+        "message_count": _message_count_cache.stats(),
+    }
+
+async def save_message(user_id: int, role: str, content: str) -> int:
+    """Сохраняет сообщение пользователя или ассистента в историю. Возвращает количество сообщений."""
+    count = await db.save_history_message(user_id, role, content)
+    # Инвалидируем кэш контекста, счётчик берём из ответа БД
+    _context_cache.invalidate_group(user_id)
+    _message_count_cache.set(user_id, count)
+    return count
+
+async def save_user_and_bot_messages(user_id: int, user_message: str, bot_message: str) -> int:
+    """
+    Сохраняет сообщение пользователя и ответ бота одним запросом (с обрезкой до HISTORY_MAX_MESSAGES)
+    и обновляет кэш пользователя. Возвращает количество сообщений в истории.
+    """
+    count = await db.save_user_and_bot_messages(user_id, user_message, bot_message, HISTORY_MAX_MESSAGES)
+    _context_cache.invalidate_group(user_id)
+    _message_count_cache.set(user_id, count)
+    return count
 
 async def get_message_count(user_id: int) -> int:
     """Возвращает количество сообщений в истории пользователя с кэшированием."""
-    # Проверяем кэш
-    cache_key = f"msg_count_{user_id}"
-    if cache_key in _message_count_cache:
-        cache_entry = _message_count_cache[cache_key]
-        if (datetime.now().timestamp() - cache_entry['timestamp']) < MESSAGE_COUNT_CACHE_TTL:
-            return cache_entry['count']
+    count = _message_count_cache.get(user_id)
+    if count is not None:
+        return count
     
     # Если кэш устарел или отсутствует, делаем запрос к БД
     count = await db.count_history_messages(user_id)
-    
-    # Сохраняем в кэш
-    _message_count_cache[cache_key] = {
-        'count': count,
-        'timestamp': datetime.now().timestamp()
-    }
-    
+    _message_count_cache.set(user_id, count)
     return count
 
 async def clear_history(user_id: int):
     """Очищает историю сообщений пользователя."""
     await db.clear_history(user_id)
+    _invalidate_user_cache(user_id)
 
 async def get_last_user_message_time(user_id: int) -> float:
     """Возвращает timestamp последнего сообщения пользователя (или None)."""
     return await db.get_last_user_message_time(user_id)
 
-async def save_summary_if_needed(user_id: int, threshold: int):
-    """Если сообщений больше threshold, делает резюме по старым сообщениям и сохраняет его, удаляя старые сообщения."""
-    start_time = time.time()
-    # logger.info(f"[PERF] Начинаем проверку резюме для пользователя {user_id}")
-    
-    count_start = time.time()
-    count = await db.count_history_messages(user_id)
-    count_time = time.time() - count_start
-    # logger.info(f"[PERF] Подсчет сообщений ({count}) занял: {count_time:.3f}s")
+async def compact_history(user_id: int, keep: int) -> bool:
+    """
+    Сжимает историю пользователя: все сообщения сверх keep последних сворачиваются в резюме
+    (объединяется с существующим) и удаляются. Запись резюме и удаление выполняются одной транзакцией.
+    Возвращает True, если сжатие было выполнено.
+    """
+    if await get_message_count(user_id) <= keep:
+        return False
+    summary, summary_ts, old_msgs = await db.get_history_for_compaction(user_id, keep)
+    if not old_msgs:
+        return False
     
-    if count > threshold:
-        # logger.info(f"[PERF] Нужно создать резюме для пользователя {user_id} ({count} > {threshold})")
-        
-        # Получаем старые сообщения для создания резюме (те, которые будут удалены)
-        old_msgs_start = time.time()
-        old_msgs = await db.get_oldest_history_messages(user_id, count-threshold)
-        old_msgs_time = time.time() - old_msgs_start
-        # logger.info(f"[PERF] Получение старых сообщений заняло: {old_msgs_time:.3f}s")
-        
-        text_block = "\n".join([f"{m['role']}: {m['content']}" for m in old_msgs])
-        
-        # Проверяем есть ли уже существующее резюме
-        existing_summary = await db.get_summary(user_id)
-        
-        summary_start = time.time()
-        if existing_summary:
-            # Объединяем старое резюме с новыми сообщениями
-            summary = await make_combined_summary(existing_summary, text_block)
-        else:
-            # Создаем первое резюме
-            summary = await make_summary(text_block)
-        summary_time = time.time() - summary_start
-        # logger.info(f"[PERF] Создание резюме через GPT заняло: {summary_time:.3f}s")
-        
-        save_start = time.time()
-        await db.save_summary(user_id, summary)
-        save_time = time.time() - save_start
-        # logger.info(f"[PERF] Сохранение резюме заняло: {save_time:.3f}s")
-        
-        # Удаляем старые сообщения (оставляем threshold новых)
-        delete_start = time.time()
-        await db.delete_oldest_history_messages(user_id, count-threshold)
-        delete_time = time.time() - delete_start
-        # logger.info(f"[PERF] Удаление старых сообщений заняло: {delete_time:.3f}s")
+    text_block = "\n".join([f"{m['role']}: {m['content']}" for m in old_msgs])
+    if summary:
+        # Объединяем старое резюме с новыми сообщениями
+        new_summary = await make_combined_summary(summary, text_block)
+    else:
+        # Создаем первое резюме
+        new_summary = await make_summary(text_block)
     
-    total_time = time.time() - start_time
-    # logger.info(f"[PERF] Полная проверка резюме для пользователя {user_id} заняла: {total_time:.3f}s")
+    applied = await db.apply_history_compaction(user_id, new_summary, [m["id"] for m in old_msgs], summary_ts)
+    if applied:
+        _invalidate_user_cache(user_id)
+    else:
+        logger.info(f"Резюме пользователя {user_id} изменилось во время сжатия, пропускаем")
+    return applied
+
+async def save_summary_if_needed(user_id: int, threshold: int):
+    """Если сообщений больше threshold, делает резюме по старым сообщениям и сохраняет его, удаляя старые сообщения."""
+    await compact_history(user_id, threshold)
 
 async def make_summary(text_block: str) -> str:
     """Генерирует краткое резюме переписки через OpenAI."""
@@ -203,6 +209,7 @@ async def make_combined_summary(existing_summary: str, new_messages: str) -> str
         return existing_summary  # Возвращаем старое резюме если GPT не ответил
     return result.strip()
 
+@single_flight('short_summary')
 async def make_short_summary(text: str) -> str:
     """Генерирует краткий пересказ одного сообщения пользователя через OpenAI."""
     system_message: ChatCompletionSystemMessageParam = {
@@ -224,6 +231,7 @@ async def make_short_summary(text: str) -> str:
         return "Извините, произошла ошибка при генерации ответа. Попробуйте еще раз."
     return result.strip()
 
+@single_flight('greeting')
 async def make_last_message_greeting(last_message: str, greeting: str) -> str:
     """Генерирует приветственное сообщение с кратким пересказом последнего сообщения пользователя."""
     prompt = LAST_MESSAGE_GREETING_PROMPT.replace('<текст>', last_message)
@@ -247,6 +255,7 @@ async def make_last_message_greeting(last_message: str, greeting: str) -> str:
         return "Извините, произошла ошибка при генерации ответа. Попробуйте еще раз."
     return result.strip()
 
+@single_flight('conversation_greeting')
 async def make_conversation_greeting(user_message: str, bot_message: str, greeting: str) -> str:
     """Генерирует приветственное сообщение на основе последнего диалога между пользователем и ботом."""
     prompt = CONVERSATION_GREETING_PROMPT.replace('<user_message>', user_message).replace('<bot_message>', bot_message)
@@ -270,37 +279,69 @@ async def make_conversation_greeting(user_message: str, bot_message: str, greeti
         return "Извините, произошла ошибка при генерации ответа. Попробуйте еще раз."
     return result.strip()
 
-def _is_cache_valid(cache_entry) -> bool:
-    """Проверяет, не истек ли кэш."""
-    return (datetime.now().timestamp() - cache_entry['timestamp']) < CACHE_TTL
-
-def _cleanup_expired_cache():
-    """Очищает истекший кэш."""
-    current_time = datetime.now().timestamp()
-    expired_keys = [
-        key for key, value in _context_cache.items()
-        if (current_time - value['timestamp']) >= CACHE_TTL
-    ]
-    for key in expired_keys:
-        del _context_cache[key]
-
-async def get_psychologist_context(user_id: int, m: int = 3) -> list[ChatCompletionMessageParam]:
-    """Формирует список сообщений для ChatGPT: системный промпт, резюме (если есть), последние m сообщений."""
+def _select_history_within_budget(history: list[dict], budget: int) -> list[ChatCompletionMessageParam]:
+    """
+    Отбирает последние сообщения истории, укладывающиеся в бюджет токенов.
+    Идём от новых к старым; самое свежее сообщение при необходимости обрезается, а не отбрасывается.
+    """
+    selected: list[ChatCompletionMessageParam] = []
+    remaining = budget
+    for msg in reversed(history):
+        tokens = msg.get("tokens")
+        if tokens is None:
+            tokens = count_tokens(msg["content"])
+        tokens += MESSAGE_OVERHEAD_TOKENS
+        if tokens <= remaining:
+            selected.append({"role": msg["role"], "content": msg["content"]})
+            remaining -= tokens
+            continue
+        if not selected and remaining > MESSAGE_OVERHEAD_TOKENS:
+            content = truncate_to_tokens(msg["content"], remaining - MESSAGE_OVERHEAD_TOKENS)
+            selected.append({"role": msg["role"], "content": content})
+        break
+    selected.reverse()
+    return selected
+
+def _trim_messages_to_budget(messages: list[ChatCompletionMessageParam], budget: int) -> list[ChatCompletionMessageParam]:
+    """
+    Укладывает готовый запрос в бюджет токенов модели.
+    Системные сообщения и последнее сообщение пользователя сохраняются,
+    из середины отбрасываются самые старые реплики; в крайнем случае обрезается само сообщение.
+    """
+    if count_messages_tokens(messages) <= budget:
+        return messages
+
+    system = [msg for msg in messages[:-1] if msg["role"] == "system"]
+    dialog = [msg for msg in messages[:-1] if msg["role"] != "system"]
+    last = messages[-1]
+
+    while dialog and count_messages_tokens(system + dialog + [last]) > budget:
+        dialog.pop(0)
+
+    result = system + dialog + [last]
+    excess = count_messages_tokens(result) - budget
+    if excess > 0:
+        allowed = count_tokens(last.get("content") or "") - excess
+        result[-1] = {"role": last["role"], "content": truncate_to_tokens(last.get("content") or "", allowed, keep="start")}
+    return result
+
+async def get_psychologist_context(user_id: int, m: int = 3, model: str = PSYCHOLOGIST_MODEL) -> list[ChatCompletionMessageParam]:
+    """
+    Формирует список сообщений для ChatGPT: системный промпт, резюме (если есть), последние m сообщений.
+    Контекст укладывается в бюджет токенов модели: резюме сжимается, старые сообщения отбрасываются.
+    """
     start_time = time.time()
     # logger.info(f"[PERF] Начинаем формирование контекста для пользователя {user_id}")
     
-    # Периодически очищаем истекший кэш
-    if len(_context_cache) > 50:  # Очищаем если кэш слишком большой
-        _cleanup_expired_cache()
-    
     # Проверяем кэш
     cache_start = time.time()
-    cache_key = f"context_{user_id}_{m}"
-    if cache_key in _context_cache and _is_cache_valid(_context_cache[cache_key]):
+    cache_key = (user_id, m, model)
+    cached = _context_cache.get(cache_key)
+    if cached is not None:
         cache_time = time.time() - cache_start
         total_time = time.time() - start_time
         # logger.info(f"[PERF] Контекст взят из кэша для пользователя {user_id}. Время кэша: {cache_time:.3f}s, общее: {total_time:.3f}s")
-        return _context_cache[cache_key]['data']
+        return cached
     
     cache_time = time.time() - cache_start
     # logger.info(f"[PERF] Кэш не найден для пользователя {user_id}. Время проверки кэша: {cache_time:.3f}s")
@@ -318,16 +359,19 @@ async def get_psychologist_context(user_id: int, m: int = 3) -> list[ChatComplet
     db_time = time.time() - db_start
     # logger.info(f"[PERF] Запрос к БД для пользователя {user_id} занял: {db_time:.3f}s")
     
+    budget = get_context_budget(model) - USER_MESSAGE_RESERVE_TOKENS - REPLY_PRIMING_TOKENS
+    budget -= count_message_tokens(system_prompt)
+    
     if summary:
-        context.append({"role": "system", "content": f"Память: {summary}"})
-    for msg in last_msgs:
-        context.append({"role": msg["role"], "content": msg["content"]})
+        summary_limit = int(get_context_budget(model) * SUMMARY_BUDGET_SHARE)
+        summary = truncate_to_tokens(summary, summary_limit, keep="end")
+        summary_message: ChatCompletionSystemMessageParam = {"role": "system", "content": f"Память: {summary}"}
+        context.append(summary_message)
+        budget -= count_message_tokens(summary_message)
+    context.extend(_select_history_within_budget(last_msgs, budget))
     
     # Кэшируем результат
-    _context_cache[cache_key] = {
-        'data': context,
-        'timestamp': datetime.now().timestamp()
-    }
+    _context_cache.set(cache_key, context, group=user_id)
     
     total_time = time.time() - start_time
     # logger.info(f"[PERF] Формирование контекста для пользователя {user_id} завершено за: {total_time:.3f}s (БД: {db_time:.3f}s)")
@@ -346,75 +390,7 @@ def _determine_model_for_task(task_type: str, content: str = "", additional_para
     Returns:
         Tuple[model_name, timeout]
     """
-    additional_params = additional_params or {}
-    
-    # Простые задачи - используем gpt-5-nano для максимальной скорости
-    simple_tasks = {
-        'quote': ('gpt-3.5-turbo', 8),      # Цитаты: максимально быстро с GPT-3.5
-        'short_summary': ('gpt-5-nano', 10), # Краткие резюме: быстро
-        'simple_greeting': ('gpt-3.5-turbo', 8), # Простые приветствия: быстро с GPT-3.5
-    }
-    
-    if task_type in simple_tasks:
-        return simple_tasks[task_type]
-    
-    # Анализ сложности для остальных задач
-    is_complex = False
-    
-    if task_type == 'psychologist':
-        # Психология использует gpt-5-mini для оптимального баланса качества и экономии
-        is_complex = _analyze_query_complexity(content)
-        return ('gpt-5-mini', 30 if is_complex else 25)  # Оптимизированные таймауты
-    
-    elif task_type == 'summary':
-        # Резюме - простая задача, используем gpt-5-nano
-        return ('gpt-5-nano', 15)
-    
-    elif task_type == 'greeting':
-        # Все приветствия используем GPT-3.5-turbo для скорости
-        return ('gpt-3.5-turbo', 8)
-    
-    elif task_type == 'conversation_greeting':
-        # Диалоговые приветствия - используем GPT-3.5-turbo для скорости
-        return ('gpt-3.5-turbo', 8)
-    
-    elif task_type == 'ideas':
-        previous_ideas = additional_params.get('previous_ideas', [])
-        constraints = additional_params.get('constraints', '')
-        category = additional_params.get('category', '')
-        
-        is_complex = (
-            previous_ideas and len(previous_ideas) > 0 or
-            len(constraints) > 100 or
-            'бизнес' in category.lower() or
-            len(category) > 50
-        )
-        return ('gpt-5-mini' if is_complex else 'gpt-5-nano', 45 if is_complex else 25)
-    
-    elif task_type == 'ideas_with_edits':
-        edits = additional_params.get('edits', [])
-        constraints = additional_params.get('constraints', '')
-        category = additional_params.get('category', '')
-        
-        is_complex = (
-            len(edits) > 2 or
-            any(len(edit) > 50 for edit in edits) or
-            len(constraints) > 100 or
-            'бизнес' in category.lower()
-        )
-        return ('gpt-5-mini' if is_complex else 'gpt-5-nano', 50 if is_complex else 30)
-    
-    elif task_type == 'congrats':
-        # Все поздравления используют gpt-5-mini для стабильности
-        is_complex = len(content) > 50  # Простые vs развернутые
-        return ('gpt-5-mini', 45 if is_complex else 35)
-    
-    elif task_type == 'congrats_with_edits':
-        # Правки поздравлений всегда требуют качественной модели
-        return ('gpt-5-mini', 45)
-    
-    # По умолчанию для неизвестных задач
-    return ('gpt-5-nano', 20)
+    return route_task(task_type, content, additional_params)
 
 def _analyze_query_complexity(user_message: str) -> bool:
     """
@@ -422,64 +398,20 @@ def _analyze_query_complexity(user_message: str) -> bool:
     Возвращает True если запрос требует глубокого анализа (gpt-5-mini),
     False для простых запросов (gpt-5-nano).
     """
-    if not user_message:
-        return False
-    
-    # Сначала проверяем сложные паттерны (приоритет)
-    complex_patterns = [
-        # Вопросы о проблемах и эмоциях (высокий приоритет)
-        any(word in user_message.lower() for word in [
-            'проблем', 'депресс', 'тревож', 'стресс', 'паник', 'страх', 
-            'отношени', 'конфликт', 'семь', 'работ', 'карьер', 'здоровь',
-            'болезн', 'смерт', 'потер', 'развод', 'измен', 'предательств'
-        ]),
-        # Вопросительные слова требующие анализа
-        any(word in user_message.lower() for word in [
-            'почему', 'зачем', 'как быть', 'что делать', 'помогите', 'посоветуйте'
-        ]),
-        # Длинные сообщения требуют анализа
-        len(user_message) > 80,
-        # Множественные предложения
-        user_message.count('.') > 2 or user_message.count('?') > 1,
-    ]
-    
-    # Если есть признаки сложности - сразу возвращаем True
-    if any(complex_patterns):
-        return True
-    
-    # Простые критерии (только если нет сложных)
-    simple_patterns = [
-        # Очень короткие сообщения
-        len(user_message) < 20,
-        # Простые вопросы
-        user_message.lower().startswith(('как дела', 'привет', 'спасибо', 'да', 'нет', 'хорошо', 'плохо')),
-        # Односложные ответы
-        len(user_message.split()) <= 3,
-        # Эмодзи без текста
-        len(user_message.strip()) <= 5 and any(ord(char) > 127 for char in user_message),
-    ]
-    
-    # Если есть явные признаки простоты
-    if any(simple_patterns):
-        return False
-    
-    # По умолчанию для средних запросов используем nano для скорости
-    return False
+    return is_complex_query(user_message)
 
 async def get_psychologist_response(context: list[ChatCompletionMessageParam], user_message: str) -> str:
     """Отправляет контекст и сообщение пользователя в OpenAI, возвращает ответ психолога."""
     start_time = time.time()
     # logger.info(f"[PERF] Начинаем запрос к OpenAI. Размер контекста: {len(context)} сообщений")
     
-    messages = context + [{"role": "user", "content": user_message}]
-    
-    # Подсчитываем приблизительное количество токенов
-    total_chars = sum(len(msg.get("content", "")) for msg in messages)
-    estimated_tokens = total_chars // 4  # Приблизительно 4 символа = 1 токен
-    
     # Определяем модель на основе сложности запроса
     model, timeout = _determine_model_for_task('psychologist', user_message)
     
+    # Укладываем запрос в бюджет токенов выбранной модели
+    messages = _trim_messages_to_budget(context + [{"role": "user", "content": user_message}], get_context_budget(model))
+    estimated_tokens = count_messages_tokens(messages)
+    
     # logger.info(f"[PERF] Приблизительно {estimated_tokens} токенов. Модель: {model}")
     
     # Оптимизированные параметры для скорости
@@ -506,6 +438,7 @@ async def get_psychologist_response(context: list[ChatCompletionMessageParam], u
     
     return result
 
+@single_flight('congrats')
 async def generate_response(prompt):
     """
     Генерирует поздравление по тексту prompt. Возвращает готовый текст (~10 предложений).
@@ -536,6 +469,7 @@ async def generate_response(prompt):
     return answer.strip()
 
 
+@single_flight('congrats_with_edits')
 async def generate_response_with_edits(base_prompt, edits):
     """
     base_prompt   — исходный запрос пользователя
@@ -567,6 +501,7 @@ async def generate_response_with_edits(base_prompt, edits):
     return result.strip()
 
 
+@single_flight('quote')
 async def generate_daily_quote_model() -> dict:
     """
     Запрашивает у модели одну короткую вдохновляющую цитату и источник.
@@ -639,6 +574,7 @@ STYLE_MAPPING = {
     "случайный": "случайный"
 }
 
+@single_flight('ideas')
 async def generate_ideas(category: str, style: str, constraints: str, previous_ideas: list = None) -> str:
     """
     Генерирует 3 идеи по заданным параметрам.
@@ -717,6 +653,7 @@ async def generate_ideas(category: str, style: str, constraints: str, previous_i
     return answer
 
 
+@single_flight('ideas_with_edits')
 async def generate_ideas_with_edits(category: str, style: str, constraints: str, edits: list, previous_ideas: list = None) -> str:
     """
     Генерирует обновленные идеи с учетом правок пользователя.
@@ -799,6 +736,7 @@ async def generate_ideas_with_edits(category: str, style: str, constraints: str,
     return answer
 
 
+@single_flight('goal_checklist')
 async def generate_goal_checklist(goal: str, timeframe: str, preferences: str) -> str:
     """
     Генерирует чек-лист для достижения цели
@@ -0,0 +1,183 @@
+import re
+from typing import Callable, NamedTuple, Optional
+
+# --- Признаки сложности запроса психологу ---
+
+# Основы слов о проблемах и эмоциях (совпадение по подстроке, как у префиксов)
+COMPLEX_TOPIC_STEMS = (
+    'проблем', 'депресс', 'тревож', 'стресс', 'паник', 'страх',
+    'отношени', 'конфликт', 'семь', 'работ', 'карьер', 'здоровь',
+    'болезн', 'смерт', 'потер', 'развод', 'измен', 'предательств'
+)
+
+# Вопросительные обороты, требующие анализа
+COMPLEX_QUESTION_PHRASES = (
+    'почему', 'зачем', 'как быть', 'что делать', 'помогите', 'посоветуйте'
+)
+
+LONG_MESSAGE_CHARS = 80
+
+# Один автомат на все ключевые слова: текст сканируется за один проход
+_KEYWORDS_RE = re.compile(
+    "(?P<topic>{})|(?P<question>{})".format(
+        "|".join(map(re.escape, sorted(COMPLEX_TOPIC_STEMS, key=len, reverse=True))),
+        "|".join(map(re.escape, sorted(COMPLEX_QUESTION_PHRASES, key=len, reverse=True))),
+    )
+)
+
+
+class QueryFeatures(NamedTuple):
+    """Признаки сообщения, вычисляемые один раз за запрос."""
+    length: int
+    words: int
+    sentences: int
+    questions: int
+    topic_hits: int
+    question_hits: int
+
+
+def extract_features(user_message: str) -> QueryFeatures:
+    """Вычисляет признаки сообщения за один проход регулярного выражения."""
+    lowered = user_message.lower()
+    topic_hits = question_hits = 0
+    for match in _KEYWORDS_RE.finditer(lowered):
+        if match.lastgroup == "topic":
+            topic_hits += 1
+        else:
+            question_hits += 1
+    return QueryFeatures(
+        length=len(user_message),
+        words=len(user_message.split()),
+        sentences=user_message.count('.'),
+        questions=user_message.count('?'),
+        topic_hits=topic_hits,
+        question_hits=question_hits,
+    )
+
+
+def default_complexity_score(features: QueryFeatures) -> float:
+    """
+    Базовая оценка сложности: любой из признаков делает запрос сложным.
+    Повторяет прежние правила выбора модели.
+    """
+    return float(
+        features.topic_hits > 0
+        or features.question_hits > 0
+        or features.length > LONG_MESSAGE_CHARS
+        or features.sentences > 2
+        or features.questions > 1
+    )
+
+
+ComplexityScorer = Callable[[QueryFeatures], float]
+
+_scorer: ComplexityScorer = default_complexity_score
+_threshold: float = 1.0
+
+
+def set_complexity_scorer(scorer: Optional[ComplexityScorer] = None, threshold: float = 1.0):
+    """
+    Подменяет функцию оценки сложности (например, для настройки баланса цена/задержка).
+    Без аргументов возвращает оценку по умолчанию.
+    """
+    global _scorer, _threshold
+    _scorer = scorer or default_complexity_score
+    _threshold = threshold
+
+
+def complexity_score(user_message: str) -> float:
+    """Оценка сложности сообщения текущей функцией оценки."""
+    if not user_message:
+        return 0.0
+    return _scorer(extract_features(user_message))
+
+
+def _default_is_complex(user_message: str) -> bool:
+    # Быстрый путь для оценки по умолчанию: дешёвые проверки первыми, без построения признаков
+    return (
+        len(user_message) > LONG_MESSAGE_CHARS
+        or user_message.count('.') > 2
+        or user_message.count('?') > 1
+        or _KEYWORDS_RE.search(user_message.lower()) is not None
+    )
+
+
+def is_complex_query(user_message: str) -> bool:
+    """True, если запрос требует глубокого анализа."""
+    if not user_message:
+        return False
+    if _scorer is default_complexity_score and 0.0 < _threshold <= 1.0:
+        return _default_is_complex(user_message)
+    return complexity_score(user_message) >= _threshold
+
+
+# --- Таблица маршрутизации задач по моделям ---
+
+# Задачи с фиксированной моделью: (модель, timeout)
+STATIC_ROUTES = {
+    'quote': ('gpt-3.5-turbo', 8),              # Цитаты: максимально быстро с GPT-3.5
+    'short_summary': ('gpt-5-nano', 10),         # Краткие резюме: быстро
+    'simple_greeting': ('gpt-3.5-turbo', 8),     # Простые приветствия: быстро с GPT-3.5
+    'summary': ('gpt-5-nano', 15),               # Резюме - простая задача
+    'greeting': ('gpt-3.5-turbo', 8),            # Приветствия: скорость важнее качества
+    'conversation_greeting': ('gpt-3.5-turbo', 8),
+    'congrats_with_edits': ('gpt-5-mini', 45),   # Правки поздравлений требуют качественной модели
+}
+
+DEFAULT_ROUTE = ('gpt-5-nano', 20)
+
+
+def _route_psychologist(content: str, params: dict) -> tuple[str, int]:
+    # Психология использует gpt-5-mini для оптимального баланса качества и экономии
+    return ('gpt-5-mini', 30 if is_complex_query(content) else 25)
+
+
+def _route_ideas(content: str, params: dict) -> tuple[str, int]:
+    previous_ideas = params.get('previous_ideas') or []
+    constraints = params.get('constraints', '')
+    category = params.get('category', '')
+    is_complex = (
+        len(previous_ideas) > 0 or
+        len(constraints) > 100 or
+        'бизнес' in category.lower() or
+        len(category) > 50
+    )
+    return ('gpt-5-mini', 45) if is_complex else ('gpt-5-nano', 25)
+
+
+def _route_ideas_with_edits(content: str, params: dict) -> tuple[str, int]:
+    edits = params.get('edits', [])
+    constraints = params.get('constraints', '')
+    category = params.get('category', '')
+    is_complex = (
+        len(edits) > 2 or
+        any(len(edit) > 50 for edit in edits) or
+        len(constraints) > 100 or
+        'бизнес' in category.lower()
+    )
+    return ('gpt-5-mini', 50) if is_complex else ('gpt-5-nano', 30)
+
+
+def _route_congrats(content: str, params: dict) -> tuple[str, int]:
+    # Все поздравления используют gpt-5-mini для стабильности, развернутым даём больше времени
+    return ('gpt-5-mini', 45 if len(content) > 50 else 35)
+
+
+DYNAMIC_ROUTES: dict[str, Callable[[str, dict], tuple[str, int]]] = {
+    'psychologist': _route_psychologist,
+    'ideas': _route_ideas,
+    'ideas_with_edits': _route_ideas_with_edits,
+    'congrats': _route_congrats,
+}
+
+
+def route_task(task_type: str, content: str = "", additional_params: dict = None) -> tuple[str, int]:
+    """Возвращает (модель, timeout) для задачи по таблице маршрутизации."""
+    route = STATIC_ROUTES.get(task_type)
+    if route is not None:
+        return route
+    handler = DYNAMIC_ROUTES.get(task_type)
+    if handler is not None:
+        return handler(content or "", additional_params or {})
+    # По умолчанию для неизвестных задач
+    return DEFAULT_ROUTE
@@ -0,0 +1,136 @@
+"""
+Офлайн-оценка маршрутизации запросов психолога.
+
+Прогоняет записанные сообщения через классификатор сложности и печатает
+скорость, распределение по маршрутам (модель и таймаут), совпадение с прежней реализацией и,
+если сообщения размечены, точность/полноту.
+
+Примеры:
+    python -m utils.chatgpt.routing_benchmark messages.jsonl
+    python -m utils.chatgpt.routing_benchmark messages.txt --threshold 0.5
+    python -m utils.chatgpt.routing_benchmark --from-db 5000
+
+--threshold сравнивается с оценкой сложности: встроенный классификатор возвращает
+0 или 1, поэтому осмысленны значения в (0, 1] (любое из них даёт прежнюю маршрутизацию).
+При пороге больше 1 каждое сообщение считается простым: модель психолога не меняется
+(всегда gpt-5-mini), но все запросы получают короткий таймаут (25 с вместо 30).
+Другие шкалы — только для своего scorer.
+
+Формат JSONL: {"text": "...", "complex": true} — поле complex необязательно.
+В .txt каждая строка — отдельное сообщение.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Optional
+
+from utils.chatgpt import routing
+
+
+def legacy_is_complex(user_message: str) -> bool:
+    """Прежняя реализация (несколько проходов по тексту) — эталон для сравнения."""
+    if not user_message:
+        return False
+    lowered = user_message.lower()
+    return (
+        any(word in lowered for word in routing.COMPLEX_TOPIC_STEMS)
+        or any(word in lowered for word in routing.COMPLEX_QUESTION_PHRASES)
+        or len(user_message) > routing.LONG_MESSAGE_CHARS
+        or user_message.count('.') > 2 or user_message.count('?') > 1
+    )
+
+
+def load_messages(path: str) -> list[tuple[str, Optional[bool]]]:
+    """Загружает сообщения (и разметку, если есть) из .jsonl или .txt."""
+    messages = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            if path.endswith('.jsonl'):
+                record = json.loads(line)
+                label = record.get('complex')
+                messages.append((record.get('text', ''), None if label is None else bool(label)))
+            else:
+                messages.append((line, None))
+    return messages
+
+
+async def load_messages_from_db(limit: int) -> list[tuple[str, Optional[bool]]]:
+    """Берёт последние сообщения пользователей из psychologist_history."""
+    from utils.database.db import get_connection, release_connection
+    conn = await get_connection()
+    try:
+        rows = await conn.fetch(
+            "SELECT content FROM psychologist_history WHERE role = 'user' ORDER BY ts DESC LIMIT $1;",
+            limit
+        )
+    finally:
+        await release_connection(conn)
+    return [(r["content"], None) for r in rows]
+
+
+def _time_per_message(func, texts: list[str], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            func(text)
+    elapsed = time.perf_counter() - start
+    return elapsed / max(len(texts) * repeat, 1) * 1e6
+
+
+def evaluate(messages: list[tuple[str, Optional[bool]]], repeat: int = 5) -> dict:
+    """Считает метрики классификатора на наборе сообщений."""
+    texts = [text for text, _ in messages]
+    predictions = [routing.is_complex_query(text) for text in texts]
+    legacy = [legacy_is_complex(text) for text in texts]
+
+    report = {
+        "messages": len(texts),
+        "complex_share": sum(predictions) / len(texts) if texts else 0.0,
+        "legacy_agreement": sum(p == l for p, l in zip(predictions, legacy)) / len(texts) if texts else 0.0,
+        "us_per_message": _time_per_message(routing.is_complex_query, texts, repeat),
+        "legacy_us_per_message": _time_per_message(legacy_is_complex, texts, repeat),
+        "routes": dict(Counter(routing.route_task('psychologist', text) for text in texts)),
+    }
+
+    labelled = [(p, label) for p, (_, label) in zip(predictions, messages) if label is not None]
+    if labelled:
+        tp = sum(1 for p, label in labelled if p and label)
+        fp = sum(1 for p, label in labelled if p and not label)
+        fn = sum(1 for p, label in labelled if not p and label)
+        report["labelled"] = len(labelled)
+        report["accuracy"] = sum(p == label for p, label in labelled) / len(labelled)
+        report["precision"] = tp / (tp + fp) if tp + fp else 0.0
+        report["recall"] = tp / (tp + fn) if tp + fn else 0.0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Оценка классификатора сложности запросов психолога")
+    parser.add_argument("path", nargs="?", help="Файл .jsonl или .txt с сообщениями")
+    parser.add_argument("--from-db", type=int, metavar="N", help="Взять N последних сообщений из БД")
+    parser.add_argument("--threshold", type=float, default=1.0, help="Порог оценки сложности (встроенная оценка: 0 или 1)")
+    parser.add_argument("--repeat", type=int, default=5, help="Повторов для замера скорости")
+    args = parser.parse_args()
+
+    if args.from_db:
+        messages = asyncio.run(load_messages_from_db(args.from_db))
+    elif args.path:
+        messages = load_messages(args.path)
+    else:
+        parser.error("укажите файл с сообщениями или --from-db")
+
+    routing.set_complexity_scorer(threshold=args.threshold)
+    report = evaluate(messages, repeat=args.repeat)
+    for key, value in report.items():
+        if isinstance(value, float):
+            value = f"{value:.4f}"
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
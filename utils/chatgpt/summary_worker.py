@@ -0,0 +1,80 @@
+import asyncio
+from typing import Dict, Optional
+
+from config import logger
+from utils.chatgpt.gpt import compact_history
+
+SUMMARY_IDLE_DELAY = 90  # секунд без новых сообщений перед сжатием истории
+SUMMARY_MAX_CONCURRENCY = 2  # одновременных вызовов модели для резюме
+
+
+class SummaryWorker:
+    """
+    Фоновое сжатие истории психолога.
+
+    Каждое сообщение лишь откладывает сжатие для пользователя (debounce):
+    повторные вызовы schedule() переносят таймер, поэтому несколько сообщений
+    подряд сворачиваются в одно резюме, когда пользователь замолкает.
+    Для одного пользователя сжатие никогда не выполняется параллельно.
+    """
+
+    def __init__(self, idle_delay: float = SUMMARY_IDLE_DELAY, max_concurrency: int = SUMMARY_MAX_CONCURRENCY):
+        self._idle_delay = idle_delay
+        self._timers: Dict[int, asyncio.Task] = {}
+        self._thresholds: Dict[int, int] = {}
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._max_concurrency = max_concurrency
+
+    def schedule(self, user_id: int, threshold: int):
+        """Планирует (или переносит) сжатие истории пользователя после паузы в переписке."""
+        self._thresholds[user_id] = threshold
+        timer = self._timers.get(user_id)
+        if timer and not timer.done():
+            timer.cancel()
+        self._timers[user_id] = asyncio.create_task(self._delayed_compaction(user_id))
+
+    def pending_count(self) -> int:
+        """Количество пользователей, ожидающих сжатия."""
+        return sum(1 for task in self._timers.values() if not task.done())
+
+    async def flush(self):
+        """Немедленно выполняет все отложенные сжатия (например, при остановке бота)."""
+        user_ids = [user_id for user_id, task in self._timers.items() if not task.done()]
+        for user_id in user_ids:
+            self._timers.pop(user_id).cancel()
+        await asyncio.gather(*(self._run(user_id) for user_id in user_ids), return_exceptions=True)
+
+    async def _delayed_compaction(self, user_id: int):
+        try:
+            await asyncio.sleep(self._idle_delay)
+        except asyncio.CancelledError:
+            return
+        # Таймер сработал — дальше сжатие не отменяется новым сообщением
+        if self._timers.get(user_id) is asyncio.current_task():
+            del self._timers[user_id]
+        await self._run(user_id)
+
+    async def _run(self, user_id: int):
+        threshold = self._thresholds.pop(user_id, None)
+        if threshold is None:
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock, self._semaphore:
+                await compact_history(user_id, threshold)
+        except Exception as e:
+            logger.error(f"Ошибка при сжатии истории пользователя {user_id}: {e}")
+        finally:
+            if not lock.locked() and user_id not in self._timers:
+                self._user_locks.pop(user_id, None)
+
+
+summary_worker = SummaryWorker()
+
+
+def schedule_summary(user_id: int, threshold: int):
+    """Откладывает сжатие истории пользователя до паузы в переписке."""
+    summary_worker.schedule(user_id, threshold)
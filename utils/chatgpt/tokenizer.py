@@ -0,0 +1,99 @@
+import re
+from functools import lru_cache
+from typing import Iterable
+
+# Локальная оценка количества токенов без обращения к сети.
+# Работает по тем же правилам, что и BPE-токенизаторы OpenAI в среднем:
+# латиница ~4 символа на токен, кириллица ~3 символа, знаки препинания — по токену.
+_TOKEN_RE = re.compile(r"[A-Za-z]+|[^\W\d_]+|\d+|[^\w\s]", re.UNICODE)
+
+ASCII_CHARS_PER_TOKEN = 4
+UNICODE_CHARS_PER_TOKEN = 3
+DIGITS_PER_TOKEN = 3
+
+# Служебные токены формата chat completions
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+# Бюджет входного контекста (в токенах) для каждой модели
+MODEL_CONTEXT_BUDGETS = {
+    'gpt-5-mini': 4000,
+    'gpt-5-nano': 3000,
+    'gpt-3.5-turbo': 2500,
+}
+DEFAULT_CONTEXT_BUDGET = 3000
+
+
+def _piece_tokens(piece: str) -> int:
+    """Оценивает число токенов для одного фрагмента текста."""
+    length = len(piece)
+    if piece.isascii():
+        if piece.isdigit():
+            return -(-length // DIGITS_PER_TOKEN)
+        if piece.isalpha():
+            return -(-length // ASCII_CHARS_PER_TOKEN)
+        return 1
+    if piece.isalpha():
+        return -(-length // UNICODE_CHARS_PER_TOKEN)
+    # Эмодзи и прочие символы вне ASCII обычно занимают несколько токенов
+    return 2 if length == 1 else length
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Возвращает приблизительное количество токенов в тексте."""
+    if not text:
+        return 0
+    return sum(_piece_tokens(piece) for piece in _TOKEN_RE.findall(text))
+
+
+def count_message_tokens(message: dict) -> int:
+    """Количество токенов одного сообщения с учётом служебных токенов формата."""
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def count_messages_tokens(messages: Iterable[dict]) -> int:
+    """Количество токенов для всего запроса к модели."""
+    return sum(count_message_tokens(msg) for msg in messages) + REPLY_PRIMING_TOKENS
+
+
+def get_context_budget(model: str) -> int:
+    """Возвращает бюджет входного контекста для модели."""
+    return MODEL_CONTEXT_BUDGETS.get(model, DEFAULT_CONTEXT_BUDGET)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = "end") -> str:
+    """
+    Обрезает текст так, чтобы он укладывался в max_tokens.
+
+    Args:
+        text: Исходный текст
+        max_tokens: Максимальное количество токенов
+        keep: 'end' — сохраняет конец текста (свежая часть сообщения), 'start' — начало
+
+    Returns:
+        Обрезанный текст (с многоточием на месте отрезанной части)
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    pieces = list(_TOKEN_RE.finditer(text))
+    used = 0
+    if keep == "start":
+        cut = 0
+        for match in pieces:
+            used += _piece_tokens(match.group())
+            if used > max_tokens - 1:
+                break
+            cut = match.end()
+        return text[:cut].rstrip() + "…"
+
+    cut = len(text)
+    for match in reversed(pieces):
+        used += _piece_tokens(match.group())
+        if used > max_tokens - 1:
+            break
+        cut = match.start()
+    return "…" + text[cut:].lstrip()
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+CATALOGUE_TTL = 600  # секунд; страховка для изменений, сделанных другим инстансом бота
+
+
+class _Section:
+    """Закэшированный список одной таблицы (шрифты или цвета) с индексом по id."""
+
+    def __init__(self):
+        self.items: Optional[Tuple] = None
+        self.by_id: Dict[int, object] = {}
+        self.loaded_at = 0.0
+        self.lock: Optional[asyncio.Lock] = None
+
+
+class Catalogue:
+    """
+    Версионированный кэш каталога шрифтов и цветов.
+
+    Каталог меняется только из админки (add/delete_font, add/delete_color) и при
+    синхронизации с Dropbox — они вызывают invalidate(), увеличивая версию.
+    Загрузка, начатая до инвалидации, не сохраняет устаревший результат.
+    """
+
+    def __init__(self, ttl: float = CATALOGUE_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self._sections = {"fonts": _Section(), "colors": _Section()}
+
+    def invalidate(self, kind: Optional[str] = None):
+        """Сбрасывает раздел ('fonts' / 'colors') или весь каталог."""
+        self.version += 1
+        for name, section in self._sections.items():
+            if kind is None or name == kind:
+                section.items = None
+                section.by_id = {}
+
+    async def fonts(self) -> Tuple:
+        """Все шрифты (id, name, font_path, sample_path) в порядке id."""
+        return await self._get("fonts")
+
+    async def colors(self) -> Tuple:
+        """Все цвета (id, name, hex_code, sample_path) в порядке id."""
+        return await self._get("colors")
+
+    async def font(self, font_id: int):
+        await self._get("fonts")
+        return self._sections["fonts"].by_id.get(font_id)
+
+    async def color(self, color_id: int):
+        await self._get("colors")
+        return self._sections["colors"].by_id.get(color_id)
+
+    async def _get(self, kind: str) -> Tuple:
+        section = self._sections[kind]
+        if section.items is not None and time.monotonic() - section.loaded_at < self.ttl:
+            return section.items
+        if section.lock is None:
+            section.lock = asyncio.Lock()
+        async with section.lock:
+            # Пока ждали блокировку, каталог мог загрузить другой обработчик
+            if section.items is not None and time.monotonic() - section.loaded_at < self.ttl:
+                return section.items
+            from utils.database import db
+            version = self.version
+            rows = await (db.list_fonts() if kind == "fonts" else db.list_colors())
+            items = tuple(rows)
+            if version == self.version:
+                section.items = items
+                section.by_id = {item["id"]: item for item in items}
+                section.loaded_at = time.monotonic()
+            return items
+
+
+catalogue = Catalogue()
@@ -1,14 +1,51 @@
 import os
+import json
+import time
 import asyncpg
 from datetime import datetime, timezone, timedelta, date
 from dateutil.relativedelta import relativedelta
+from decimal import Decimal
 from typing import Optional, List, Dict, Any
 
+from utils.chatgpt.tokenizer import count_tokens
+from utils.database.unit_of_work import SharedConnection, current_unit_of_work
+from utils.database.records import Notification
+from utils.database.catalogue import catalogue
+from utils.database.profiler import profiler, instrument_module
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него используется стандартный json
+    orjson = None
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 # Пул соединений для оптимизации производительности
 _connection_pool = None
 
+
+def _json_encode(value) -> str:
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _json_decode(value: str):
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+async def _init_connection(conn):
+    """Кодеки соединения: JSON/JSONB (де)сериализуются драйвером в объекты Python."""
+    for type_name in ('json', 'jsonb'):
+        await conn.set_type_codec(
+            type_name, encoder=_json_encode, decoder=_json_decode, schema='pg_catalog'
+        )
+    # Журнал медленных запросов (add_query_logger есть в asyncpg >= 0.29)
+    if hasattr(conn, 'add_query_logger'):
+        conn.add_query_logger(profiler.log_query)
+
 async def init_connection_pool():
     """Инициализирует пул соединений к базе данных."""
     global _connection_pool
@@ -18,6 +55,7 @@ async def init_connection_pool():
             min_size=5,  # Минимум соединений
             max_size=20,  # Максимум соединений
             command_timeout=30,  # Таймаут команд
+            init=_init_connection,
             server_settings={
                 'jit': 'off'  # Отключаем JIT для стабильности
             }
@@ -25,12 +63,21 @@ async def init_connection_pool():
     return _connection_pool
 
 async def get_connection():
-    """Получает соединение из пула."""
+    """Получает соединение из пула (или соединение активной единицы работы)."""
+    uow = current_unit_of_work()
+    if uow is not None:
+        return await uow.connection()
     pool = await init_connection_pool()
-    return await pool.acquire()
+    start = time.perf_counter()
+    conn = await pool.acquire()
+    profiler.record_pool_wait(time.perf_counter() - start)
+    return conn
 
 async def release_connection(conn):
     """Возвращает соединение в пул."""
+    if isinstance(conn, SharedConnection):
+        # Соединением владеет единица работы
+        return
     pool = await init_connection_pool()
     await pool.release(conn)
 
@@ -69,7 +116,7 @@ async def init_db():
         CREATE TABLE IF NOT EXISTS notifications (
             id          SERIAL PRIMARY KEY,
             text        TEXT NOT NULL,
-            media_files TEXT, -- JSON строка с медиафайлами
+            media_files JSONB NOT NULL DEFAULT '[]'::jsonb, -- список медиафайлов
             scheduled_at TIMESTAMP WITH TIME ZONE,
             sent_at     TIMESTAMP WITH TIME ZONE,
             created_by  BIGINT NOT NULL,
@@ -77,16 +124,7 @@ async def init_db():
             is_sent     BOOLEAN NOT NULL DEFAULT FALSE
         );
     """)
-    
-    # Миграция: изменяем тип поля media_files с TEXT[] на TEXT если нужно
-    try:
-        await conn.execute("""
-            ALTER TABLE notifications 
-            ALTER COLUMN media_files TYPE TEXT;
-        """)
-    except Exception:
-        # Поле уже имеет правильный тип или таблица не существует
-        pass
+    # Тип media_files для существующих баз приводится к JSONB миграцией 6 (utils/database/migrations.py)
     await conn.execute("""
         CREATE TABLE IF NOT EXISTS daily_quotes (
             user_id     BIGINT,
@@ -203,6 +241,26 @@ async def fetch_daily_quote(user_id: int, quote_date: str):
         return None
     return row["quote"], row["source"]
 
+async def fetch_daily_quote_with_subscription(user_id: int, quote_date: str, subscription_type: str = 'main'):
+    """
+    Одним запросом возвращает цитату пользователя за дату (или None) и срок его подписки (или None).
+    """
+    conn = await get_connection()
+    try:
+        row = await conn.fetchrow(
+            """
+            SELECT q.quote, q.source, s.expires_at
+            FROM (SELECT $1::bigint AS user_id) u
+            LEFT JOIN daily_quotes q ON q.user_id = u.user_id AND q.quote_date = $2
+            LEFT JOIN subscriptions s ON s.user_id = u.user_id AND s.type = $3;
+            """,
+            user_id, quote_date, subscription_type
+        )
+    finally:
+        await release_connection(conn)
+    existing = (row["quote"], row["source"]) if row["quote"] is not None else None
+    return existing, row["expires_at"]
+
 async def upsert_daily_quote(user_id: int, quote_date: str, quote: str, source: str | None):
     conn = await get_connection()
     await conn.execute("""
@@ -222,17 +280,16 @@ async def add_font(name: str, font_path: str, sample_path: str):
         name, font_path, sample_path, now
     )
     await conn.close()
+    catalogue.invalidate("fonts")
 
 async def list_fonts():
+    """Список шрифтов (записи asyncpg с полями id, name, font_path, sample_path)."""
     conn = await get_connection()
     rows = await conn.fetch(
         "SELECT id, name, font_path, sample_path FROM fonts ORDER BY id;"
     )
     await conn.close()
-    return [
-        {"id": r["id"], "name": r["name"], "font_path": r["font_path"], "sample_path": r["sample_path"]}
-        for r in rows
-    ]
+    return rows
 
 async def delete_font(font_id: int):
     conn = await get_connection()
@@ -245,6 +302,7 @@ async def delete_font(font_id: int):
         font_id
     )
     await conn.close()
+    catalogue.invalidate("fonts")
     if not row:
         return None
     return row["font_path"], row["sample_path"]
@@ -257,17 +315,16 @@ async def add_color(name: str, hex_code: str, sample_path: str):
         name, hex_code, sample_path, now
     )
     await conn.close()
+    catalogue.invalidate("colors")
 
 async def list_colors():
+    """Список цветов (записи asyncpg с полями id, name, hex_code, sample_path)."""
     conn = await get_connection()
     rows = await conn.fetch(
         "SELECT id, name, hex_code, sample_path FROM colors ORDER BY id;"
     )
     await conn.close()
-    return [
-        {"id": r["id"], "name": r["name"], "hex_code": r["hex_code"], "sample_path": r["sample_path"]}
-        for r in rows
-    ]
+    return rows
 
 async def delete_color(color_id: int):
     conn = await get_connection()
@@ -280,6 +337,7 @@ async def delete_color(color_id: int):
         color_id
     )
     await conn.close()
+    catalogue.invalidate("colors")
     if not row:
         return None
     return row["sample_path"]
@@ -296,23 +354,43 @@ async def upsert_future_letter(user_id: int, content: str, send_after: datetime,
     await conn.close()
     return row['id'] if row else None
 
-async def fetch_due_letters():
-    now = datetime.now(timezone.utc)
+async def claim_due_letters(limit: int, lease_seconds: int):
+    """
+    Забирает до limit писем, время отправки которых наступило, и арендует их на lease_seconds.
+
+    SKIP LOCKED и аренда (claimed_until) не дают нескольким инстансам бота взять одно письмо;
+    если доставщик упал, письмо снова станет доступно после окончания аренды.
+    """
     conn = await get_connection()
-    rows = await conn.fetch(
-        "SELECT * FROM future_letters WHERE is_sent = FALSE AND send_after <= $1;",
-        now
-    )
-    await conn.close()
-    return [dict(r) for r in rows]
+    try:
+        return await conn.fetch(
+            """
+            UPDATE future_letters f
+            SET claimed_until = NOW() + make_interval(secs => $2), attempts = f.attempts + 1
+            WHERE f.id IN (
+                SELECT id FROM future_letters
+                WHERE is_sent = FALSE AND send_after <= NOW()
+                  AND (claimed_until IS NULL OR claimed_until < NOW())
+                ORDER BY send_after
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING f.id, f.user_id, f.content, f.created_at, f.send_after, f.attempts;
+            """,
+            limit, lease_seconds
+        )
+    finally:
+        await release_connection(conn)
 
-async def fetch_all_unsent_letters():
+async def next_letter_send_after() -> Optional[datetime]:
+    """Время отправки ближайшего неотправленного письма (по частичному индексу send_after)."""
     conn = await get_connection()
-    rows = await conn.fetch(
-        "SELECT * FROM future_letters WHERE is_sent = FALSE;"
-    )
-    await conn.close()
-    return [dict(r) for r in rows]
+    try:
+        return await conn.fetchval(
+            "SELECT MIN(send_after) FROM future_letters WHERE is_sent = FALSE;"
+        )
+    finally:
+        await release_connection(conn)
 
 async def mark_letter_sent(letter_id: int):
     conn = await get_connection()
@@ -338,57 +416,133 @@ async def count_free_letters_in_month(user_id: int, reference_date: Optional[dat
     await conn.close()
     return row["cnt"] if row else 0
 
+async def insert_free_letter_if_available(user_id: int, content: str, send_after: datetime, limit: int = 1) -> Optional[int]:
+    """
+    Одним запросом списывает бесплатное письмо текущего месяца (UTC) и сохраняет письмо.
+    Возвращает id письма или None, если бесплатные письма в этом месяце исчерпаны.
+    """
+    now = datetime.now(timezone.utc)
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).date()
+    conn = await get_connection()
+    try:
+        return await conn.fetchval(
+            """
+            WITH quota AS (
+                INSERT INTO free_letter_quota AS q (user_id, month, used)
+                VALUES ($1, $2, 1)
+                ON CONFLICT (user_id, month) DO UPDATE SET used = q.used + 1
+                WHERE q.used < $3
+                RETURNING used
+            )
+            INSERT INTO future_letters(user_id, content, created_at, send_after, is_sent, is_free)
+            SELECT $1, $4, $5, $6, FALSE, TRUE FROM quota
+            RETURNING id;
+            """,
+            user_id, month_start, limit, content, now, send_after
+        )
+    finally:
+        await release_connection(conn)
+
 # --- Психолог: история и резюме ---
 
-async def save_history_message(user_id: int, role: str, content: str):
-    """Сохраняет сообщение в историю пользователя."""
+# Счётчик сообщений в psychologist_history_counters меняется тем же запросом,
+# что и сама история, поэтому количество сообщений не требует COUNT(*)
+
+async def save_history_message(user_id: int, role: str, content: str) -> int:
+    """Сохраняет сообщение в историю пользователя. Возвращает новое количество сообщений."""
     now = datetime.now(timezone.utc)
     conn = await get_connection()
-    await conn.execute(
-        "INSERT INTO psychologist_history(user_id, role, content, ts) VALUES ($1, $2, $3, $4);",
-        user_id, role, content, now
-    )
-    await conn.close()
+    try:
+        return await conn.fetchval(
+            """
+            WITH inserted AS (
+                INSERT INTO psychologist_history(user_id, role, content, ts, tokens)
+                VALUES ($1, $2, $3, $4, $5)
+                RETURNING id
+            )
+            INSERT INTO psychologist_history_counters AS c (user_id, message_count)
+            SELECT $1, COUNT(*) FROM inserted
+            ON CONFLICT (user_id) DO UPDATE SET message_count = c.message_count + EXCLUDED.message_count
+            RETURNING message_count;
+            """,
+            user_id, role, content, now, count_tokens(content)
+        )
+    finally:
+        await release_connection(conn)
 
-async def save_user_and_bot_messages(user_id: int, user_message: str, bot_message: str):
-    """Сохраняет сообщение пользователя и ответ бота в одной транзакции для ускорения."""
-    conn = await get_connection()
+async def save_user_and_bot_messages(user_id: int, user_message: str, bot_message: str,
+                                     max_messages: Optional[int] = None) -> int:
+    """
+    Одним запросом сохраняет сообщение пользователя и ответ бота, обновляет счётчик
+    сообщений и, если задан max_messages, удаляет самые старые сообщения сверх лимита.
+    Возвращает новое количество сообщений в истории.
+    """
     now = datetime.now(timezone.utc)
-    
+    conn = await get_connection()
     try:
-        # Используем транзакцию для атомарности и скорости
-        async with conn.transaction():
-            # Сохраняем оба сообщения одним запросом для максимальной скорости
-            await conn.executemany(
-                "INSERT INTO psychologist_history(user_id, role, content, ts) VALUES ($1, $2, $3, $4);",
-                [
-                    (user_id, "user", user_message, now),
-                    (user_id, "assistant", bot_message, now)
-                ]
+        # Обрезка выполняется, только если по счётчику история превысит лимит;
+        # иначе условие в подзапросе отбрасывает её без сканирования индекса
+        return await conn.fetchval(
+            """
+            WITH inserted AS (
+                INSERT INTO psychologist_history(user_id, role, content, ts, tokens)
+                VALUES ($1, 'user', $2, $4, $5), ($1, 'assistant', $3, $4, $6)
+                RETURNING id
+            ),
+            trimmed AS (
+                DELETE FROM psychologist_history
+                WHERE id IN (
+                    SELECT id FROM psychologist_history
+                    WHERE user_id = $1
+                      AND $7::int IS NOT NULL
+                      AND COALESCE(
+                          (SELECT message_count FROM psychologist_history_counters WHERE user_id = $1), 0
+                      ) + 2 > $7::int
+                    ORDER BY ts DESC, id DESC
+                    OFFSET GREATEST($7::int - 2, 0)
+                )
+                RETURNING id
             )
+            INSERT INTO psychologist_history_counters AS c (user_id, message_count)
+            VALUES ($1, (SELECT COUNT(*) FROM inserted) - (SELECT COUNT(*) FROM trimmed))
+            ON CONFLICT (user_id) DO UPDATE SET message_count = c.message_count + EXCLUDED.message_count
+            RETURNING message_count;
+            """,
+            user_id, user_message, bot_message, now,
+            count_tokens(user_message), count_tokens(bot_message), max_messages
+        )
     finally:
         await release_connection(conn)
 
 async def count_history_messages(user_id: int) -> int:
-    """Возвращает количество сообщений в истории пользователя."""
+    """Возвращает количество сообщений в истории пользователя (из счётчика)."""
     conn = await get_connection()
     try:
-        row = await conn.fetchrow(
-            "SELECT COUNT(*) AS cnt FROM psychologist_history WHERE user_id = $1;",
+        count = await conn.fetchval(
+            "SELECT message_count FROM psychologist_history_counters WHERE user_id = $1;",
             user_id
         )
-        return row["cnt"] if row else 0
+        return count or 0
     finally:
         await release_connection(conn)
 
 async def clear_history(user_id: int):
     """Очищает историю сообщений пользователя."""
     conn = await get_connection()
-    await conn.execute(
-        "DELETE FROM psychologist_history WHERE user_id = $1;",
-        user_id
-    )
-    await conn.close()
+    try:
+        await conn.execute(
+            """
+            WITH deleted AS (
+                DELETE FROM psychologist_history WHERE user_id = $1 RETURNING id
+            )
+            UPDATE psychologist_history_counters
+            SET message_count = GREATEST(message_count - (SELECT COUNT(*) FROM deleted), 0)
+            WHERE user_id = $1;
+            """,
+            user_id
+        )
+    finally:
+        await release_connection(conn)
 
 async def get_last_user_message_time(user_id: int) -> float:
     """Возвращает timestamp последнего сообщения пользователя (или None)."""
@@ -429,18 +583,95 @@ async def save_summary(user_id: int, summary: str):
 async def delete_oldest_history_messages(user_id: int, n: int):
     """Удаляет n самых старых сообщений пользователя."""
     conn = await get_connection()
-    # Получаем id старейших сообщений
-    rows = await conn.fetch(
-        "SELECT id FROM psychologist_history WHERE user_id = $1 ORDER BY ts ASC LIMIT $2;",
-        user_id, n
-    )
-    ids = [r["id"] for r in rows]
-    if ids:
+    try:
         await conn.execute(
-            f"DELETE FROM psychologist_history WHERE id = ANY($1);",
-            ids
+            """
+            WITH deleted AS (
+                DELETE FROM psychologist_history
+                WHERE id IN (
+                    SELECT id FROM psychologist_history WHERE user_id = $1 ORDER BY ts ASC, id ASC LIMIT $2
+                )
+                RETURNING id
+            )
+            UPDATE psychologist_history_counters
+            SET message_count = GREATEST(message_count - (SELECT COUNT(*) FROM deleted), 0)
+            WHERE user_id = $1;
+            """,
+            user_id, n
         )
-    await conn.close()
+    finally:
+        await release_connection(conn)
+
+async def get_history_for_compaction(user_id: int, keep: int):
+    """
+    Возвращает текущее резюме, время его обновления и все сообщения сверх keep последних
+    (от старых к новым, с id) — всё из одного снимка данных, без отдельного COUNT.
+    """
+    conn = await get_connection()
+    try:
+        async with conn.transaction(isolation='repeatable_read', readonly=True):
+            summary_row = await conn.fetchrow(
+                "SELECT summary, ts FROM psychologist_summary WHERE user_id = $1;",
+                user_id
+            )
+            rows = await conn.fetch(
+                """
+                SELECT id, role, content FROM psychologist_history
+                WHERE user_id = $1
+                ORDER BY ts DESC, id DESC
+                OFFSET $2;
+                """,
+                user_id, keep
+            )
+        summary = summary_row["summary"] if summary_row else None
+        summary_ts = summary_row["ts"] if summary_row else None
+        messages = [{"id": r["id"], "role": r["role"], "content": r["content"]} for r in reversed(rows)]
+        return summary, summary_ts, messages
+    finally:
+        await release_connection(conn)
+
+async def apply_history_compaction(user_id: int, summary: str, message_ids: list, expected_summary_ts: Optional[datetime]) -> bool:
+    """
+    В одной транзакции сохраняет новое резюме и удаляет сжатые сообщения.
+    Если резюме успело измениться с момента чтения (параллельное сжатие), ничего не делает и возвращает False.
+    """
+    now = datetime.now(timezone.utc)
+    conn = await get_connection()
+    try:
+        async with conn.transaction():
+            # Блокировка на пользователя, чтобы два сжатия (в т.ч. с разных инстансов) не пересеклись
+            await conn.execute("SELECT pg_advisory_xact_lock($1);", user_id)
+            current_ts = await conn.fetchval(
+                "SELECT ts FROM psychologist_summary WHERE user_id = $1;",
+                user_id
+            )
+            if current_ts != expected_summary_ts:
+                return False
+            await conn.execute(
+                """
+                INSERT INTO psychologist_summary(user_id, summary, ts)
+                VALUES ($1, $2, $3)
+                ON CONFLICT(user_id) DO UPDATE SET summary = EXCLUDED.summary, ts = EXCLUDED.ts;
+                """,
+                user_id, summary, now
+            )
+            if message_ids:
+                await conn.execute(
+                    """
+                    WITH deleted AS (
+                        DELETE FROM psychologist_history
+                        WHERE user_id = $1 AND id = ANY($2::int[])
+                        RETURNING id
+                    )
+                    UPDATE psychologist_history_counters
+                    SET message_count = GREATEST(message_count - (SELECT COUNT(*) FROM deleted), 0)
+                    WHERE user_id = $1;
+                    """,
+                    user_id, message_ids
+                )
+        return True
+    finally:
+        await release_connection(conn)
 
 async def get_summary(user_id: int) -> str:
     """Возвращает текущее резюме пользователя (или None)."""
@@ -464,12 +695,20 @@ async def get_summary_and_history(user_id: int, m: int = 5):
         )
         
         history_rows = await conn.fetch(
-            "SELECT role, content FROM psychologist_history WHERE user_id = $1 ORDER BY ts DESC LIMIT $2;",
+            "SELECT role, content, tokens FROM psychologist_history WHERE user_id = $1 ORDER BY ts DESC LIMIT $2;",
             user_id, m
         )
         
         summary = summary_row["summary"] if summary_row else None
-        history = [{"role": r["role"], "content": r["content"]} for r in reversed(history_rows)]
+        # Для старых записей без сохранённого количества токенов считаем его локально
+        history = [
+            {
+                "role": r["role"],
+                "content": r["content"],
+                "tokens": r["tokens"] if r["tokens"] is not None else count_tokens(r["content"])
+            }
+            for r in reversed(history_rows)
+        ]
         
         return summary, history
     finally:
@@ -547,20 +786,68 @@ async def get_free_count(user_id: int) -> int:
 
 async def increment_free_count(user_id: int) -> int:
     conn = await get_connection()
-    await conn.execute(
-        """
-        INSERT INTO psychologist_free_count(user_id, free_count)
-        VALUES ($1, 1)
-        ON CONFLICT(user_id) DO UPDATE SET free_count = psychologist_free_count.free_count + 1;
-        """,
-        user_id
-    )
-    row = await conn.fetchrow(
-        "SELECT free_count FROM psychologist_free_count WHERE user_id = $1;",
-        user_id
-    )
-    await conn.close()
-    return row["free_count"] if row else 1
+    try:
+        count = await conn.fetchval(
+            """
+            INSERT INTO psychologist_free_count(user_id, free_count)
+            VALUES ($1, 1)
+            ON CONFLICT(user_id) DO UPDATE SET free_count = psychologist_free_count.free_count + 1
+            RETURNING free_count;
+            """,
+            user_id
+        )
+    finally:
+        await release_connection(conn)
+    return count if count is not None else 1
+
+async def fetch_psychologist_access(user_id: int) -> dict:
+    """Одним запросом возвращает срок подписки психолога и число использованных бесплатных сообщений."""
+    conn = await get_connection()
+    try:
+        row = await conn.fetchrow(
+            """
+            SELECT
+                (SELECT expires_at FROM subscriptions WHERE user_id = $1 AND type = 'psychologist') AS expires_at,
+                (SELECT free_count FROM psychologist_free_count WHERE user_id = $1) AS free_count;
+            """,
+            user_id
+        )
+    finally:
+        await release_connection(conn)
+    return {"expires_at": row["expires_at"], "free_count": row["free_count"] or 0}
+
+async def consume_free_message(user_id: int, limit: int) -> Optional[int]:
+    """
+    Атомарно списывает одно бесплатное сообщение психолога, если лимит ещё не исчерпан.
+    Возвращает новое количество использованных сообщений или None, если лимит исчерпан.
+    """
+    if limit <= 0:
+        return None
+    conn = await get_connection()
+    try:
+        return await conn.fetchval(
+            """
+            INSERT INTO psychologist_free_count AS f (user_id, free_count)
+            VALUES ($1, 1)
+            ON CONFLICT(user_id) DO UPDATE SET free_count = f.free_count + 1
+            WHERE f.free_count < $2
+            RETURNING free_count;
+            """,
+            user_id, limit
+        )
+    finally:
+        await release_connection(conn)
+
+async def refund_free_message(user_id: int):
+    """Возвращает списанное бесплатное сообщение (например, если ответ не удалось получить)."""
+    conn = await get_connection()
+    try:
+        await conn.execute(
+            "UPDATE psychologist_free_count SET free_count = GREATEST(free_count - 1, 0) WHERE user_id = $1;",
+            user_id
+        )
+    finally:
+        await release_connection(conn)
 
 async def reset_free_count(user_id: int):
     conn = await get_connection()
@@ -582,6 +869,120 @@ async def set_free_count(user_id: int, value: int):
     )
     await conn.close()
 
+# --- Платежи ---
+
+# Конечные статусы платежа ЮKassa: после них статус больше не меняется
+PAYMENT_TERMINAL_STATUSES = ('succeeded', 'canceled')
+
+async def save_payment(payment_id: str, user_id: int, amount, description: str, status: str = 'pending'):
+    """Сохраняет созданный платёж."""
+    conn = await get_connection()
+    try:
+        await conn.execute(
+            """
+            INSERT INTO payments(payment_id, user_id, amount, description, status)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT(payment_id) DO NOTHING;
+            """,
+            payment_id, user_id, Decimal(str(amount)), description, status
+        )
+    finally:
+        await release_connection(conn)
+
+async def get_payment_status(payment_id: str) -> Optional[str]:
+    """Последний известный статус платежа или None, если платёж не сохранён."""
+    conn = await get_connection()
+    try:
+        return await conn.fetchval("SELECT status FROM payments WHERE payment_id = $1;", payment_id)
+    finally:
+        await release_connection(conn)
+
+async def update_payment_status(payment_id: str, status: str) -> bool:
+    """
+    Записывает новый статус платежа. Конечный статус не перезаписывается.
+    Возвращает True, если статус изменился.
+    """
+    conn = await get_connection()
+    try:
+        changed = await conn.fetchval(
+            """
+            INSERT INTO payments AS p (payment_id, status)
+            VALUES ($1, $2)
+            ON CONFLICT(payment_id) DO UPDATE SET status = EXCLUDED.status, updated_at = NOW()
+            WHERE p.status <> EXCLUDED.status AND p.status <> ALL($3::text[])
+            RETURNING TRUE;
+            """,
+            payment_id, status, list(PAYMENT_TERMINAL_STATUSES)
+        )
+    finally:
+        await release_connection(conn)
+    return bool(changed)
+
+async def reserve_payment_intent(user_id: int, product: str, amount, description: str,
+                                 idempotence_key: str, reuse_seconds: int):
+    """
+    Возвращает намерение оплаты (user_id, product): idempotence_key, payment_id, confirmation_url.
+
+    Существующее намерение переиспользуется, пока его платёж не завершён, сумма совпадает
+    и не прошло reuse_seconds; иначе оно заменяется новым с переданным ключом идемпотентности.
+    """
+    conn = await get_connection()
+    try:
+        query_args = (user_id, product, Decimal(str(amount)), description, idempotence_key, reuse_seconds,
+                      list(PAYMENT_TERMINAL_STATUSES))
+        row = await conn.fetchrow(
+            """
+            WITH upsert AS (
+                INSERT INTO payment_intents AS i (user_id, product, amount, description, idempotence_key)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT(user_id, product) DO UPDATE SET
+                    amount = EXCLUDED.amount,
+                    description = EXCLUDED.description,
+                    idempotence_key = EXCLUDED.idempotence_key,
+                    payment_id = NULL,
+                    confirmation_url = NULL,
+                    created_at = NOW()
+                WHERE i.created_at < NOW() - make_interval(secs => $6)
+                   OR i.amount <> EXCLUDED.amount
+                   OR EXISTS (
+                       SELECT 1 FROM payments p
+                       WHERE p.payment_id = i.payment_id AND p.status = ANY($7::text[])
+                   )
+                RETURNING idempotence_key, payment_id, confirmation_url
+            )
+            SELECT idempotence_key, payment_id, confirmation_url FROM upsert
+            UNION ALL
+            SELECT idempotence_key, payment_id, confirmation_url FROM payment_intents
+            WHERE user_id = $1 AND product = $2 AND NOT EXISTS (SELECT 1 FROM upsert);
+            """,
+            *query_args
+        )
+        if row is None:
+            # Параллельная вставка того же намерения не видна в снимке запроса — читаем ещё раз
+            row = await conn.fetchrow(
+                "SELECT idempotence_key, payment_id, confirmation_url FROM payment_intents "
+                "WHERE user_id = $1 AND product = $2;",
+                user_id, product
+            )
+        return row
+    finally:
+        await release_connection(conn)
+
+async def attach_payment_to_intent(user_id: int, product: str, idempotence_key: str,
+                                   payment_id: str, confirmation_url: str):
+    """Привязывает созданный платёж к намерению (если оно не было заменено)."""
+    conn = await get_connection()
+    try:
+        await conn.execute(
+            """
+            UPDATE payment_intents SET payment_id = $4, confirmation_url = $5
+            WHERE user_id = $1 AND product = $2 AND idempotence_key = $3;
+            """,
+            user_id, product, idempotence_key, payment_id, confirmation_url
+        )
+    finally:
+        await release_connection(conn)
+
 # --- Функции управления сервисами ---
 
 async def get_service_status(service_name: str) -> dict:
@@ -642,23 +1043,27 @@ async def is_service_active(service_name: str) -> bool:
 
 # --- Функции для работы с пользователями ---
 
+ACTIVE_USER_DAYS = 30  # пользователь считается активным, если заходил за последние 30 дней
+
 async def upsert_user(user_id: int, username: str = None, first_name: str = None, last_name: str = None):
     """Добавляет или обновляет информацию о пользователе."""
     conn = await get_connection()
     now = datetime.now(timezone.utc)
-    await conn.execute(
-        """
-        INSERT INTO users(user_id, username, first_name, last_name, created_at, last_activity)
-        VALUES ($1, $2, $3, $4, $5, $6)
-        ON CONFLICT(user_id) DO UPDATE SET
-            username = COALESCE(EXCLUDED.username, users.username),
-            first_name = COALESCE(EXCLUDED.first_name, users.first_name),
-            last_name = COALESCE(EXCLUDED.last_name, users.last_name),
-            last_activity = EXCLUDED.last_activity;
-        """,
-        user_id, username, first_name, last_name, now, now
-    )
-    await conn.close()
+    try:
+        await conn.execute(
+            """
+            INSERT INTO users(user_id, username, first_name, last_name, created_at, last_activity)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = COALESCE(EXCLUDED.username, users.username),
+                first_name = COALESCE(EXCLUDED.first_name, users.first_name),
+                last_name = COALESCE(EXCLUDED.last_name, users.last_name),
+                last_activity = EXCLUDED.last_activity;
+            """,
+            user_id, username, first_name, last_name, now, now
+        )
+    finally:
+        await release_connection(conn)
 
 async def get_all_users(active_only: bool = False, limit: int = None) -> list:
     """
@@ -669,7 +1074,7 @@ async def get_all_users(active_only: bool = False, limit: int = None) -> list:
         limit: Максимальное количество пользователей для возврата (None = все)
     
     Returns:
-        list: Список пользователей
+        list: Список записей asyncpg (user_id, username, first_name, last_name, created_at, last_activity)
     """
     conn = await get_connection()
     
@@ -717,17 +1122,8 @@ async def get_all_users(active_only: bool = False, limit: int = None) -> list:
             )
     
     await conn.close()
-    return [
-        {
-            "user_id": row["user_id"],
-            "username": row["username"],
-            "first_name": row["first_name"],
-            "last_name": row["last_name"],
-            "created_at": row["created_at"],
-            "last_activity": row["last_activity"]
-        }
-        for row in rows
-    ]
+    # Записи asyncpg отдаём как есть: доступ по ключу тот же, без копирования в словари
+    return rows
 
 async def get_users_batch(limit: int = 1000, offset: int = 0, active_only: bool = True) -> list:
     """
@@ -739,7 +1135,7 @@ async def get_users_batch(limit: int = 1000, offset: int = 0, active_only: bool
         active_only: Если True, возвращает только активных пользователей (за последние 30 дней)
     
     Returns:
-        list: Список пользователей
+        list: Список записей asyncpg (user_id, username, first_name, last_name, created_at, last_activity)
     """
     conn = await get_connection()
     
@@ -767,17 +1163,8 @@ async def get_users_batch(limit: int = 1000, offset: int = 0, active_only: bool
         )
     
     await conn.close()
-    return [
-        {
-            "user_id": row["user_id"],
-            "username": row["username"],
-            "first_name": row["first_name"],
-            "last_name": row["last_name"],
-            "created_at": row["created_at"],
-            "last_activity": row["last_activity"]
-        }
-        for row in rows
-    ]
+    # Записи asyncpg отдаём как есть: доступ по ключу тот же, без копирования в словари
+    return rows
 
 async def get_users_count(active_only: bool = True) -> int:
     """
@@ -803,6 +1190,26 @@ async def get_users_count(active_only: bool = True) -> int:
     await conn.close()
     return row["cnt"] if row else 0
 
+async def fetch_user_stats() -> dict:
+    """Всего / активных / новых за сегодня (UTC) пользователей — одним проходом по users."""
+    now = datetime.now(timezone.utc)
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    conn = await get_connection()
+    try:
+        row = await conn.fetchrow(
+            """
+            SELECT
+                COUNT(*) AS total,
+                COUNT(*) FILTER (WHERE last_activity >= $1) AS active,
+                COUNT(*) FILTER (WHERE created_at >= $2) AS new_today
+            FROM users;
+            """,
+            now - timedelta(days=ACTIVE_USER_DAYS), day_start
+        )
+    finally:
+        await release_connection(conn)
+    return {"total": row["total"], "active": row["active"], "new_today": row["new_today"], "day": day_start.date()}
+
 async def get_active_users_count() -> int:
     """Получает количество активных пользователей (за последние 30 дней)."""
     conn = await get_connection()
@@ -816,66 +1223,54 @@ async def get_active_users_count() -> int:
 
 # --- Функции для работы с уведомлениями ---
 
+# Канал LISTEN/NOTIFY, в который сообщается о новых уведомлениях
+NOTIFICATIONS_CHANNEL = 'notifications_changed'
+
 async def create_notification(text: str, media_files: list = None, scheduled_at: datetime = None, created_by: int = None) -> int:
     """Создает новое уведомление и возвращает его ID."""
-    import json
-    
     conn = await get_connection()
     now = datetime.now(timezone.utc)
     
-    # Если media_files не передан, используем пустой список
+    # Если media_files не передан, используем пустой список; в JSONB сериализует драйвер
     if media_files is None:
         media_files = []
     
-    # Сериализуем media_files в JSON строку
-    media_files_json = json.dumps(media_files) if media_files else "[]"
-    
+    # pg_notify будит планировщики рассылок всех инстансов (см. utils/notification_sender.py);
+    # уведомление доставляется слушателям только после фиксации транзакции
     row = await conn.fetchrow(
         """
-        INSERT INTO notifications(text, media_files, scheduled_at, created_by, created_at)
-        VALUES ($1, $2, $3, $4, $5)
-        RETURNING id
+        WITH ins AS (
+            INSERT INTO notifications(text, media_files, scheduled_at, created_by, created_at)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING id
+        )
+        SELECT id, pg_notify($6, id::text) FROM ins;
         """,
-        text, media_files_json, scheduled_at, created_by, now
+        text, media_files, scheduled_at, created_by, now, NOTIFICATIONS_CHANNEL
     )
     await conn.close()
     return row['id'] if row else None
 
-async def get_notification(notification_id: int) -> dict:
+async def get_notification(notification_id: int) -> Optional[Notification]:
     """Получает уведомление по ID."""
-    import json
-    
     conn = await get_connection()
     row = await conn.fetchrow(
-        "SELECT * FROM notifications WHERE id = $1;",
+        f"SELECT {Notification.COLUMNS} FROM notifications WHERE id = $1;",
         notification_id
     )
     await conn.close()
-    if row:
-        result = dict(row)
-        # Десериализуем media_files из JSON
-        if result.get('media_files') and result['media_files'] != '[]':
-            try:
-                result['media_files'] = json.loads(result['media_files'])
-            except (json.JSONDecodeError, TypeError):
-                result['media_files'] = []
-        else:
-            result['media_files'] = []
-        return result
-    return None
+    return Notification.from_record(row) if row else None
 
-async def get_pending_notifications() -> list:
+async def get_pending_notifications() -> List[Notification]:
     """Получает все ожидающие отправки уведомления."""
-    import json
-    
     conn = await get_connection()
     now = datetime.now(timezone.utc)
     
     # Для запланированных уведомлений проверяем, что время прошло
     # Для немедленных уведомлений (scheduled_at IS NULL) отправляем сразу
     rows = await conn.fetch(
-        """
-        SELECT * FROM notifications 
+        f"""
+        SELECT {Notification.COLUMNS} FROM notifications 
         WHERE is_sent = FALSE 
         AND (scheduled_at IS NULL OR scheduled_at <= $1)
         ORDER BY 
@@ -886,21 +1281,7 @@ async def get_pending_notifications() -> list:
         now
     )
     await conn.close()
-    
-    result = []
-    for row in rows:
-        notification = dict(row)
-        # Десериализуем media_files из JSON
-        if notification.get('media_files') and notification['media_files'] != '[]':
-            try:
-                notification['media_files'] = json.loads(notification['media_files'])
-            except (json.JSONDecodeError, TypeError):
-                notification['media_files'] = []
-        else:
-            notification['media_files'] = []
-        result.append(notification)
-    
-    return result
+    return [Notification.from_record(row) for row in rows]
 
 async def mark_notification_sent(notification_id: int):
     """Отмечает уведомление как отправленное."""
@@ -912,58 +1293,57 @@ async def mark_notification_sent(notification_id: int):
     )
     await conn.close()
 
-async def get_notifications_history(limit: int = 50) -> list:
-    """Получает историю уведомлений."""
-    import json
-    
+async def get_notifications_history(limit: int = 50, media_type: Optional[str] = None) -> List[Notification]:
+    """
+    Получает историю уведомлений.
+    media_type ('photo', 'video', 'document') оставляет только уведомления с таким вложением — фильтр выполняется в БД.
+    """
     conn = await get_connection()
     rows = await conn.fetch(
-        """
-        SELECT * FROM notifications 
+        f"""
+        SELECT {Notification.COLUMNS} FROM notifications 
+        WHERE $2::text IS NULL
+           OR media_files @> jsonb_build_array(jsonb_build_object('type', $2::text))
         ORDER BY created_at DESC 
         LIMIT $1;
         """,
-        limit
+        limit, media_type
     )
     await conn.close()
-    
-    result = []
-    for row in rows:
-        notification = dict(row)
-        # Десериализуем media_files из JSON
-        if notification.get('media_files') and notification['media_files'] != '[]':
-            try:
-                notification['media_files'] = json.loads(notification['media_files'])
-            except (json.JSONDecodeError, TypeError):
-                notification['media_files'] = []
-        else:
-            notification['media_files'] = []
-        result.append(notification)
-    
-    return result
+    return [Notification.from_record(row) for row in rows]
 
 
 async def get_next_notification_time() -> Optional[datetime]:
-    """Получает время следующего запланированного уведомления."""
+    """
+    Время ближайшего неотправленного уведомления. Может быть в прошлом, если уведомление
+    уже наступило, но не отправлено (ошибка рассылки); немедленные (scheduled_at IS NULL)
+    считаются наступившими сейчас. None — неотправленных уведомлений нет.
+    """
     conn = await get_connection()
-    now = datetime.now(timezone.utc)
     
-    # Ищем ближайшее запланированное уведомление в ближайшие 5 минут
+    # Неотправленных уведомлений единицы (частичный индекс idx_notifications_unsent_scheduled)
     row = await conn.fetchrow(
         """
         SELECT scheduled_at FROM notifications 
         WHERE is_sent = FALSE 
-        AND scheduled_at IS NOT NULL 
-        AND scheduled_at > $1 
-        AND scheduled_at <= $2
-        ORDER BY scheduled_at ASC 
+        ORDER BY scheduled_at ASC NULLS FIRST 
         LIMIT 1;
-        """,
-        now, now + timedelta(minutes=5)
+        """
     )
     await conn.close()
     
-    return row['scheduled_at'] if row else None
+    if row is None:
+        return None
+    return row['scheduled_at'] or datetime.now(timezone.utc)
+
+async def open_listener(channel: str, callback):
+    """
+    Открывает отдельное (не из пула) соединение, подписанное на канал LISTEN/NOTIFY.
+    Соединение из пула не подходит: при возврате в пул подписки сбрасываются.
+    """
+    conn = await asyncpg.connect(DATABASE_URL)
+    await conn.add_listener(channel, callback)
+    return conn
 
 
 
@@ -983,28 +1363,42 @@ async def update_user_activity(user_id: int):
     await conn.close()
 
 
-async def batch_update_user_activity(user_ids: list):
-    """Пакетное обновление активности пользователей (оптимизированная версия)."""
+async def batch_update_user_activity(user_ids: list) -> tuple[int, int]:
+    """
+    Пакетное обновление активности пользователей (оптимизированная версия).
+    Возвращает (новых пользователей, вернувшихся в активные) — для счётчиков статистики.
+    """
     if not user_ids:
-        return
+        return 0, 0
     
     conn = await get_connection()
     now = datetime.now(timezone.utc)
     
     try:
-        # Используем VALUES для пакетной вставки без временной таблицы
-        values_list = []
-        for user_id in user_ids:
-            values_list.append(f"({user_id}, '{now.isoformat()}')")
-        
-        values_str = ", ".join(values_list)
-        
-        # Обновляем активность всех пользователей одним запросом
-        await conn.execute(f"""
-            INSERT INTO users(user_id, last_activity)
-            VALUES {values_str}
-            ON CONFLICT(user_id) DO UPDATE SET last_activity = EXCLUDED.last_activity;
-        """)
+        # Обновляем активность всех пользователей одним запросом; прежнее время активности
+        # читается из снимка до обновления, поэтому видно, кто новый, а кто вернулся
+        row = await conn.fetchrow(
+            """
+            WITH input AS (
+                SELECT DISTINCT unnest($1::bigint[]) AS user_id
+            ),
+            old AS (
+                SELECT u.user_id, u.last_activity FROM users u JOIN input USING (user_id)
+            ),
+            upserted AS (
+                INSERT INTO users(user_id, last_activity)
+                SELECT user_id, $2 FROM input
+                ON CONFLICT(user_id) DO UPDATE SET last_activity = EXCLUDED.last_activity
+                RETURNING user_id
+            )
+            SELECT
+                COUNT(*) FILTER (WHERE old.user_id IS NULL) AS inserted,
+                COUNT(*) FILTER (WHERE old.last_activity < $3) AS reactivated
+            FROM upserted LEFT JOIN old USING (user_id);
+            """,
+            list(user_ids), now, now - timedelta(days=ACTIVE_USER_DAYS)
+        )
+        return row["inserted"], row["reactivated"]
         
     except Exception as e:
         # Если пакетная вставка не удалась, используем обычную
@@ -1021,6 +1415,8 @@ async def batch_update_user_activity(user_ids: list):
             except Exception as inner_e:
                 # Логируем ошибку, но продолжаем обработку
                 print(f"Ошибка при обновлении активности пользователя {user_id}: {inner_e}")
+        # Точные приращения неизвестны — счётчики поправит сверка
+        return 0, 0
     
     finally:
         await conn.close()
@@ -1252,3 +1648,8 @@ async def cleanup_old_ideas_sessions(days: int = 30) -> int:
         return deleted_count
     finally:
         await conn.close()
+
+
+
+# Профилирование: все публичные функции модуля собирают статистику вызовов
+instrument_module(globals(), exclude=('init_connection_pool', 'get_connection', 'release_connection'))
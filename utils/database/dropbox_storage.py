@@ -1,9 +1,15 @@
 import os
+import json
+import time
+import threading
 import dropbox
 import hashlib
 import tempfile
 import shutil
-from dropbox.files import WriteMode, FileMetadata, FolderMetadata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dropbox.files import (
+    WriteMode, FileMetadata, FolderMetadata, DeletedMetadata, RelocationPathsArg, UploadSessionCursor, CommitInfo,
+)
 from typing import Optional
 from config import APP_KEY, APP_SECRET, REFRESH_TOKEN, logger
 
@@ -16,10 +22,30 @@ dbx = dropbox.Dropbox(
     app_secret=APP_SECRET,
 )
 
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # файлы крупнее загружаются сессией, по частям с диска
+
+
 def upload_file(local_path: str, dropbox_path: str) -> Optional[str]:
+    """
+    Загружает файл в Dropbox. Небольшие файлы — одним запросом, крупные — сессией загрузки
+    частями по UPLOAD_CHUNK_SIZE, не читая файл в память целиком.
+    Безопасно вызывать из нескольких потоков одновременно.
+    """
     try:
+        client = _thread_dbx()
+        size = os.path.getsize(local_path)
         with open(local_path, 'rb') as f:
-            dbx.files_upload(f.read(), dropbox_path, mode=WriteMode.overwrite)
+            if size <= UPLOAD_CHUNK_SIZE:
+                client.files_upload(f.read(), dropbox_path, mode=WriteMode.overwrite)
+                return dropbox_path
+            session = client.files_upload_session_start(f.read(UPLOAD_CHUNK_SIZE))
+            cursor = UploadSessionCursor(session_id=session.session_id, offset=f.tell())
+            while size - f.tell() > UPLOAD_CHUNK_SIZE:
+                client.files_upload_session_append_v2(f.read(UPLOAD_CHUNK_SIZE), cursor)
+                cursor.offset = f.tell()
+            client.files_upload_session_finish(
+                f.read(), cursor, CommitInfo(path=dropbox_path, mode=WriteMode.overwrite)
+            )
         return dropbox_path
     except Exception as e:
         logger.error(f'Ошибка загрузки {local_path}: {str(e)}')
@@ -57,116 +83,442 @@ def file_content_hash(path):
             hasher.update(hashlib.sha256(block).digest())
     return hasher.hexdigest()
 
-def sync_resources_hash():
+RESOURCES_DROPBOX_ROOT = '/resources'
+RESOURCES_LOCAL_ROOT = 'resources'
+SYNC_MANIFEST_PATH = os.path.join(RESOURCES_LOCAL_ROOT, '.sync_manifest.json')
+SYNC_STAGING_DIR = os.path.join(RESOURCES_LOCAL_ROOT, '.sync_staging')
+SYNC_DOWNLOAD_WORKERS = 8  # параллельных скачиваний
+
+_sync_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def _thread_dbx():
+    """Клиент Dropbox для текущего потока (у каждого потока своя HTTP-сессия)."""
+    client = getattr(_thread_local, 'dbx', None)
+    if client is None:
+        client = _thread_local.dbx = dbx.clone()
+    return client
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(SYNC_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get('files'), dict):
+            return manifest
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f'Манифест синхронизации повреждён, выполняем полную синхронизацию: {e}')
+    return {'cursor': None, 'files': {}}
+
+
+def _save_manifest(manifest: dict):
+    """Записывает манифест атомарно: при сбое остаётся предыдущая версия."""
+    os.makedirs(RESOURCES_LOCAL_ROOT, exist_ok=True)
+    tmp_path = SYNC_MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, SYNC_MANIFEST_PATH)
+
+
+def _local_path(path_display: str) -> str:
+    relative = path_display[len(RESOURCES_DROPBOX_ROOT):].lstrip('/')
+    return os.path.join(RESOURCES_LOCAL_ROOT, *relative.split('/'))
+
+
+def _local_matches(entry: dict) -> bool:
+    """Локальный файл не менялся с момента записи в манифест (проверка по размеру и mtime, без чтения)."""
+    try:
+        st = os.stat(entry['path'])
+    except OSError:
+        return False
+    return st.st_size == entry['size'] and int(st.st_mtime) == entry['mtime']
+
+
+def _manifest_entry(local_path: str, content_hash: str) -> dict:
+    st = os.stat(local_path)
+    return {'path': local_path, 'size': st.st_size, 'mtime': int(st.st_mtime), 'content_hash': content_hash}
+
+
+def _download(remote: FileMetadata, local_path: str) -> dict:
+    """Скачивает файл во временный файл рядом с целевым и атомарно подменяет его."""
+    folder = os.path.dirname(local_path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.sync_', dir=folder)
+    os.close(fd)
+    try:
+        _thread_dbx().files_download_to_file(tmp_path, remote.path_lower)
+        os.replace(tmp_path, local_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return _manifest_entry(local_path, remote.content_hash)
+
+
+def _list_changes(cursor: Optional[str]):
     """
-    Синхронизирует папку resources с Dropbox по хешам:
-    - Скачивает только новые/изменённые файлы
-    - Удаляет локальные файлы, которых нет в Dropbox
-    - Не трогает совпадающие
+    Изменения в /resources: с курсором — только новое с прошлой синхронизации,
+    без курсора — полный рекурсивный список. Возвращает (entries, cursor, full).
     """
-    def _sync(dropbox_folder, local_folder):
-        os.makedirs(local_folder, exist_ok=True)
+    full = cursor is None
+    if not full:
         try:
-            result = dbx.files_list_folder(dropbox_folder)
-            if result is None:
-                logger.error(f'Ошибка при хеш-синхронизации папки {dropbox_folder}: пустой ответ от Dropbox')
-                return
-            entries = getattr(result, 'entries', [])
-            dropbox_files = {}
-            dropbox_folders = set()
-            for entry in entries:
-                dropbox_path = entry.path_lower
-                local_path = os.path.join(local_folder, entry.name)
-                if isinstance(entry, FileMetadata):
-                    dropbox_files[entry.name] = entry.content_hash
-                elif isinstance(entry, FolderMetadata):
-                    dropbox_folders.add(entry.name)
-                    _sync(dropbox_path, local_path)
-            for fname, dbx_hash in dropbox_files.items():
-                local_path = os.path.join(local_folder, fname)
-                if not os.path.exists(local_path):
-                    metadata, response = dbx.files_download(f"{dropbox_folder}/{fname}")
-                    if response is None:
-                        logger.error(f'Ошибка скачивания файла {dropbox_folder}/{fname}: пустой ответ от Dropbox')
+            result = dbx.files_list_folder_continue(cursor)
+        except dropbox.exceptions.ApiError as e:
+            # Курсор устарел (например, папку пересоздали) — нужна полная синхронизация
+            logger.warning(f'Курсор Dropbox недействителен, выполняем полную синхронизацию: {e}')
+            full = True
+    if full:
+        result = dbx.files_list_folder(RESOURCES_DROPBOX_ROOT, recursive=True)
+    entries = list(result.entries)
+    while result.has_more:
+        result = dbx.files_list_folder_continue(result.cursor)
+        entries.extend(result.entries)
+    return entries, result.cursor, full
+
+
+def _stage_local_copies(to_download: list, local_by_hash: dict) -> list:
+    """
+    Для новых файлов Dropbox, содержимое которых уже есть локально (файл переименован или
+    перемещён, например при перенумерации), откладывает локальную копию в staging вместо скачивания.
+    Возвращает [(key, staged_path, local_path, content_hash)].
+    """
+    staged = []
+    for key, remote, local_path in to_download:
+        source = local_by_hash.get(remote.content_hash)
+        if source is None or not _local_matches(source):
+            continue
+        os.makedirs(SYNC_STAGING_DIR, exist_ok=True)
+        staged_path = os.path.join(SYNC_STAGING_DIR, str(len(staged)))
+        try:
+            # Жёсткая ссылка не копирует данные и переживает удаление или подмену исходного пути
+            os.link(source['path'], staged_path)
+        except OSError:
+            try:
+                shutil.copyfile(source['path'], staged_path)
+            except OSError:
+                continue
+        staged.append((key, staged_path, local_path, remote.content_hash))
+    return staged
+
+
+def _listing_failed_stats(start: float, error: Exception) -> dict:
+    """Статистика синхронизации, не получившей список изменений: локальные файлы и манифест не тронуты."""
+    logger.error(f'Не удалось получить список изменений Dropbox, используем локальную копию resources: {error}')
+    return {
+        'full': False, 'changes': 0, 'downloaded': 0, 'moved': 0, 'skipped': 0, 'deleted': 0,
+        'failed': 0, 'error': f'{type(error).__name__}: {error}',
+        'seconds': round(time.monotonic() - start, 2),
+    }
+
+
+def _remove_local(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def sync_resources_hash(full: bool = False) -> dict:
+    """
+    Синхронизирует папку resources с Dropbox.
+
+    Локальный манифест хранит для каждого файла путь, размер, mtime и content_hash Dropbox,
+    а также курсор list_folder. Повторный запуск запрашивает у Dropbox только изменения
+    по курсору и сверяет локальные файлы по размеру и mtime, не перечитывая их.
+    Изменённые файлы скачиваются параллельно во временные файлы с атомарной подменой;
+    переименованные в Dropbox файлы переносятся из локальных копий без скачивания.
+    full=True — полный список папки и удаление локальных файлов, которых нет в Dropbox.
+    Возвращает статистику синхронизации. Если Dropbox недоступен, исключение не выбрасывается:
+    локальная копия и манифест остаются как есть, а в stats['error'] записывается причина.
+    """
+    with _sync_lock:
+        start = time.monotonic()
+        # Сначала переименовываем только фоны и рисунки
+        rename_and_sync_dropbox_images('/resources/images')
+        rename_and_sync_dropbox_images('/resources/backgrounds')
+
+        manifest = _load_manifest()
+        files = manifest['files']
+        # Локальные файлы по содержимому: перемещённые в Dropbox файлы не скачиваются повторно
+        local_by_hash = {entry['content_hash']: entry for entry in files.values()}
+        try:
+            entries, cursor, full = _list_changes(None if full else manifest.get('cursor'))
+        except Exception as e:
+            return _listing_failed_stats(start, e)
+
+        remote_files = {}
+        removed_paths = []
+        deleted = 0
+        for entry in entries:
+            key = entry.path_lower
+            if isinstance(entry, FileMetadata):
+                if entry.name.startswith(RENUMBER_TMP_PREFIX):
+                    # Временные имена перенумерации локально не нужны: файл встанет на место при следующем проходе
+                    continue
+                remote_files[key] = entry
+            elif isinstance(entry, FolderMetadata):
+                os.makedirs(_local_path(entry.path_display), exist_ok=True)
+            elif isinstance(entry, DeletedMetadata):
+                # Удалён файл или папка целиком — убираем всё под этим путём
+                # (удаление откладывается: файл может оказаться источником для перемещённого)
+                for gone in [k for k in remote_files if k == key or k.startswith(key + '/')]:
+                    del remote_files[gone]
+                for stale in [k for k in files if k == key or k.startswith(key + '/')]:
+                    removed_paths.append(files.pop(stale)['path'])
+                    deleted += 1
+                if key != RESOURCES_DROPBOX_ROOT:
+                    removed_paths.append(_local_path(entry.path_display))
+
+        if not full:
+            # Файлы, изменённые или удалённые локально, перекачиваются при полной сверке
+            drifted = [k for k, entry in files.items() if k not in remote_files and not _local_matches(entry)]
+            if drifted:
+                logger.info(f'Локальные файлы изменены вне синхронизации ({len(drifted)}), выполняем полную сверку')
+                try:
+                    entries, cursor, full = _list_changes(None)
+                except Exception as e:
+                    return _listing_failed_stats(start, e)
+                remote_files = {e.path_lower: e for e in entries if isinstance(e, FileMetadata)}
+
+        to_download = []
+        skipped = 0
+        for key, remote in remote_files.items():
+            local_path = _local_path(remote.path_display)
+            known = files.get(key)
+            if known and known['content_hash'] == remote.content_hash and known['path'] == local_path \
+                    and _local_matches(known):
+                skipped += 1
+                continue
+            if os.path.isfile(local_path):
+                # Файл уже есть (например, загружен из админки), но не записан в манифест — сверяем хеш один раз
+                try:
+                    if file_content_hash(local_path) == remote.content_hash:
+                        files[key] = _manifest_entry(local_path, remote.content_hash)
+                        skipped += 1
                         continue
-                    with open(local_path, 'wb') as f:
-                        f.write(response.content)
-                else:
+                except OSError:
+                    pass
+            to_download.append((key, remote, local_path))
+
+        staged = _stage_local_copies(to_download, local_by_hash)
+        for path in removed_paths:
+            _remove_local(path)
+        moved = set()
+        for key, staged_path, local_path, content_hash in staged:
+            try:
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                os.replace(staged_path, local_path)
+            except OSError as e:
+                logger.warning(f'Не удалось переместить локальную копию {local_path}, скачиваем: {e}')
+                continue
+            files[key] = _manifest_entry(local_path, content_hash)
+            moved.add(key)
+        shutil.rmtree(SYNC_STAGING_DIR, ignore_errors=True)
+        to_download = [item for item in to_download if item[0] not in moved]
+
+        downloaded = failed = 0
+        failed_paths = set()
+        if to_download:
+            with ThreadPoolExecutor(max_workers=SYNC_DOWNLOAD_WORKERS, thread_name_prefix='dropbox_sync') as pool:
+                futures = {pool.submit(_download, remote, path): key for key, remote, path in to_download}
+                for future in as_completed(futures):
+                    key = futures[future]
                     try:
-                        local_hash = file_content_hash(local_path)
-                    except Exception:
-                        local_hash = None
-                    if local_hash != dbx_hash:
-                        metadata, response = dbx.files_download(f"{dropbox_folder}/{fname}")
-                        if response is None:
-                            logger.error(f'Ошибка скачивания файла {dropbox_folder}/{fname}: пустой ответ от Dropbox')
-                            continue
-                        with open(local_path, 'wb') as f:
-                            f.write(response.content)
-            for fname in os.listdir(local_folder):
-                fpath = os.path.join(local_folder, fname)
-                if os.path.isfile(fpath) and fname not in dropbox_files:
-                    os.remove(fpath)
-                elif os.path.isdir(fpath) and fname not in dropbox_folders:
-                    shutil.rmtree(fpath)
-        except Exception as e:
-            logger.error(f'Ошибка при хеш-синхронизации папки {dropbox_folder}: {str(e)}')
-    # Сначала переименовываем только фоны и рисунки
-    rename_and_sync_dropbox_images('/resources/images')
-    rename_and_sync_dropbox_images('/resources/backgrounds')
-    _sync('/resources', 'resources')
+                        files[key] = future.result()
+                        downloaded += 1
+                    except Exception as e:
+                        # Прежняя запись манифеста остаётся: старая локальная копия лучше, чем никакой,
+                        # а несовпадение content_hash заставит следующую синхронизацию скачать файл снова
+                        failed += 1
+                        failed_paths.add(os.path.normpath(_local_path(remote_files[key].path_display)))
+                        logger.error(f'Ошибка скачивания {key}: {e}')
+
+        if full:
+            # Полная сверка: удаляем локальные файлы, которых нет в Dropbox
+            for stale in [k for k in files if k not in remote_files]:
+                files.pop(stale)
+            expected = {os.path.normpath(entry['path']) for entry in files.values()} | failed_paths
+            expected.add(os.path.normpath(SYNC_MANIFEST_PATH))
+            for root, dirs, names in os.walk(RESOURCES_LOCAL_ROOT):
+                for name in names:
+                    path = os.path.normpath(os.path.join(root, name))
+                    if path not in expected:
+                        os.remove(path)
+                        deleted += 1
+
+        # Если часть файлов не скачалась, курсор не сохраняем: следующая синхронизация повторит их
+        manifest['cursor'] = cursor if not failed else manifest.get('cursor')
+        _save_manifest(manifest)
+
+        stats = {
+            'full': full,
+            'changes': len(entries),
+            'downloaded': downloaded,
+            'moved': len(moved),
+            'skipped': skipped,
+            'deleted': deleted,
+            'failed': failed,
+            'error': None,
+            'seconds': round(time.monotonic() - start, 2),
+        }
+        logger.info(f'🔄 Синхронизация resources завершена: {stats}')
+        return stats
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+IMAGE_INDEX_NAME = '.index.json'     # индекс папки: стабильный id Dropbox -> порядок показа
+RENUMBER_TMP_PREFIX = '.renumber_'   # временные имена первой фазы перенумерации
+MOVE_BATCH_SIZE = 1000               # перемещений в одном пакетном запросе
+MOVE_BATCH_POLL_INTERVAL = 0.5       # секунд между проверками асинхронного пакета
+
+
+def _bytes_content_hash(data: bytes) -> str:
+    """content_hash Dropbox для данных в памяти (тот же алгоритм, что в file_content_hash)."""
+    block_size = 4 * 1024 * 1024
+    hasher = hashlib.sha256()
+    for offset in range(0, len(data), block_size):
+        hasher.update(hashlib.sha256(data[offset:offset + block_size]).digest())
+    return hasher.hexdigest()
+
+
+def _move_batch(moves: list) -> set:
+    """
+    Перемещает файлы пакетами files_move_batch_v2 (только метаданные, без передачи содержимого).
+    moves — список (from_path, to_path). Возвращает множество from_path, перемещённых успешно.
+    """
+    moved = set()
+    for offset in range(0, len(moves), MOVE_BATCH_SIZE):
+        chunk = moves[offset:offset + MOVE_BATCH_SIZE]
+        launch = dbx.files_move_batch_v2([RelocationPathsArg(src, dst) for src, dst in chunk], autorename=False)
+        if launch.is_complete():
+            result = launch.get_complete()
+        else:
+            job_id = launch.get_async_job_id()
+            while True:
+                status = dbx.files_move_batch_check_v2(job_id)
+                if status.is_complete():
+                    result = status.get_complete()
+                    break
+                if not status.is_in_progress():
+                    raise RuntimeError(f'пакетное перемещение {job_id} завершилось с ошибкой: {status}')
+                time.sleep(MOVE_BATCH_POLL_INTERVAL)
+        for (src, dst), entry in zip(chunk, result.entries):
+            if entry.is_success():
+                moved.add(src)
+            else:
+                logger.error(f'Не удалось переместить {src} -> {dst}: {entry.get_failure()}')
+    return moved
+
+
+def _write_image_index(dropbox_folder: str, files_sorted: list, current_index: Optional[FileMetadata]):
+    """
+    Записывает индекс папки: стабильный id файла Dropbox -> номер в порядке показа и имя.
+    Содержимое детерминировано, поэтому актуальность проверяется по content_hash без скачивания.
+    """
+    items = [
+        {'id': entry.id, 'order': idx, 'name': f"{idx}{os.path.splitext(entry.name)[1].lower()}"}
+        for idx, entry in enumerate(files_sorted, 1)
+    ]
+    data = json.dumps({'items': items}, ensure_ascii=False, indent=1).encode('utf-8')
+    if current_index is not None and current_index.content_hash == _bytes_content_hash(data):
+        return
+    dbx.files_upload(data, f"{dropbox_folder}/{IMAGE_INDEX_NAME}", mode=WriteMode.overwrite)
+
+
+def list_images_in_display_order(local_folder: str, extensions: tuple = ('.jpg', '.png')) -> list:
+    """
+    Имена изображений локальной папки в порядке показа: по индексу папки (IMAGE_INDEX_NAME),
+    файлы, которых в индексе ещё нет (например, только что загруженные из админки), — следом по номеру.
+    """
+    order = {}
+    try:
+        with open(os.path.join(local_folder, IMAGE_INDEX_NAME), 'r', encoding='utf-8') as f:
+            order = {item['name']: item['order'] for item in json.load(f).get('items', [])}
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    def sort_key(name: str):
+        stem = os.path.splitext(name)[0]
+        return (order.get(name, float('inf')), int(stem) if stem.isdigit() else float('inf'), name)
+
+    names = [
+        f for f in os.listdir(local_folder)
+        if f.lower().endswith(extensions) and not f.startswith('.')
+    ]
+    return sorted(names, key=sort_key)
+
 
 def rename_and_sync_dropbox_images(dropbox_folder: str):
     """
     Переименовывает все изображения в папке Dropbox по порядку: 1.jpg, 2.jpg, ... (с сохранением расширения).
-    Если имена уже идут по порядку, ничего не делает.
+    Если имена уже идут по порядку, ничего не переименовывает.
     Работает для .jpg, .jpeg, .png, .gif
+
+    Перенумерация выполняется на стороне Dropbox пакетными перемещениями в две фазы:
+    сначала файлы с неверными именами уходят на временные имена, затем на итоговые —
+    так новые имена не конфликтуют со старыми, а содержимое файлов не передаётся.
+    Файлы, оставшиеся на временных именах после сбоя, встают на задуманные места при следующем запуске.
+    После перенумерации обновляется индекс папки (IMAGE_INDEX_NAME), по которому
+    list_images_in_display_order() упорядочивает локальную копию.
     """
-    exts = ['.jpg', '.jpeg', '.png', '.gif']
     try:
         result = dbx.files_list_folder(dropbox_folder)
         if result is None:
             logger.error(f'Ошибка при переименовании файлов на Dropbox в {dropbox_folder}: пустой ответ от Dropbox')
             return
-        entries = getattr(result, 'entries', [])
-        files = [entry for entry in entries if isinstance(entry, FileMetadata) and any(entry.name.lower().endswith(ext) for ext in exts)]
+        entries = list(result.entries)
+        while result.has_more:
+            result = dbx.files_list_folder_continue(result.cursor)
+            entries.extend(result.entries)
+        files = [entry for entry in entries if isinstance(entry, FileMetadata) and entry.name.lower().endswith(IMAGE_EXTENSIONS)]
+        current_index = next(
+            (entry for entry in entries if isinstance(entry, FileMetadata) and entry.name == IMAGE_INDEX_NAME), None
+        )
         numeric = []
         non_numeric = []
         for entry in files:
             name_wo_ext = os.path.splitext(entry.name)[0]
-            ext = os.path.splitext(entry.name)[1].lower()
             if name_wo_ext.isdigit():
-                numeric.append((int(name_wo_ext), entry))
+                numeric.append(((int(name_wo_ext), 0), entry))
+            elif name_wo_ext.startswith(RENUMBER_TMP_PREFIX) and name_wo_ext[len(RENUMBER_TMP_PREFIX):].isdigit():
+                # Файл застрял на временном имени после сбоя второй фазы — возвращаем его на задуманное место
+                numeric.append(((int(name_wo_ext[len(RENUMBER_TMP_PREFIX):]), 1), entry))
             else:
                 non_numeric.append((entry.name.lower(), entry))
         numeric_sorted = [e for _, e in sorted(numeric, key=lambda x: x[0])]
         non_numeric_sorted = [e for _, e in sorted(non_numeric, key=lambda x: x[0])]
         files_sorted = numeric_sorted + non_numeric_sorted
-        need_rename = False
+
+        renames = []
         for idx, entry in enumerate(files_sorted, 1):
             ext = os.path.splitext(entry.name)[1].lower()
             expected_name = f"{idx}{ext}"
             if entry.name != expected_name:
-                need_rename = True
-                break
-        if not need_rename:
-            return
-        tmpdir = tempfile.mkdtemp(prefix='dropbox_images_')
-        local_files = []
-        for idx, entry in enumerate(files_sorted, 1):
-            ext = os.path.splitext(entry.name)[1].lower()
-            local_name = f"{idx}{ext}"
-            local_path = os.path.join(tmpdir, local_name)
-            md, res = dbx.files_download(entry.path_lower)
-            with open(local_path, 'wb') as f:
-                f.write(res.content)
-            local_files.append((local_name, local_path))
-        for entry in files:
-            dbx.files_delete_v2(entry.path_lower)
-        for local_name, local_path in local_files:
-            dropbox_path = f"{dropbox_folder}/{local_name}"
-            with open(local_path, 'rb') as f:
-                dbx.files_upload(f.read(), dropbox_path, mode=WriteMode.overwrite)
-        shutil.rmtree(tmpdir)
+                renames.append((entry, idx, ext))
+
+        if renames:
+            start = time.monotonic()
+            width = len(str(len(files_sorted)))
+            plan = [
+                (entry.path_display, f"{dropbox_folder}/{RENUMBER_TMP_PREFIX}{idx:0{width}d}{ext}", f"{dropbox_folder}/{idx}{ext}")
+                for entry, idx, ext in renames
+            ]
+            # Файлы, уже стоящие на своём временном имени (сбой прошлого прохода), первую фазу пропускают
+            moved = _move_batch([(src, tmp) for src, tmp, _ in plan if src.lower() != tmp.lower()])
+            moved |= {src for src, tmp, _ in plan if src.lower() == tmp.lower()}
+            # На итоговые имена переносим только то, что успешно ушло на временные
+            placed = _move_batch([(tmp, dst) for src, tmp, dst in plan if src in moved])
+            logger.info(
+                f'🔢 Перенумерация {dropbox_folder}: {len(placed)} из {len(renames)} файлов '
+                f'за {time.monotonic() - start:.1f} с'
+            )
+            if len(placed) < len(renames):
+                # Порядок восстановится при следующей синхронизации; индекс пишем по согласованному состоянию
+                return
+
+        _write_image_index(dropbox_folder, files_sorted, current_index)
     except Exception as e:
-        logger.error(f'Ошибка при переименовании файлов на Dropbox в {dropbox_folder}: {str(e)}') 
+        logger.error(f'Ошибка при переименовании файлов на Dropbox в {dropbox_folder}: {str(e)}')
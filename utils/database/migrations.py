@@ -0,0 +1,218 @@
+import re
+
+import asyncpg
+
+from config import logger
+from utils.database.db import DATABASE_URL
+
+# Ключ advisory-блокировки: миграции выполняет только один инстанс бота одновременно
+MIGRATIONS_LOCK_KEY = 7_310_001
+
+# Версионированные миграции схемы: (версия, описание, список SQL-запросов).
+# Запросы должны быть идемпотентными. Миграции с CREATE INDEX CONCURRENTLY
+# выполняются вне транзакции, чтобы не блокировать запись в большие таблицы.
+MIGRATIONS = [
+    (1, "psychologist_history: кэш количества токенов", [
+        "ALTER TABLE psychologist_history ADD COLUMN IF NOT EXISTS tokens INT;",
+    ]),
+    (2, "psychologist_history: индексы по пользователю и времени", [
+        # Контекст, подсчёт, самые старые/новые сообщения и удаление — всё по (user_id, ts)
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_psychologist_history_user_ts "
+        "ON psychologist_history (user_id, ts, id);",
+        # Последнее сообщение пользователя (role = 'user')
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_psychologist_history_user_role_ts "
+        "ON psychologist_history (user_id, ts) WHERE role = 'user';",
+    ]),
+    (3, "future_letters: неотправленные письма по времени отправки", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_future_letters_unsent_send_after "
+        "ON future_letters (send_after) WHERE is_sent = FALSE;",
+        # Бесплатные письма пользователя за месяц
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_future_letters_free_user_created "
+        "ON future_letters (user_id, created_at) WHERE is_free = TRUE;",
+    ]),
+    (4, "notifications: очередь рассылок и история", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notifications_unsent_scheduled "
+        "ON notifications (scheduled_at) WHERE is_sent = FALSE;",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notifications_created_at "
+        "ON notifications (created_at DESC);",
+    ]),
+    (5, "psychologist_history_counters: счётчик сообщений истории", [
+        """
+        CREATE TABLE IF NOT EXISTS psychologist_history_counters (
+            user_id       BIGINT PRIMARY KEY,
+            message_count INT NOT NULL DEFAULT 0
+        );
+        """,
+        """
+        INSERT INTO psychologist_history_counters(user_id, message_count)
+        SELECT user_id, COUNT(*) FROM psychologist_history GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET message_count = EXCLUDED.message_count;
+        """,
+    ]),
+    (6, "notifications.media_files: TEXT с JSON-строкой -> JSONB", [
+        # Некорректные значения (в т.ч. из старого TEXT[]) превращаются в пустой список
+        """
+        CREATE OR REPLACE FUNCTION pg_temp.media_files_to_jsonb(value TEXT) RETURNS JSONB
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF value IS NULL OR value = '' THEN
+                RETURN '[]'::jsonb;
+            END IF;
+            RETURN CASE WHEN jsonb_typeof(value::jsonb) = 'array' THEN value::jsonb ELSE '[]'::jsonb END;
+        EXCEPTION WHEN others THEN
+            RETURN '[]'::jsonb;
+        END;
+        $$;
+        """,
+        """
+        DO $$
+        BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'notifications' AND column_name = 'media_files') <> 'jsonb' THEN
+                ALTER TABLE notifications ALTER COLUMN media_files DROP DEFAULT;
+                ALTER TABLE notifications
+                    ALTER COLUMN media_files TYPE JSONB USING pg_temp.media_files_to_jsonb(media_files::text);
+            END IF;
+        END;
+        $$;
+        """,
+        "UPDATE notifications SET media_files = '[]'::jsonb WHERE media_files IS NULL;",
+        "ALTER TABLE notifications ALTER COLUMN media_files SET DEFAULT '[]'::jsonb;",
+        "ALTER TABLE notifications ALTER COLUMN media_files SET NOT NULL;",
+    ]),
+    (7, "индексы для удаления устаревших записей (retention)", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_daily_quotes_quote_date "
+        "ON daily_quotes (quote_date);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_daily_surprise_ideas_used_date "
+        "ON daily_surprise_ideas (used_date);",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_future_letters_sent_send_after "
+        "ON future_letters (send_after) WHERE is_sent = TRUE;",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_notifications_sent_sent_at "
+        "ON notifications (sent_at) WHERE is_sent = TRUE;",
+    ]),
+    (8, "free_letter_quota: счётчик бесплатных писем по месяцам", [
+        """
+        CREATE TABLE IF NOT EXISTS free_letter_quota (
+            user_id BIGINT NOT NULL,
+            month   DATE NOT NULL,
+            used    INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month)
+        );
+        """,
+        """
+        INSERT INTO free_letter_quota(user_id, month, used)
+        SELECT user_id, date_trunc('month', created_at AT TIME ZONE 'UTC')::date, COUNT(*)
+        FROM future_letters
+        WHERE is_free = TRUE
+        GROUP BY 1, 2
+        ON CONFLICT (user_id, month) DO UPDATE SET used = EXCLUDED.used;
+        """,
+    ]),
+    (9, "payments: локальное хранилище статусов платежей", [
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            payment_id  TEXT PRIMARY KEY,
+            user_id     BIGINT,
+            amount      NUMERIC(12, 2),
+            description TEXT,
+            status      TEXT NOT NULL DEFAULT 'pending',
+            created_at  TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            updated_at  TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_payments_user_created ON payments(user_id, created_at);",
+    ]),
+    (10, "payment_intents: отложенное создание платежей с сохранённым ключом идемпотентности", [
+        """
+        CREATE TABLE IF NOT EXISTS payment_intents (
+            user_id          BIGINT NOT NULL,
+            product          TEXT NOT NULL,
+            amount           NUMERIC(12, 2) NOT NULL,
+            description      TEXT NOT NULL,
+            idempotence_key  TEXT NOT NULL,
+            payment_id       TEXT,
+            confirmation_url TEXT,
+            created_at       TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (user_id, product)
+        );
+        """,
+    ]),
+    (11, "future_letters: аренда письма доставщиком и счётчик попыток", [
+        "ALTER TABLE future_letters ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP WITH TIME ZONE;",
+        "ALTER TABLE future_letters ADD COLUMN IF NOT EXISTS attempts INT NOT NULL DEFAULT 0;",
+    ]),
+]
+
+_CONCURRENT_INDEX_RE = re.compile(r"CREATE\s+INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+
+async def _drop_invalid_index(conn, statement: str):
+    """
+    Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс, который
+    IF NOT EXISTS потом молча пропускает. Удаляем такой индекс перед повтором.
+    """
+    match = _CONCURRENT_INDEX_RE.search(statement)
+    if not match:
+        return
+    index_name = match.group(1)
+    is_valid = await conn.fetchval(
+        """
+        SELECT i.indisvalid FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = $1;
+        """,
+        index_name
+    )
+    if is_valid is False:
+        logger.warning(f"Удаляем невалидный индекс {index_name} перед повторным созданием")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+
+
+async def run_migrations() -> int:
+    """
+    Применяет ещё не выполненные миграции и записывает их в schema_version.
+    Возвращает количество применённых миграций.
+
+    Миграции идут на отдельном соединении без command_timeout пула: построение индексов
+    и заполнение колонок на больших таблицах длится дольше 30 секунд.
+    """
+    conn = await asyncpg.connect(DATABASE_URL, command_timeout=None)
+    applied_count = 0
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version     INT PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at  TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+            );
+        """)
+        await conn.execute("SELECT pg_advisory_lock($1);", MIGRATIONS_LOCK_KEY)
+        try:
+            applied = {r["version"] for r in await conn.fetch("SELECT version FROM schema_version;")}
+            for version, description, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                logger.info(f"🛠 Миграция {version}: {description}")
+                concurrent = any("CONCURRENTLY" in sql.upper() for sql in statements)
+                if concurrent:
+                    for sql in statements:
+                        await _drop_invalid_index(conn, sql)
+                        await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_version(version, description) VALUES ($1, $2);",
+                        version, description
+                    )
+                else:
+                    async with conn.transaction():
+                        for sql in statements:
+                            await conn.execute(sql)
+                        await conn.execute(
+                            "INSERT INTO schema_version(version, description) VALUES ($1, $2);",
+                            version, description
+                        )
+                applied_count += 1
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1);", MIGRATIONS_LOCK_KEY)
+    finally:
+        await conn.close()
+    return applied_count
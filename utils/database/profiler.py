@@ -0,0 +1,166 @@
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from config import DB_SLOW_QUERY_MS, logger
+
+# Границы корзин гистограммы задержек, мс (последняя корзина — всё, что дольше)
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# Функция db.*, внутри которой сейчас выполняется код (для учёта ожидания пула)
+_current_function: ContextVar[Optional[str]] = ContextVar("db_current_function", default=None)
+
+
+class FunctionStats:
+    """Статистика одной функции db.*."""
+
+    __slots__ = ("calls", "errors", "total", "max", "rows", "pool_wait", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.pool_wait = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float, rows: int, error: bool):
+        self.calls += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+        self.histogram[bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+
+    def percentile_ms(self, q: float) -> float:
+        """Оценка перцентиля по гистограмме (верхняя граница корзины)."""
+        if not self.calls:
+            return 0.0
+        target = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if seen >= target:
+                bound = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else float("inf")
+                return round(min(bound, self.max * 1000), 1)
+        return self.max * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        calls = self.calls or 1
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": round(self.total * 1000, 1),
+            "avg_ms": round(self.total / calls * 1000, 2),
+            "p95_ms": self.percentile_ms(0.95),
+            "max_ms": round(self.max * 1000, 1),
+            "avg_rows": round(self.rows / calls, 1),
+            "avg_pool_wait_ms": round(self.pool_wait / calls * 1000, 2),
+        }
+
+
+class QueryProfiler:
+    """Сбор статистики по функциям db.* и журнал медленных SQL-запросов."""
+
+    def __init__(self, slow_query_ms: float = DB_SLOW_QUERY_MS):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.functions: Dict[str, FunctionStats] = {}
+        self.slow_queries = 0
+        self.started_at = time.time()
+
+    def _stats(self, name: str) -> FunctionStats:
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = FunctionStats()
+        return stats
+
+    def record_pool_wait(self, seconds: float):
+        name = _current_function.get()
+        if name is not None:
+            self._stats(name).pool_wait += seconds
+
+    def log_query(self, record):
+        """Обработчик asyncpg add_query_logger: пишет в лог SQL медленнее порога."""
+        if record.elapsed < self.slow_query_seconds:
+            return
+        self.slow_queries += 1
+        query = " ".join(record.query.split())
+        logger.warning(
+            f"🐢 Медленный запрос {record.elapsed * 1000:.0f} мс "
+            f"[{_current_function.get() or '-'}]: {query[:500]} args={redact_args(record.args)}"
+        )
+
+    def instrument(self, func):
+        """Оборачивает корутину db.* сбором статистики."""
+        name = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _current_function.set(name)
+            start = time.perf_counter()
+            error = False
+            result = None
+            try:
+                result = await func(*args, **kwargs)
+                return result
+            except BaseException:
+                error = True
+                raise
+            finally:
+                _current_function.reset(token)
+                self._stats(name).observe(time.perf_counter() - start, _count_rows(result), error)
+
+        wrapper.__wrapped_by_profiler__ = True
+        return wrapper
+
+    def snapshot(self, top: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Статистика функций, отсортированная по суммарному времени."""
+        items = sorted(self.functions.items(), key=lambda item: item[1].total, reverse=True)
+        if top is not None:
+            items = items[:top]
+        return [{"name": name, **stats.to_dict()} for name, stats in items]
+
+    def reset(self):
+        self.functions.clear()
+        self.slow_queries = 0
+        self.started_at = time.time()
+
+
+def _count_rows(result: Any) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+def redact_args(args) -> str:
+    """Параметры запроса без значений: только типы и размеры."""
+    if not args:
+        return "()"
+    parts = []
+    for value in args:
+        if value is None:
+            parts.append("NULL")
+        elif isinstance(value, (str, bytes, list, tuple, dict)):
+            parts.append(f"{type(value).__name__}[{len(value)}]")
+        else:
+            parts.append(type(value).__name__)
+    return "(" + ", ".join(parts) + ")"
+
+
+def instrument_module(namespace: dict, exclude: tuple = ()):
+    """Оборачивает все публичные корутины модуля (кроме exclude) профилировщиком."""
+    for name, obj in list(namespace.items()):
+        if name.startswith("_") or name in exclude:
+            continue
+        if inspect.iscoroutinefunction(obj) and obj.__module__ == namespace.get("__name__") \
+                and not getattr(obj, "__wrapped_by_profiler__", False):
+            namespace[name] = profiler.instrument(obj)
+
+
+profiler = QueryProfiler()
@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, ClassVar, Optional
+
+
+def _decode_media_files(value: Any) -> list:
+    """media_files — JSONB, его декодирует драйвер; здесь лишь гарантируем список."""
+    return value if isinstance(value, list) else []
+
+
+@dataclass(slots=True)
+class Notification:
+    """
+    Уведомление рассылки. Поддерживает и доступ по ключу (notification["text"]),
+    как у прежних словарей, чтобы не менять вызывающий код.
+    """
+    id: int
+    text: str
+    media_files: list
+    scheduled_at: Optional[datetime]
+    sent_at: Optional[datetime]
+    created_by: int
+    created_at: datetime
+    is_sent: bool
+
+    COLUMNS: ClassVar[str] = "id, text, media_files, scheduled_at, sent_at, created_by, created_at, is_sent"
+
+    @classmethod
+    def from_record(cls, row) -> "Notification":
+        return cls(
+            id=row["id"],
+            text=row["text"],
+            media_files=_decode_media_files(row["media_files"]),
+            scheduled_at=row["scheduled_at"],
+            sent_at=row["sent_at"],
+            created_by=row["created_by"],
+            created_at=row["created_at"],
+            is_sent=row["is_sent"],
+        )
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
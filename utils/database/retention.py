@@ -0,0 +1,192 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Optional
+
+from config import RETENTION_ARCHIVE_DIR, logger
+from utils.task_supervisor import supervisor
+from utils.database.db import get_connection, release_connection
+from utils.image_processing import prune_preview_cache
+
+RETENTION_INTERVAL = 6 * 60 * 60  # секунд между запусками очистки
+RETENTION_CHUNK_SIZE = 1000       # строк за один DELETE: короткие блокировки и умеренный WAL
+RETENTION_MAX_CHUNKS = 200        # не более стольких порций на таблицу за запуск
+RETENTION_CHUNK_PAUSE = 0.2       # пауза между порциями, чтобы не мешать рабочей нагрузке
+RETENTION_LOCK_KEY = 7_310_002    # advisory-блокировка: очистку выполняет один инстанс
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """
+    Политика хранения таблицы: строки, подходящие под condition (параметр $1 — граница
+    по времени, keep_days назад от текущего момента), удаляются порциями.
+    """
+    table: str
+    condition: str
+    keep_days: int
+    archive: bool = False
+    cutoff_is_date: bool = False
+
+
+RETENTION_POLICIES = (
+    RetentionPolicy("ideas_sessions", "created_at < $1", keep_days=30),
+    RetentionPolicy("daily_quotes", "quote_date < $1", keep_days=30, cutoff_is_date=True),
+    RetentionPolicy("daily_surprise_ideas", "used_date < $1", keep_days=7, cutoff_is_date=True),
+    RetentionPolicy("future_letters", "is_sent = TRUE AND send_after < $1", keep_days=90, archive=True),
+    RetentionPolicy("notifications", "is_sent = TRUE AND sent_at < $1", keep_days=90, archive=True),
+    RetentionPolicy("free_letter_quota", "month < $1", keep_days=62, cutoff_is_date=True),
+)
+
+
+class RetentionStats:
+    """Метрики очистки по таблицам."""
+
+    def __init__(self):
+        self.tables: Dict[str, dict] = {}
+        self.runs = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_run_seconds = 0.0
+
+    def record(self, table: str, deleted: int, archived: int, chunks: int, seconds: float, error: Optional[str] = None):
+        entry = self.tables.setdefault(table, {"deleted_total": 0, "archived_total": 0, "errors": 0})
+        entry["deleted_total"] += deleted
+        entry["archived_total"] += archived
+        entry["last_deleted"] = deleted
+        entry["last_chunks"] = chunks
+        entry["last_seconds"] = round(seconds, 3)
+        if error:
+            entry["errors"] += 1
+            entry["last_error"] = error
+
+    def snapshot(self) -> dict:
+        return {
+            "runs": self.runs,
+            "last_run_at": self.last_run_at,
+            "last_run_seconds": round(self.last_run_seconds, 3),
+            "tables": {table: dict(entry) for table, entry in self.tables.items()},
+        }
+
+
+retention_stats = RetentionStats()
+
+
+def _write_archive(table: str, rows: list):
+    """Дописывает удаляемые строки в сжатый JSONL-файл таблицы за текущий день."""
+    os.makedirs(RETENTION_ARCHIVE_DIR, exist_ok=True)
+    day = datetime.now(timezone.utc).strftime("%Y%m%d")
+    path = os.path.join(RETENTION_ARCHIVE_DIR, f"{table}-{day}.jsonl.gz")
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False, default=str))
+            f.write("\n")
+
+
+async def _purge_chunk(conn, policy: RetentionPolicy, cutoff, archive: bool) -> int:
+    """Удаляет одну порцию строк политики (в отдельной транзакции). Возвращает количество удалённых."""
+    # Порция выбирается по ctid: удаление идёт через TID Scan без повторной фильтрации
+    select_chunk = (
+        f"SELECT ctid FROM {policy.table} WHERE {policy.condition} "
+        f"LIMIT $2 FOR UPDATE SKIP LOCKED"
+    )
+    if not archive:
+        result = await conn.execute(
+            f"DELETE FROM {policy.table} WHERE ctid = ANY(ARRAY({select_chunk}));",
+            cutoff, RETENTION_CHUNK_SIZE
+        )
+        return int(result.split()[-1]) if result else 0
+
+    async with conn.transaction():
+        rows = await conn.fetch(
+            f"DELETE FROM {policy.table} t WHERE t.ctid = ANY(ARRAY({select_chunk})) "
+            f"RETURNING to_jsonb(t.*) AS row;",
+            cutoff, RETENTION_CHUNK_SIZE
+        )
+        if rows:
+            # Если архив записать не удалось, транзакция откатится и строки останутся в БД
+            await asyncio.to_thread(_write_archive, policy.table, [r["row"] for r in rows])
+    return len(rows)
+
+
+async def apply_policy(conn, policy: RetentionPolicy) -> int:
+    """Удаляет устаревшие строки таблицы порциями. Возвращает количество удалённых строк."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=policy.keep_days)
+    if policy.cutoff_is_date:
+        cutoff = cutoff.date()
+    archive = policy.archive and bool(RETENTION_ARCHIVE_DIR)
+
+    start = time.monotonic()
+    deleted = chunks = 0
+    try:
+        while chunks < RETENTION_MAX_CHUNKS:
+            count = await _purge_chunk(conn, policy, cutoff, archive)
+            chunks += 1
+            deleted += count
+            if count < RETENTION_CHUNK_SIZE:
+                break
+            await asyncio.sleep(RETENTION_CHUNK_PAUSE)
+    except Exception as e:
+        retention_stats.record(policy.table, deleted, deleted if archive else 0, chunks, time.monotonic() - start, str(e))
+        raise
+    retention_stats.record(policy.table, deleted, deleted if archive else 0, chunks, time.monotonic() - start)
+    return deleted
+
+
+async def run_retention() -> Dict[str, int]:
+    """Применяет все политики хранения. Возвращает количество удалённых строк по таблицам."""
+    result: Dict[str, int] = {}
+    conn = await get_connection()
+    try:
+        locked = await conn.fetchval("SELECT pg_try_advisory_lock($1);", RETENTION_LOCK_KEY)
+        if not locked:
+            logger.info("Очистка устаревших записей уже выполняется другим инстансом")
+            return result
+        start = time.monotonic()
+        try:
+            for policy in RETENTION_POLICIES:
+                try:
+                    result[policy.table] = await apply_policy(conn, policy)
+                except Exception as e:
+                    logger.error(f"Ошибка очистки таблицы {policy.table}: {e}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1);", RETENTION_LOCK_KEY)
+        retention_stats.runs += 1
+        retention_stats.last_run_at = datetime.now(timezone.utc)
+        retention_stats.last_run_seconds = time.monotonic() - start
+    finally:
+        await release_connection(conn)
+
+    deleted = {table: count for table, count in result.items() if count}
+    if deleted:
+        logger.info(f"🧹 Удалены устаревшие записи: {deleted}")
+    return result
+
+
+async def retention_scheduler():
+    """Периодически запускает очистку устаревших записей и локального кэша превью."""
+    while True:
+        try:
+            await run_retention()
+        except Exception as e:
+            logger.error(f"Ошибка в планировщике очистки: {e}")
+        # Кэш превью локален для инстанса, поэтому чистится без advisory-блокировки
+        try:
+            removed = await asyncio.to_thread(prune_preview_cache)
+            if removed:
+                logger.info(f"🧹 Удалены устаревшие превью: {removed}")
+        except Exception as e:
+            logger.error(f"Ошибка очистки кэша превью: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+
+def start_retention_scheduler():
+    """Запускает планировщик очистки под надзором супервизора."""
+    supervisor.run_forever("retention", retention_scheduler)
+
+
+def get_retention_stats() -> dict:
+    """Метрики очистки (удалено/заархивировано по таблицам, время последнего запуска)."""
+    return retention_stats.snapshot()
@@ -0,0 +1,91 @@
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Единица работы текущего апдейта; выставляется UnitOfWorkMiddleware
+_current_uow: ContextVar[Optional["UnitOfWork"]] = ContextVar("current_unit_of_work", default=None)
+
+
+class SharedConnection:
+    """
+    Соединение единицы работы, которое получают функции db.*.
+    Закрытие/возврат в пул игнорируются: соединением владеет UnitOfWork.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def close(self):
+        pass
+
+
+class UnitOfWork:
+    """
+    Одно соединение из пула на весь апдейт (или фоновую операцию).
+
+    Пока единица работы активна, все вызовы db.* из задачи-владельца используют её
+    соединение, поэтому цепочка запросов стоит одного обращения к пулу, а внутри
+    transaction() выполняется атомарно. Соединение берётся лениво при первом запросе;
+    перед долгими внешними вызовами (модель, платёжный сервис) его стоит вернуть
+    через release() — следующий запрос возьмёт соединение заново.
+
+    Задачи, запущенные из обработчика (asyncio.create_task), наследуют контекст,
+    но не являются владельцем и работают с пулом напрямую.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._owner: Optional[asyncio.Task] = None
+        self._token = None
+
+    async def __aenter__(self) -> "UnitOfWork":
+        self._owner = asyncio.current_task()
+        self._token = _current_uow.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self.release()
+        finally:
+            _current_uow.reset(self._token)
+            self._token = None
+            self._owner = None
+
+    def owns_current_task(self) -> bool:
+        return self._owner is not None and self._owner is asyncio.current_task()
+
+    async def connection(self) -> SharedConnection:
+        """Возвращает соединение единицы работы, при необходимости беря его из пула."""
+        if self._conn is None:
+            from utils.database.db import init_connection_pool
+            pool = await init_connection_pool()
+            self._conn = await pool.acquire()
+        return SharedConnection(self._conn)
+
+    @asynccontextmanager
+    async def transaction(self, **kwargs):
+        """Транзакция на соединении единицы работы; вложенные вызовы становятся savepoint'ами."""
+        conn = await self.connection()
+        async with conn.transaction(**kwargs):
+            yield conn
+
+    async def release(self):
+        """Возвращает соединение в пул (если оно было взято)."""
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        from utils.database.db import init_connection_pool
+        pool = await init_connection_pool()
+        await pool.release(conn)
+
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    """Активная единица работы текущей задачи (или None)."""
+    uow = _current_uow.get()
+    if uow is not None and uow.owns_current_task():
+        return uow
+    return None
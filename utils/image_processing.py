@@ -1,5 +1,8 @@
+import hashlib
 import os
 import textwrap
+import threading
+import time
 
 from PIL import Image, ImageDraw, ImageFont
 from pathlib import Path
@@ -185,3 +188,79 @@ async def generate_font_sample(font_path: Path, sample_path: Path, size: int, te
         y += line_heights[i] + spacing
 
     img.save(sample_path)
+
+
+PREVIEW_FOLDER = "resources/output/previews"
+ALBUM_WATERMARK_TEXT = "Создано в Добрые Открыточки<3"  # водяной знак в альбоме открыток
+BACKGROUND_WATERMARK_TEXT = "Оплатите картинку перед сохранением <3"  # водяной знак в каталоге фонов
+PREVIEW_MAX_AGE = 14 * 24 * 60 * 60  # секунд без обращений, после которых превью удаляется
+PREVIEW_MAX_FILES = 5000             # не более стольких превью в кэше
+PREVIEW_TMP_MAX_AGE = 60 * 60        # недописанные временные файлы старше этого — мусор
+
+
+def _cached_preview(src: str, variant: str, render) -> str:
+    """
+    Производное изображение (водяной знак, номер) из кэша превью.
+    Ключ — путь, размер и mtime исходника и вариант, поэтому изменённый файл получает новое превью.
+    """
+    st = os.stat(src)
+    key = hashlib.sha1(
+        f"{os.path.abspath(src)}|{st.st_size}|{st.st_mtime_ns}|{variant}".encode("utf-8")
+    ).hexdigest()[:20]
+    path = os.path.join(PREVIEW_FOLDER, f"{key}{os.path.splitext(src)[1].lower()}")
+    try:
+        # Отмечаем обращение: prune_preview_cache удаляет давно не использованные превью
+        os.utime(path)
+    except FileNotFoundError:
+        os.makedirs(PREVIEW_FOLDER, exist_ok=True)
+        tmp_path = os.path.join(PREVIEW_FOLDER, f".tmp_{threading.get_ident()}_{os.path.basename(path)}")
+        render(tmp_path)
+        os.replace(tmp_path, path)
+    return path
+
+
+def prune_preview_cache(max_age: float = PREVIEW_MAX_AGE, max_files: int = PREVIEW_MAX_FILES) -> int:
+    """
+    Чистит кэш превью: удаляет файлы, к которым не обращались дольше max_age
+    (в том числе превью заменённых и удалённых исходников), брошенные временные файлы,
+    а затем самые старые превью сверх max_files. Возвращает число удалённых файлов.
+    """
+    try:
+        entries = list(os.scandir(PREVIEW_FOLDER))
+    except FileNotFoundError:
+        return 0
+    now = time.time()
+    keep = []
+    removed = 0
+    for entry in entries:
+        try:
+            if not entry.is_file():
+                continue
+            age = now - entry.stat().st_mtime
+            limit = PREVIEW_TMP_MAX_AGE if entry.name.startswith(".tmp_") else max_age
+            if age > limit:
+                os.remove(entry.path)
+                removed += 1
+            elif not entry.name.startswith(".tmp_"):
+                keep.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            continue
+    if len(keep) > max_files:
+        keep.sort()
+        for _, path in keep[:len(keep) - max_files]:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def cached_watermark(src: str, watermark_text: str = BACKGROUND_WATERMARK_TEXT) -> str:
+    """Путь к копии src с водяным знаком (создаётся один раз на версию файла)."""
+    return _cached_preview(src, f"wm:{watermark_text}", lambda out: add_watermark(src, out, watermark_text))
+
+
+def cached_number_overlay(src: str, number: int) -> str:
+    """Путь к копии src с номером в углу (создаётся один раз на версию файла и номер)."""
+    return _cached_preview(src, f"num:{number}", lambda out: add_number_overlay(src, out, number=number))
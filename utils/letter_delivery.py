@@ -0,0 +1,103 @@
+import asyncio
+import functools
+from datetime import datetime, timezone
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from config import logger, ADMIN_IDS
+from utils.database.db import claim_due_letters, mark_letter_sent, next_letter_send_after
+from utils.task_supervisor import supervisor
+
+LETTER_POLL_INTERVAL = 300    # секунд; не дольше этого доставщик спит между проверками
+LETTER_BATCH_SIZE = 50        # писем за одну выборку
+LETTER_SEND_RATE = 20         # сообщений в секунду (ниже глобального лимита Telegram)
+LETTER_CLAIM_LEASE = 600      # секунд аренды: после неё неотправленное письмо берётся повторно
+LETTER_MAX_ATTEMPTS = 3       # после стольких неудач письмо снимается с доставки и передаётся админам
+
+
+def _letter_text(letter) -> str:
+    created_at = letter['created_at']
+    ts = created_at.strftime("%d.%m.%Y %H:%M") if created_at else ""
+    return f"📨 Ваше письмо, составленное {ts}:\n\n{letter['content']}"
+
+
+async def _notify_admins(bot: Bot, letter):
+    """Сообщает админам о письме, которое не удалось доставить."""
+    try:
+        chat = await bot.get_chat(letter['user_id'])
+        username = chat.username or f"{chat.first_name or ''} {chat.last_name or ''}".strip()
+    except TelegramAPIError:
+        username = None
+    who = f"{letter['user_id']} (@{username})" if username else f"{letter['user_id']}"
+    admin_text = f"❗ Не удалось доставить письмо пользователю {who}:\n\n{letter['content']}"
+    admin_ids = ADMIN_IDS if isinstance(ADMIN_IDS, (list, tuple, set)) else [ADMIN_IDS]
+    for admin_id in admin_ids:
+        try:
+            await bot.send_message(admin_id, admin_text)
+        except TelegramAPIError:
+            logger.exception(f"Не удалось уведомить админа {admin_id} о неотправленном письме")
+
+
+async def deliver_letter(bot: Bot, letter) -> bool:
+    """Отправляет одно письмо. True — письмо доставлено или снято с доставки."""
+    try:
+        await bot.send_message(letter['user_id'], _letter_text(letter))
+    except TelegramRetryAfter as e:
+        # Письмо останется арендованным и будет взято повторно после аренды
+        logger.warning(f"Telegram ограничил отправку писем, пауза {e.retry_after} с")
+        await asyncio.sleep(e.retry_after)
+        return False
+    except (TelegramBadRequest, TelegramForbiddenError) as e:
+        if letter['attempts'] < LETTER_MAX_ATTEMPTS:
+            logger.warning(f"Письмо id={letter['id']} не отправлено (попытка {letter['attempts']}): {e}")
+            return False
+        logger.exception(f"Не удалось отправить письмо id={letter['id']} после {letter['attempts']} попыток", exc_info=e)
+        try:
+            await _notify_admins(bot, letter)
+        except Exception:
+            # Письмо всё равно снимается с доставки, иначе оно будет браться бесконечно
+            logger.exception(f"Не удалось передать админам письмо id={letter['id']}")
+    await mark_letter_sent(letter['id'])
+    return True
+
+
+async def deliver_due_letters(bot: Bot) -> int:
+    """Доставляет все письма, время которых наступило, порциями с ограничением скорости."""
+    delivered = 0
+    while True:
+        letters = await claim_due_letters(LETTER_BATCH_SIZE, LETTER_CLAIM_LEASE)
+        for letter in letters:
+            delivered += await deliver_letter(bot, letter)
+            await asyncio.sleep(1 / LETTER_SEND_RATE)
+        if len(letters) < LETTER_BATCH_SIZE:
+            return delivered
+
+
+async def letter_delivery_loop(bot: Bot):
+    """
+    Доставщик писем в будущее: в памяти не хранится ничего, письма выбираются из БД
+    по мере наступления send_after. Между проверками спит до ближайшего письма,
+    но не дольше LETTER_POLL_INTERVAL.
+    """
+    while True:
+        try:
+            delivered = await deliver_due_letters(bot)
+            if delivered:
+                logger.info(f"📨 Доставлено писем в будущее: {delivered}")
+            next_at = await next_letter_send_after()
+        except Exception as e:
+            logger.error(f"Ошибка доставки писем в будущее: {e}")
+            next_at = None
+
+        delay = LETTER_POLL_INTERVAL
+        if next_at is not None:
+            until_next = (next_at - datetime.now(timezone.utc)).total_seconds()
+            if until_next > 0:
+                delay = min(delay, until_next)
+        await asyncio.sleep(delay)
+
+
+def start_letter_delivery(bot: Bot):
+    """Запускает доставщик писем в будущее под надзором супервизора."""
+    supervisor.run_forever("letter_delivery", functools.partial(letter_delivery_loop, bot))
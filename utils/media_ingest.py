@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Bot
+
+import config
+from config import logger
+from utils.database.dropbox_storage import upload_file
+from utils.image_processing import cached_number_overlay, cached_watermark
+
+INGEST_CONCURRENCY = 4          # файлов админской пачки обрабатывается одновременно
+INGEST_PROGRESS_INTERVAL = 2.0  # секунд между обновлениями сообщения о прогрессе
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+def _item_ext(item: dict) -> str:
+    if item["type"] == "photo":
+        return ".jpg"
+    return os.path.splitext(item.get("file_name") or "")[1] or ".png"
+
+
+def _store(dest: str, dropbox_path: str, number: int, watermark_text: Optional[str]) -> bool:
+    """
+    Рабочий поток: выгрузка в Dropbox и подготовка превью, которые потом показываются
+    при просмотре (номер для админки, водяной знак для пользователей).
+    """
+    uploaded = upload_file(dest, dropbox_path) is not None
+    try:
+        cached_number_overlay(dest, number)
+        if watermark_text is not None:
+            cached_watermark(dest, watermark_text)
+    except Exception as e:
+        # Превью не критичны: при просмотре они построятся заново
+        logger.warning(f"Не удалось подготовить превью {dest}: {e}")
+    return uploaded
+
+
+async def _ingest_one(bot: Bot, item: dict, dest: str, dropbox_path: str,
+                      number: int, watermark_text: Optional[str]) -> bool:
+    tg_file = await bot.get_file(item["file_id"])
+    if not tg_file.file_path:
+        return False
+    # Скачиваем во временный файл: в папке ресурсов файл появляется только целиком
+    os.makedirs(config.Output_Folder, exist_ok=True)
+    tmp_path = os.path.join(config.Output_Folder, f"ingest_{uuid.uuid4().hex}{os.path.splitext(dest)[1]}")
+    try:
+        await bot.download_file(tg_file.file_path, destination=tmp_path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return await asyncio.to_thread(_store, dest, dropbox_path, number, watermark_text)
+
+
+async def ingest_media(
+    bot: Bot,
+    pending: list,
+    local_folder: str,
+    dropbox_folder: str,
+    start_index: int,
+    watermark_text: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> dict:
+    """
+    Сохраняет пачку файлов, присланных админом, под номерами start_index, start_index + 1, ...
+
+    Файлы обрабатываются параллельно (не более INGEST_CONCURRENCY): скачивание из Telegram,
+    выгрузка в Dropbox (крупные файлы — по частям) и построение превью в том же проходе.
+    Блокирующая работа выполняется в потоках, event loop не блокируется.
+    progress(done, total) вызывается не чаще INGEST_PROGRESS_INTERVAL и по завершении.
+    Возвращает {'added': ..., 'failed': ..., 'seconds': ...}.
+    """
+    total = len(pending)
+    start = time.monotonic()
+    semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+    done = failed = 0
+    last_report = 0.0
+
+    async def report(force: bool = False):
+        nonlocal last_report
+        now = time.monotonic()
+        if progress is None or (not force and now - last_report < INGEST_PROGRESS_INTERVAL):
+            return
+        last_report = now
+        try:
+            await progress(done, total)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс загрузки: {e}")
+
+    async def worker(offset: int, item: dict):
+        nonlocal done, failed
+        number = start_index + offset
+        name = f"{number}{_item_ext(item)}"
+        async with semaphore:
+            try:
+                ok = await _ingest_one(
+                    bot, item, os.path.join(local_folder, name), f"{dropbox_folder}/{name}", number, watermark_text
+                )
+            except Exception as e:
+                logger.error(f"Ошибка загрузки файла {name}: {e}")
+                ok = False
+        done += 1
+        failed += not ok
+        await report()
+
+    await asyncio.gather(*(worker(offset, item) for offset, item in enumerate(pending)))
+    await report(force=True)
+
+    stats = {"added": total - failed, "failed": failed, "seconds": round(time.monotonic() - start, 1)}
+    logger.info(f"📥 Загрузка медиа в {dropbox_folder}: {stats}")
+    return stats
@@ -1,6 +1,6 @@
 import asyncio
-from datetime import datetime, timezone
-from typing import List, Dict, Any
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Any, Optional
 import json
 import time
 
@@ -9,12 +9,18 @@ from utils.database.db import (
     get_pending_notifications,
     mark_notification_sent,
     get_all_users,
-    get_users_count,
-    get_active_users_count,
     get_users_batch,
-    get_next_notification_time
+    get_next_notification_time,
+    open_listener,
+    NOTIFICATIONS_CHANNEL,
 )
 from utils.bot_instance import bot
+from utils.user_stats import user_stats
+from utils.task_supervisor import supervisor
+
+NOTIFICATION_FALLBACK_POLL = 300  # секунд; потолок сна планировщика, даже при подписке LISTEN
+NOTIFICATION_RETRY_INITIAL = 30   # секунд до повтора, если наступившее уведомление не отправилось
+NOTIFICATION_LISTENER_PING_TIMEOUT = 10  # секунд на проверку соединения LISTEN
 
 
 async def send_notification_to_user(user_id: int, notification: Dict[str, Any]) -> bool:
@@ -114,7 +120,7 @@ async def send_pending_notifications():
             return
         
         # Получаем количество пользователей для планирования
-        total_users = await get_users_count(active_only=False)
+        total_users = (await user_stats.snapshot())["total"]
         
         if total_users == 0:
             logger.info("Нет пользователей для рассылки уведомлений")
@@ -247,28 +253,95 @@ async def send_pending_notifications_old():
         logger.error(f"Ошибка при отправке уведомлений: {e}")
 
 
-async def notification_scheduler():
-    """Планировщик для регулярной проверки и отправки уведомлений."""
-    while True:
+class NotificationScheduler:
+    """
+    Планировщик рассылок без периодического опроса БД.
+
+    Спит до scheduled_at ближайшего уведомления и просыпается раньше, если создано
+    новое: через wake() в этом процессе или по NOTIFY из create_notification
+    (в том числе от других инстансов). Без уведомлений проверяет БД и соединение
+    LISTEN не чаще раза в NOTIFICATION_FALLBACK_POLL — на случай потерянного NOTIFY
+    или зависшего сокета. Наступившее, но не отправленное уведомление повторяется
+    с экспоненциальной задержкой.
+    """
+
+    def __init__(self):
+        self._wakeup: Optional[asyncio.Event] = None
+        self._listener = None
+
+    def wake(self):
+        """Будит планировщик: появились новые уведомления."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.wake()
+
+    def _on_listener_lost(self, connection):
+        logger.warning("Соединение LISTEN планировщика уведомлений потеряно")
+        self._listener = None
+        self.wake()
+
+    async def _ensure_listener(self) -> bool:
+        if self._listener is not None and not self._listener.is_closed():
+            try:
+                # Полуоткрытый сокет не вызывает termination listener — проверяем запросом
+                await asyncio.wait_for(self._listener.execute("SELECT 1;"), NOTIFICATION_LISTENER_PING_TIMEOUT)
+                return True
+            except Exception as e:
+                logger.warning(f"Соединение LISTEN планировщика уведомлений не отвечает, переподключаемся: {e}")
+                self._listener.remove_termination_listener(self._on_listener_lost)
+                self._listener.terminate()
+                self._listener = None
         try:
-            # Отправляем ожидающие уведомления
-            await send_pending_notifications()
-            
-            # Проверяем, есть ли запланированные уведомления в ближайшие 5 минут
-            next_check_time = await get_next_notification_time()
-            
-            if next_check_time:
-                # Если есть уведомления в ближайшие 5 минут, проверяем каждую минуту
-                await asyncio.sleep(60)
-            else:
-                # Если нет запланированных уведомлений, проверяем каждые 5 минут
-                await asyncio.sleep(300)
-                
+            self._listener = await open_listener(NOTIFICATIONS_CHANNEL, self._on_notify)
+            self._listener.add_termination_listener(self._on_listener_lost)
+            return True
         except Exception as e:
-            logger.error(f"Ошибка в планировщике уведомлений: {e}")
-            await asyncio.sleep(60)  # При ошибке проверяем каждую минуту
+            logger.error(f"Не удалось подписаться на {NOTIFICATIONS_CHANNEL}: {e}")
+            self._listener = None
+            return False
+
+    async def run(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        retry = NOTIFICATION_RETRY_INITIAL
+        try:
+            while True:
+                # Сбрасываем сигнал до запросов: уведомление, созданное во время рассылки, не потеряется
+                self._wakeup.clear()
+                await self._ensure_listener()
+                await send_pending_notifications()
+                next_at = await get_next_notification_time()
+
+                timeout = NOTIFICATION_FALLBACK_POLL
+                until_next = (next_at - datetime.now(timezone.utc)).total_seconds() if next_at else None
+                if until_next is not None and until_next <= 0:
+                    # Уведомление наступило, но осталось неотправленным — повторяем с растущей задержкой
+                    timeout = retry
+                    retry = min(retry * 2, NOTIFICATION_FALLBACK_POLL)
+                else:
+                    retry = NOTIFICATION_RETRY_INITIAL
+                    if until_next is not None:
+                        timeout = min(timeout, until_next)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self._listener is not None and not self._listener.is_closed():
+                await self._listener.close()
+            self._listener = None
+
+
+notification_scheduler = NotificationScheduler()
+
+
+def wake_notification_scheduler():
+    """Сообщает планировщику о новом уведомлении в этом процессе."""
+    notification_scheduler.wake()
 
 
 def start_notification_scheduler():
-    """Запускает планировщик уведомлений в отдельной задаче."""
-    asyncio.create_task(notification_scheduler())
\ No newline at end of file
+    """Запускает планировщик уведомлений под надзором супервизора."""
+    supervisor.run_forever("notifications", notification_scheduler.run)
@@ -1,6 +1,22 @@
 from yookassa import Configuration, Payment
+import asyncio
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
 import config
+from config import logger
+from utils.database import db
+from utils.singleflight import single_flight
+from utils.ttl_cache import TTLCache
+
+PAYMENT_WORKERS = 8          # потоков для запросов к ЮKassa: SDK синхронный и не должен блокировать цикл событий
+PAYMENT_TIMEOUT = 15         # секунд на один запрос к ЮKassa
+PAYMENT_SLOW_SECONDS = 3     # запросы дольше пишутся в лог
+PENDING_STATUS_TTL = 5       # секунд; столько незавершённый статус отдаётся без запроса к ЮKassa
+STATUS_CACHE_MAX_SIZE = 50000
+PAYMENT_REUSE_SECONDS = 30 * 60  # столько незавершённый платёж за тот же товар переиспользуется
 
 # Configuration.account_id = "1025133"
 # Configuration.secret_key = config.PAYMENT_SECRET_KEY
@@ -8,12 +24,81 @@ import config
 
 Configuration.account_id = "1029197"
 Configuration.secret_key = config.PAYMENT_SECRET_KEY_LIVE
+# По умолчанию SDK ждёт ответа до 30 минут и повторяет запрос трижды
+Configuration.timeout = PAYMENT_TIMEOUT
+Configuration.max_attempts = 1
+
+# Отдельный ограниченный пул: медленный провайдер не занимает общий executor
+_executor = ThreadPoolExecutor(max_workers=PAYMENT_WORKERS, thread_name_prefix="yookassa")
+
+
+class PaymentGatewayError(Exception):
+    """Запрос к платёжному провайдеру не выполнен (ошибка или таймаут)."""
+
+
+class PaymentMetrics:
+    """Счётчики запросов к ЮKassa по операциям."""
+
+    def __init__(self):
+        self.operations: Dict[str, dict] = {}
+
+    def record(self, operation: str, seconds: float, error: Optional[str] = None):
+        entry = self.operations.setdefault(
+            operation, {"calls": 0, "errors": 0, "timeouts": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        )
+        entry["calls"] += 1
+        entry["total_seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+        if error == "timeout":
+            entry["timeouts"] += 1
+        elif error:
+            entry["errors"] += 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        result = {}
+        for operation, entry in self.operations.items():
+            calls = entry["calls"] or 1
+            result[operation] = {
+                **entry,
+                "total_seconds": round(entry["total_seconds"], 3),
+                "max_seconds": round(entry["max_seconds"], 3),
+                "avg_seconds": round(entry["total_seconds"] / calls, 3),
+            }
+        return result
+
+
+payment_metrics = PaymentMetrics()
+
+# Статусы платежей: конечные хранятся бессрочно (до вытеснения), незавершённые — несколько секунд
+_status_cache = TTLCache(max_size=STATUS_CACHE_MAX_SIZE, ttl=PENDING_STATUS_TTL)
 
 
-async def create_payment(user_id, value, description: str = "Оплата за открытку без водяного знака"):
-    idempotence_key = str(uuid.uuid4())
+async def _call(operation: str, func, *args):
+    """Выполняет синхронный вызов SDK в пуле потоков с таймаутом и учётом метрик."""
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    try:
+        result = await asyncio.wait_for(
+            loop.run_in_executor(_executor, func, *args), timeout=PAYMENT_TIMEOUT + 1
+        )
+    except asyncio.TimeoutError as e:
+        payment_metrics.record(operation, time.monotonic() - start, "timeout")
+        raise PaymentGatewayError(f"{operation}: таймаут запроса к ЮKassa") from e
+    except Exception as e:
+        payment_metrics.record(operation, time.monotonic() - start, str(e))
+        raise PaymentGatewayError(f"{operation}: {e}") from e
+    elapsed = time.monotonic() - start
+    payment_metrics.record(operation, elapsed)
+    if elapsed > PAYMENT_SLOW_SECONDS:
+        logger.warning(f"Медленный запрос к ЮKassa {operation}: {elapsed:.1f} с")
+    return result
 
-    payment = Payment.create({
+
+async def create_payment(user_id, value, description: str = "Оплата за открытку без водяного знака",
+                         idempotence_key: Optional[str] = None):
+    idempotence_key = idempotence_key or str(uuid.uuid4())
+
+    payment = await _call("create", Payment.create, {
         "amount": {
             "value": value,
             "currency": "RUB"
@@ -57,11 +142,71 @@ async def create_payment(user_id, value, description: str = "Оплата за 
             confirmation_url = payment.get('confirmation', {}).get('confirmation_url')
             payment_id = payment.get('id')
 
-    print("link:", confirmation_url)
+    logger.info(f"Создан платёж {payment_id} пользователя {user_id}")
+    if payment_id:
+        await db.save_payment(payment_id, user_id, value, description)
+        _status_cache.set(payment_id, 'pending')
     # Возвращаем URL для подтверждения платежа
     return confirmation_url, payment_id
 
 
-async def check_payment_status(payment_id):
-    payment = Payment.find_one(payment_id)
+async def get_or_create_payment(user_id: int, product: str, value, description: str):
+    """
+    Ссылка на оплату товара product: создаётся при первом нажатии «Оплатить»,
+    повторные нажатия возвращают тот же незавершённый платёж.
+
+    Ключ идемпотентности сохраняется в БД до запроса к ЮKassa, поэтому повтор после
+    сбоя или двойное нажатие не создают второй платёж.
+    """
+    intent = await db.reserve_payment_intent(
+        user_id, product, value, description, str(uuid.uuid4()), PAYMENT_REUSE_SECONDS
+    )
+    if intent["payment_id"] and intent["confirmation_url"]:
+        return intent["confirmation_url"], intent["payment_id"]
+    url, payment_id = await create_payment(user_id, value, description, idempotence_key=intent["idempotence_key"])
+    if url and payment_id:
+        await db.attach_payment_to_intent(user_id, product, intent["idempotence_key"], payment_id, url)
+    return url, payment_id
+
+
+async def remember_payment_status(payment_id: str, status: str) -> bool:
+    """Сохраняет статус в БД и кэше. Возвращает True, если статус изменился."""
+    ttl = float("inf") if status in db.PAYMENT_TERMINAL_STATUSES else PENDING_STATUS_TTL
+    _status_cache.set(payment_id, status, ttl=ttl)
+    return await db.update_payment_status(payment_id, status)
+
+
+async def refresh_payment_status(payment_id: str) -> Optional[str]:
+    """Запрашивает статус у ЮKassa и сохраняет его. None — провайдер не ответил."""
+    try:
+        payment = await _call("find_one", Payment.find_one, payment_id)
+    except PaymentGatewayError as e:
+        logger.error(f"Не удалось проверить платёж {payment_id}: {e}")
+        return None
+    await remember_payment_status(payment_id, payment.status)
     return payment.status
+
+
+# Повторные нажатия «Проверить оплату» во время запроса ждут один и тот же ответ
+@single_flight('payment_status', per_user=False)
+async def check_payment_status(payment_id) -> Optional[str]:
+    """
+    Статус платежа или None, если провайдер не ответил (пользователь может проверить ещё раз).
+
+    Порядок: кэш в памяти → таблица payments (конечный статус, в том числе из вебхука) → ЮKassa.
+    """
+    if not payment_id:
+        return None
+    status = _status_cache.get(payment_id)
+    if status is not None:
+        return status
+    status = await db.get_payment_status(payment_id)
+    if status in db.PAYMENT_TERMINAL_STATUSES:
+        _status_cache.set(payment_id, status, ttl=float("inf"))
+        return status
+    return await refresh_payment_status(payment_id)
+
+
+def get_payment_metrics() -> Dict[str, dict]:
+    """Метрики запросов к ЮKassa (вызовы, ошибки, таймауты, время ответа) и кэша статусов."""
+    return {**payment_metrics.snapshot(), "status_cache": _status_cache.stats()}
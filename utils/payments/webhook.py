@@ -0,0 +1,63 @@
+from typing import Optional
+
+from aiohttp import web
+
+from config import PAYMENT_WEBHOOK_HOST, PAYMENT_WEBHOOK_PATH, PAYMENT_WEBHOOK_PORT, logger
+from utils.payments.payment_functional import refresh_payment_status
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def handle_notification(request: web.Request) -> web.Response:
+    """
+    Принимает HTTP-уведомление ЮKassa (payment.succeeded, payment.canceled и т.п.).
+
+    Содержимому уведомления не доверяем: статус подтверждается одним запросом к ЮKassa
+    и записывается в таблицу payments, откуда его берут проверки оплаты в хендлерах.
+    """
+    try:
+        body = await request.json()
+    except Exception:
+        return web.Response(status=400)
+
+    # Тело приходит из сети: проверяем типы до обращения к полям
+    if not isinstance(body, dict):
+        return web.Response(status=400)
+    event = body.get("event")
+    obj = body.get("object")
+    if not isinstance(event, str) or not isinstance(obj, dict):
+        return web.Response(status=400)
+    payment_id = obj.get("id")
+    if payment_id is not None and not isinstance(payment_id, str):
+        return web.Response(status=400)
+    if not payment_id or not event.startswith("payment."):
+        # Неинтересные события подтверждаем, чтобы ЮKassa не присылала их повторно
+        return web.Response(status=200)
+
+    status = await refresh_payment_status(payment_id)
+    if status is None:
+        # ЮKassa повторит уведомление позже
+        return web.Response(status=503)
+    logger.info(f"Вебхук ЮKassa: платёж {payment_id} — {status}")
+    return web.Response(status=200)
+
+
+async def start_payment_webhook():
+    """Запускает приёмник уведомлений ЮKassa, если задан PAYMENT_WEBHOOK_PORT."""
+    global _runner
+    if not PAYMENT_WEBHOOK_PORT or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_post(PAYMENT_WEBHOOK_PATH, handle_notification)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, PAYMENT_WEBHOOK_HOST, PAYMENT_WEBHOOK_PORT).start()
+    logger.info(f"Приёмник уведомлений ЮKassa слушает {PAYMENT_WEBHOOK_HOST}:{PAYMENT_WEBHOOK_PORT}{PAYMENT_WEBHOOK_PATH}")
+
+
+async def stop_payment_webhook():
+    """Останавливает приёмник уведомлений."""
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
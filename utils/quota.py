@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+from utils.database import db
+from utils.ttl_cache import TTLCache
+
+FREE_LETTERS_PER_MONTH = 1
+EXHAUSTED_SHADOW_TTL = 60  # секунд; сколько помним, что квота исчерпана, не спрашивая БД
+EXHAUSTED_SHADOW_MAX_SIZE = 10000
+
+
+class QuotaService:
+    """
+    Бесплатные квоты: сообщения психолога и письма в будущее.
+
+    Списание — один условный UPSERT ... RETURNING: проверка и увеличение счётчика
+    атомарны, поэтому параллельные запросы не могут списать больше лимита.
+    В памяти хранится только «тень» исчерпанных квот: повторные попытки пользователя
+    без подписки отклоняются без обращения к БД.
+    """
+
+    def __init__(self):
+        self._exhausted = TTLCache(max_size=EXHAUSTED_SHADOW_MAX_SIZE, ttl=EXHAUSTED_SHADOW_TTL)
+
+    async def consume_free_message(self, user_id: int, limit: int) -> bool:
+        """Списывает бесплатное сообщение психолога. False — лимит исчерпан."""
+        key = ("psychologist", user_id)
+        if key in self._exhausted:
+            return False
+        used = await db.consume_free_message(user_id, limit)
+        if used is None or used >= limit:
+            # Следующая попытка точно не пройдёт
+            self._exhausted.set(key, True)
+        return used is not None
+
+    async def refund_free_message(self, user_id: int):
+        """Возвращает списанное сообщение психолога."""
+        await db.refund_free_message(user_id)
+        self._exhausted.pop(("psychologist", user_id))
+
+    async def create_free_letter(self, user_id: int, content: str, send_after: datetime) -> Optional[int]:
+        """Сохраняет бесплатное письмо, если квота месяца не исчерпана. Возвращает id письма или None."""
+        month = datetime.now(timezone.utc).strftime("%Y-%m")
+        key = ("letter", user_id, month)
+        if key in self._exhausted:
+            return None
+        letter_id = await db.insert_free_letter_if_available(user_id, content, send_after, FREE_LETTERS_PER_MONTH)
+        if letter_id is None or FREE_LETTERS_PER_MONTH <= 1:
+            self._exhausted.set(key, True)
+        return letter_id
+
+    def forget(self, user_id: int):
+        """Сбрасывает тень квот пользователя (после сброса счётчика или покупки подписки)."""
+        self._exhausted.pop(("psychologist", user_id))
+        month = datetime.now(timezone.utc).strftime("%Y-%m")
+        self._exhausted.pop(("letter", user_id, month))
+
+
+quota = QuotaService()
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+# Этапы запуска
+STAGE_DB = "db"                  # пул, схема и миграции готовы
+STAGE_RESOURCES = "resources"    # папка resources синхронизирована с Dropbox
+
+RESOURCES_LOADING_TEXT = (
+    "⏳ Каталог открыток загружается после обновления бота. "
+    "Пожалуйста, попробуйте через минуту."
+)
+
+
+class Readiness:
+    """
+    Готовность подсистем после запуска.
+
+    Бот начинает принимать апдейты, как только готова БД; остальные этапы
+    (синхронизация ресурсов) завершаются в фоне. Компоненты проверяют этап
+    через is_ready() или дожидаются его через wait().
+    """
+
+    def __init__(self):
+        self._events: Dict[str, asyncio.Event] = {}
+        self._ready_at: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._started_at = time.monotonic()
+        # Локальная копия ресурсов с прошлого запуска: её можно отдавать, пока идёт синхронизация
+        self.resources_snapshot = False
+
+    def _event(self, stage: str) -> asyncio.Event:
+        event = self._events.get(stage)
+        if event is None:
+            event = self._events[stage] = asyncio.Event()
+        return event
+
+    def mark_ready(self, stage: str):
+        self._errors.pop(stage, None)
+        self._ready_at[stage] = time.monotonic() - self._started_at
+        self._event(stage).set()
+
+    def mark_failed(self, stage: str, error: str):
+        self._errors[stage] = error
+
+    def is_ready(self, stage: str) -> bool:
+        return stage in self._ready_at
+
+    async def wait(self, stage: str, timeout: Optional[float] = None) -> bool:
+        """Ждёт готовности этапа. False — не дождались за timeout."""
+        if self.is_ready(stage):
+            return True
+        try:
+            await asyncio.wait_for(self._event(stage).wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def resources_available(self) -> bool:
+        """Можно ли работать с файлами resources: синхронизация завершена или есть прошлая копия."""
+        return self.resources_snapshot or self.is_ready(STAGE_RESOURCES)
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": {stage: round(seconds, 2) for stage, seconds in self._ready_at.items()},
+            "errors": dict(self._errors),
+            "resources_snapshot": self.resources_snapshot,
+        }
+
+
+readiness = Readiness()
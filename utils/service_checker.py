@@ -1,5 +1,15 @@
 from utils.database.db import is_service_active, get_service_status
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from utils.readiness import readiness, RESOURCES_LOADING_TEXT
+
+# Сервисы, которым нужны файлы из папки resources (картинки, фоны, шрифты)
+RESOURCE_SERVICES = {"create_card", "shop"}
+
+
+def _main_menu_kb() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🏠 Вернуться в главное меню", callback_data="start")]
+    ])
 
 async def check_service_availability(service_name: str) -> tuple[bool, str, InlineKeyboardMarkup]:
     """
@@ -8,6 +18,10 @@ async def check_service_availability(service_name: str) -> tuple[bool, str, Inli
     Returns:
         tuple: (is_available, message, keyboard)
     """
+    if service_name in RESOURCE_SERVICES and not readiness.resources_available():
+        # Первый запуск без локальной копии: ресурсы ещё скачиваются
+        return False, RESOURCES_LOADING_TEXT, _main_menu_kb()
+
     is_active = await is_service_active(service_name)
     
     if is_active:
@@ -22,8 +36,6 @@ async def check_service_availability(service_name: str) -> tuple[bool, str, Inli
         maintenance_message = "Сервис временно недоступен. Приносим извинения за неудобства."
     
     # Создаем клавиатуру для возврата в главное меню
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏠 Вернуться в главное меню", callback_data="start")]
-    ])
+    keyboard = _main_menu_kb()
     
     return False, maintenance_message, keyboard 
\ No newline at end of file
@@ -0,0 +1,91 @@
+import asyncio
+import functools
+import json
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+# Пользователь текущего апдейта; выставляется middleware и используется в ключе запросов
+current_user_id: ContextVar[Optional[int]] = ContextVar("current_user_id", default=None)
+
+
+def _normalize(value: Any) -> Any:
+    """Приводит аргументы к каноничному виду: регистр и лишние пробелы в строках не важны."""
+    if isinstance(value, str):
+        return " ".join(value.split()).lower()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    return value
+
+
+def make_key(*args, **kwargs) -> str:
+    """Строит хешируемый ключ из нормализованных аргументов вызова."""
+    return json.dumps([_normalize(list(args)), _normalize(kwargs)], sort_keys=True, ensure_ascii=False, default=str)
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые вызовы: пока запрос с ключом key выполняется,
+    повторные вызовы с тем же ключом ждут его результата вместо нового запроса.
+    Сам запрос выполняется отдельной задачей, поэтому отмена одного из ожидающих
+    (например, пользователь ушёл из меню) не отменяет его для остальных.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+            return await asyncio.shield(task)
+
+        self.calls += 1
+        task = asyncio.ensure_future(func())
+        self._inflight[key] = task
+        task.add_done_callback(functools.partial(self._forget, key))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Забираем исключение, чтобы оно не логировалось как необработанное, если все ожидающие отменены
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._inflight), "calls": self.calls, "shared": self.shared}
+
+
+_group = SingleFlight()
+
+
+def single_flight(task_name: str, group: Optional[SingleFlight] = None, per_user: bool = True):
+    """
+    Декоратор для корутин: одновременные вызовы с одинаковыми (пользователь, задача,
+    нормализованные аргументы) разделяют один запрос к внешнему сервису.
+    При per_user=True вне апдейта пользователя (фоновые задачи, супервизор)
+    пользователь неизвестен, и вызов выполняется без объединения.
+    """
+    flight = group or _group
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            user_id = current_user_id.get() if per_user else None
+            if per_user and user_id is None:
+                # Общий «ничей» ключ смешал бы ответы разных пользователей
+                return await func(*args, **kwargs)
+            key = (user_id, task_name, make_key(*args, **kwargs))
+            return await flight.do(key, lambda: func(*args, **kwargs))
+        return wrapper
+
+    return decorator
+
+
+def get_single_flight_stats() -> Dict[str, int]:
+    """Статистика объединения запросов (выполнено / разделено с уже идущими)."""
+    return _group.stats()
@@ -1,18 +1,44 @@
 import asyncio
+import os
 
 from aiogram import Bot
 from aiogram.types import BotCommand, BotCommandScopeAllPrivateChats, MenuButtonCommands, BotCommandScopeChat
 
 from config import ADMIN_IDS, logger
-from handlers.branches.future_letter import setup_future_letter_scheduler
-from utils.database.dropbox_storage import sync_resources_hash
+from utils.letter_delivery import start_letter_delivery
+from utils.database.dropbox_storage import SYNC_MANIFEST_PATH, sync_resources_hash
 from utils.notification_sender import start_notification_scheduler
+from utils.user_stats import start_user_stats_reconciler
+from utils.database.retention import start_retention_scheduler
+from utils.database.catalogue import catalogue
 from utils.database.db import init_db, init_connection_pool
+from utils.database.migrations import run_migrations
+from utils.payments.webhook import start_payment_webhook
+from utils.readiness import readiness, STAGE_DB, STAGE_RESOURCES
+from utils.task_supervisor import supervisor
 
 
-def sync_resources():
+async def sync_resources():
+    """
+    Фоновая синхронизация resources после запуска. Пока она идёт, бот отвечает
+    по прошлой локальной копии (если она есть), а функции открыток сообщают о загрузке каталога.
+    Ошибка пробрасывается супервизору, который повторяет синхронизацию с растущей задержкой.
+    """
     logger.info('🔄 Синхронизируем папку resources с Dropbox...')
-    sync_resources_hash()
+    try:
+        stats = await asyncio.to_thread(sync_resources_hash)
+        if stats['error']:
+            raise RuntimeError(f"Dropbox недоступен: {stats['error']}")
+    except Exception as e:
+        readiness.mark_failed(STAGE_RESOURCES, f"{type(e).__name__}: {e}")
+        raise
+    # Файлы ресурсов обновились — каталог шрифтов и цветов перечитается при следующем обращении
+    catalogue.invalidate()
+    readiness.mark_ready(STAGE_RESOURCES)
+    logger.info(f"🚀 Папка resources синхронизирована: {stats}")
+    if stats['failed']:
+        # Каталог доступен, но часть файлов не скачалась — следующая попытка докачает их
+        raise RuntimeError(f"не скачано файлов: {stats['failed']}")
 
 async def on_startup(bot: Bot, activity_middleware=None):
     # Инициализируем пул соединений для оптимизации производительности
@@ -22,19 +48,28 @@ async def on_startup(bot: Bot, activity_middleware=None):
     # Инициализируем базу данных
     await init_db()
     logger.info("🚀 Инициализация базы данных...")
-    
-    # Запускаем синхронизацию в отдельном потоке, чтобы не блокировать event loop
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, sync_resources)
-    setup_future_letter_scheduler(bot)
+
+    # Применяем миграции схемы (индексы и новые колонки) до запуска фоновых задач
+    applied = await run_migrations()
+    logger.info(f"🚀 Миграции схемы применены: {applied}")
+    readiness.mark_ready(STAGE_DB)
+
+    # Ресурсы синхронизируются в фоне: polling начинается сразу после готовности БД.
+    # Манифест прошлой синхронизации означает, что локальная копия целая и её можно отдавать.
+    readiness.resources_snapshot = os.path.exists(SYNC_MANIFEST_PATH)
+    supervisor.run_until_success("resources_sync", sync_resources)
+    start_letter_delivery(bot)
     start_notification_scheduler()
+    start_user_stats_reconciler()
+    start_retention_scheduler()
+    await start_payment_webhook()
     
     # Запускаем фоновый процессор активности, если передан
     if activity_middleware:
         await activity_middleware.start_background_processor()
         logger.info("Фоновый процессор активности запущен!")
     
-    logger.info("Письма в будущее перезаписаны!")
+    logger.info("Доставщик писем в будущее запущен!")
     logger.info("Планировщик уведомлений запущен!") 
 
     default_commands = [
@@ -46,6 +81,8 @@ async def on_startup(bot: Bot, activity_middleware=None):
 
     admin_commands = default_commands + [
         BotCommand(command="admin", description="Меню админа"),
+        BotCommand(command="dbstats", description="Статистика запросов к БД"),
+        BotCommand(command="tasks", description="Фоновые задачи"),
     ]
 
     for admin_id in ADMIN_IDS:
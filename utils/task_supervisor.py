@@ -0,0 +1,199 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import logger
+
+LOOP_BACKOFF_INITIAL = 1     # секунд до первого перезапуска упавшего цикла
+LOOP_BACKOFF_MAX = 300       # потолок задержки перезапуска
+LOOP_HEALTHY_AFTER = 60      # цикл, проработавший дольше, перезапускается без накопленной задержки
+SHUTDOWN_DRAIN_TIMEOUT = 10  # секунд на завершение фоновых задач при остановке
+
+
+class _Loop:
+    """Бесконечный фоновый цикл под надзором."""
+
+    def __init__(self, name: str, factory: Callable[[], Awaitable[Any]], until_success: bool = False):
+        self.name = name
+        self.factory = factory
+        self.until_success = until_success  # успешное завершение не перезапускается
+        self.task: Optional[asyncio.Task] = None
+        self.started_at: Optional[float] = None
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+
+
+class _TaskClass:
+    """Класс разовых фоновых задач с ограничением параллельности и очереди."""
+
+    def __init__(self, name: str, max_concurrency: int, max_pending: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.tasks: set = set()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.total_runtime = 0.0
+        self.max_runtime = 0.0
+
+
+class TaskSupervisor:
+    """
+    Единая точка запуска фоновой работы.
+
+    - run_forever() — периодические циклы (планировщики, сверки): упавший цикл
+      перезапускается с экспоненциальной задержкой, ошибка попадает в лог и статистику.
+    - run_until_success() — разовая работа с теми же повторами до первого успешного завершения.
+    - spawn() — разовые задачи из обработчиков: не более max_concurrency одновременно
+      в классе, не более max_pending ожидающих; сверх лимита задача не принимается
+      (spawn возвращает None), и вызывающий код сам решает, выполнить ли её синхронно.
+    - shutdown() — останавливает циклы и даёт разовым задачам завершиться.
+    """
+
+    def __init__(self):
+        self._loops: Dict[str, _Loop] = {}
+        self._classes: Dict[str, _TaskClass] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._closing = False
+
+    def register_class(self, name: str, max_concurrency: int, max_pending: int = 1000):
+        """Объявляет класс разовых задач с его лимитами."""
+        if name not in self._classes:
+            self._classes[name] = _TaskClass(name, max_concurrency, max_pending)
+
+    def register_queue(self, name: str, queue: asyncio.Queue):
+        """Добавляет очередь в статистику (размер очереди виден в stats())."""
+        self._queues[name] = queue
+
+    def run_forever(self, name: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Запускает цикл factory() под надзором (повторный вызов с тем же именем ничего не делает)."""
+        loop = self._loops.get(name)
+        if loop is not None and loop.task is not None and not loop.task.done():
+            return loop.task
+        loop = self._loops[name] = _Loop(name, factory)
+        loop.task = asyncio.create_task(self._supervise(loop), name=f"loop:{name}")
+        return loop.task
+
+    def run_until_success(self, name: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Выполняет factory() под надзором, повторяя с экспоненциальной задержкой, пока не завершится без ошибки."""
+        loop = self._loops.get(name)
+        if loop is not None and loop.task is not None and not loop.task.done():
+            return loop.task
+        loop = self._loops[name] = _Loop(name, factory, until_success=True)
+        loop.task = asyncio.create_task(self._supervise(loop), name=f"loop:{name}")
+        return loop.task
+
+    async def _supervise(self, loop: _Loop):
+        backoff = LOOP_BACKOFF_INITIAL
+        while not self._closing:
+            loop.started_at = time.monotonic()
+            try:
+                await loop.factory()
+                if loop.until_success:
+                    loop.last_error = None
+                    return
+                loop.last_error = "цикл завершился"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                loop.last_error = f"{type(e).__name__}: {e}"
+            if self._closing:
+                return
+            if time.monotonic() - loop.started_at > LOOP_HEALTHY_AFTER:
+                backoff = LOOP_BACKOFF_INITIAL
+            loop.restarts += 1
+            logger.error(f"Фоновый цикл {loop.name} остановился ({loop.last_error}), перезапуск через {backoff} с")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, LOOP_BACKOFF_MAX)
+
+    def spawn(self, class_name: str, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Optional[asyncio.Task]:
+        """
+        Запускает func(*args, **kwargs) в фоне в рамках класса class_name.
+        Возвращает None, если бот останавливается или очередь класса переполнена.
+        """
+        task_class = self._classes.get(class_name)
+        if task_class is None:
+            self.register_class(class_name, max_concurrency=10)
+            task_class = self._classes[class_name]
+        if self._closing or len(task_class.tasks) >= task_class.max_pending:
+            task_class.dropped += 1
+            return None
+        task = asyncio.create_task(self._run_one(task_class, func, args, kwargs), name=f"{class_name}")
+        task_class.tasks.add(task)
+        task.add_done_callback(task_class.tasks.discard)
+        return task
+
+    async def _run_one(self, task_class: _TaskClass, func, args, kwargs):
+        if task_class.semaphore is None:
+            task_class.semaphore = asyncio.Semaphore(task_class.max_concurrency)
+        async with task_class.semaphore:
+            task_class.running += 1
+            start = time.monotonic()
+            try:
+                await func(*args, **kwargs)
+                task_class.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                task_class.failed += 1
+                logger.error(f"Ошибка фоновой задачи {task_class.name}: {type(e).__name__}: {e}")
+            finally:
+                elapsed = time.monotonic() - start
+                task_class.running -= 1
+                task_class.total_runtime += elapsed
+                task_class.max_runtime = max(task_class.max_runtime, elapsed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние циклов, классов задач и очередей."""
+        now = time.monotonic()
+        return {
+            "loops": {
+                name: {
+                    "alive": loop.task is not None and not loop.task.done(),
+                    "finished": loop.until_success and loop.task is not None and loop.task.done()
+                                and loop.last_error is None,
+                    "uptime": round(now - loop.started_at, 1) if loop.started_at else 0.0,
+                    "restarts": loop.restarts,
+                    "last_error": loop.last_error,
+                }
+                for name, loop in self._loops.items()
+            },
+            "classes": {
+                name: {
+                    "running": c.running,
+                    "pending": len(c.tasks) - c.running,
+                    "completed": c.completed,
+                    "failed": c.failed,
+                    "dropped": c.dropped,
+                    "avg_runtime": round(c.total_runtime / max(c.completed + c.failed, 1), 3),
+                    "max_runtime": round(c.max_runtime, 3),
+                }
+                for name, c in self._classes.items()
+            },
+            "queues": {name: queue.qsize() for name, queue in self._queues.items()},
+        }
+
+    async def shutdown(self, timeout: float = SHUTDOWN_DRAIN_TIMEOUT):
+        """Останавливает циклы и ждёт завершения разовых задач (не дольше timeout)."""
+        self._closing = True
+        loop_tasks = [loop.task for loop in self._loops.values() if loop.task is not None and not loop.task.done()]
+        for task in loop_tasks:
+            task.cancel()
+        await asyncio.gather(*loop_tasks, return_exceptions=True)
+
+        pending = [task for c in self._classes.values() for task in c.tasks]
+        if not pending:
+            return
+        logger.info(f"Ожидаем завершения фоновых задач: {len(pending)}")
+        done, not_done = await asyncio.wait(pending, timeout=timeout)
+        for task in not_done:
+            task.cancel()
+        if not_done:
+            logger.warning(f"Отменены незавершённые фоновые задачи: {len(not_done)}")
+            await asyncio.gather(*not_done, return_exceptions=True)
+
+
+supervisor = TaskSupervisor()
@@ -0,0 +1,112 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Ограниченный по размеру LRU-кэш с временем жизни записей.
+
+    - При превышении max_size вытесняется давно не использованная запись.
+    - Записи старше ttl считаются отсутствующими и удаляются при обращении.
+    - Ключи можно объединять в группы (например, по user_id), чтобы
+      инвалидировать все записи группы без просмотра всего кэша.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any, Optional[Hashable]]]" = OrderedDict()
+        self._groups: Dict[Hashable, Set[Hashable]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None, *, count: bool = True) -> Any:
+        """Возвращает значение по ключу или default, если записи нет или она устарела."""
+        entry = self._data.get(key)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return default
+        expires_at, value, group = entry
+        if expires_at <= time.monotonic():
+            self._remove(key, group)
+            self.expirations += 1
+            if count:
+                self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        if count:
+            self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, *, group: Optional[Hashable] = None, ttl: Optional[float] = None):
+        """Сохраняет значение; group позволяет позже инвалидировать запись через invalidate_group."""
+        old = self._data.pop(key, None)
+        if old is not None and old[2] != group:
+            self._discard_from_group(key, old[2])
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value, group)
+        if group is not None:
+            self._groups.setdefault(group, set()).add(key)
+        while len(self._data) > self.max_size:
+            old_key, (_, _, old_group) = self._data.popitem(last=False)
+            self._discard_from_group(old_key, old_group)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Удаляет запись и возвращает её значение."""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        self._remove(key, entry[2])
+        return entry[1]
+
+    def invalidate_group(self, group: Hashable) -> int:
+        """Удаляет все записи группы. Возвращает количество удалённых записей."""
+        keys = self._groups.pop(group, None)
+        if not keys:
+            return 0
+        for key in keys:
+            self._data.pop(key, None)
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+        self._groups.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика использования кэша."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: Hashable, group: Optional[Hashable]):
+        self._data.pop(key, None)
+        self._discard_from_group(key, group)
+
+    def _discard_from_group(self, key: Hashable, group: Optional[Hashable]):
+        if group is None:
+            return
+        keys = self._groups.get(group)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._groups[group]
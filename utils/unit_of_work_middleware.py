@@ -0,0 +1,34 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, CallbackQuery
+
+from utils.database.unit_of_work import UnitOfWork
+
+# Флаг обработчика, включающий единицу работы: @router.message(..., flags={UNIT_OF_WORK_FLAG: True})
+UNIT_OF_WORK_FLAG = "unit_of_work"
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    Открывает единицу работы на время обработки апдейта и передаёт её в обработчик
+    аргументом uow. Все запросы db.* обработчика идут через одно соединение из пула.
+
+    Включается только для обработчиков с флагом UNIT_OF_WORK_FLAG: соединение держится
+    до конца обработчика, поэтому такие обработчики сами возвращают его через uow.release()
+    перед долгими внешними вызовами (модель, платёжный сервис). Остальные обработчики
+    берут соединение из пула на каждый запрос.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message | CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not get_flag(data, UNIT_OF_WORK_FLAG):
+            return await handler(event, data)
+        async with UnitOfWork() as uow:
+            data["uow"] = uow
+            return await handler(event, data)
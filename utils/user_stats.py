@@ -0,0 +1,83 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from config import logger
+from utils.database.db import fetch_user_stats
+from utils.task_supervisor import supervisor
+
+RECONCILE_INTERVAL = 600  # секунд между сверками счётчиков с БД
+
+
+class UserStats:
+    """
+    Счётчики пользователей (всего / активных за 30 дней / новых за сегодня) в памяти.
+
+    Счётчики увеличиваются по результатам пакетного обновления активности
+    (batch_update_user_activity из ActivityMiddleware), а периодическая сверка
+    одним запросом к users исправляет накопившееся расхождение:
+    пользователей, выпавших из 30-дневного окна, гонки между инстансами и т.п.
+    Между сверками число активных может быть немного завышено.
+    """
+
+    def __init__(self, reconcile_interval: float = RECONCILE_INTERVAL):
+        self.reconcile_interval = reconcile_interval
+        self.total = 0
+        self.active = 0
+        self.new_today = 0
+        self._day = None
+        self._reconciled_at: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def apply(self, inserted: int, reactivated: int):
+        """Учитывает новых пользователей и вернувшихся в активные."""
+        self._roll_day()
+        self.total += inserted
+        self.active += inserted + reactivated
+        self.new_today += inserted
+
+    async def reconcile(self):
+        """Пересчитывает счётчики по таблице users."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            stats = await fetch_user_stats()
+            self.total = stats["total"]
+            self.active = stats["active"]
+            self.new_today = stats["new_today"]
+            self._day = stats["day"]
+            self._reconciled_at = time.monotonic()
+
+    async def snapshot(self) -> dict:
+        """Текущие счётчики; сверяет их с БД, если сверки ещё не было или она устарела."""
+        if self._reconciled_at is None or time.monotonic() - self._reconciled_at > self.reconcile_interval:
+            await self.reconcile()
+        self._roll_day()
+        return {"total": self.total, "active": self.active, "new_today": self.new_today}
+
+    def _roll_day(self):
+        today = datetime.now(timezone.utc).date()
+        if self._day != today:
+            self._day = today
+            self.new_today = 0
+
+    async def _reconcile_loop(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Ошибка сверки статистики пользователей: {e}")
+            await asyncio.sleep(self.reconcile_interval)
+
+    def start(self):
+        """Запускает периодическую сверку в фоне под надзором супервизора."""
+        supervisor.run_forever("user_stats", self._reconcile_loop)
+
+
+user_stats = UserStats()
+
+
+def start_user_stats_reconciler():
+    """Запускает периодическую сверку статистики пользователей."""
+    user_stats.start()